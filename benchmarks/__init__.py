@@ -0,0 +1,10 @@
+"""
+Performance benchmarks for hl7_transform.
+
+Run from the repository root, e.g.::
+
+    python -m benchmarks.pipeline
+    python -m benchmarks.pipeline --save
+    python -m benchmarks.startup
+    python -m benchmarks.dates
+"""
@@ -0,0 +1,61 @@
+"""
+Benchmarks the HL7 date and time parser of :mod:`hl7_transform.dtm` against
+:func:`datetime.strptime`, for values of several precisions, with and without
+the cache of parsed values, and the formatter against :meth:`datetime.strftime`.
+
+Usage::
+
+    python -m benchmarks.dates            # compare with benchmarks/baseline_dates.json
+    python -m benchmarks.dates --save     # store a new baseline
+"""
+import argparse
+import os
+import sys
+from datetime import datetime, timedelta
+from hl7_transform.dtm import HL7DateTime, parse_dtm
+from hl7_transform.operations import SetEndTime
+from benchmarks.utils import measure, main, add_arguments
+
+
+BASELINE = os.path.join(os.path.dirname(__file__), 'baseline_dates.json')
+
+# the values of every precision, with the strptime format that parses them
+VALUES = [
+    ('date', '20200520', '%Y%m%d'),
+    ('minute', '202005201615', '%Y%m%d%H%M'),
+    ('second', '20200520161530', '%Y%m%d%H%M%S'),
+    ('fraction offset', '20200520161530.1234+0200', '%Y%m%d%H%M%S.%f%z'),
+]
+
+
+def strptime_end_time(dt_str, duration_str):
+    """
+    The implementation of :meth:`SetEndTime.end_time` with strptime, for comparison.
+    """
+    dt_format = ('%Y%m%d%H%M', '%Y%m%d%H%M%S')[len(dt_str) > 12]
+    return (datetime.strptime(dt_str, dt_format) + timedelta(minutes=int(duration_str))).strftime(dt_format)
+
+
+def benchmark(args):
+    results = []
+    parse_uncached = parse_dtm.__wrapped__
+    for name, txt, dt_format in VALUES:
+        results.append(measure('strptime {}'.format(name), lambda: datetime.strptime(txt, dt_format), args.min_time))
+        results.append(measure('parse_dtm {}'.format(name), lambda: parse_uncached(txt), args.min_time))
+        results.append(measure('parse_dtm cached {}'.format(name), lambda: HL7DateTime.from_string(txt), args.min_time))
+        value = datetime.strptime(txt, dt_format)
+        dt = HL7DateTime.from_string(txt)
+        results.append(measure('strftime {}'.format(name), lambda: value.strftime(dt_format), args.min_time))
+        results.append(measure('to_string {}'.format(name), dt.to_string, args.min_time))
+    for name, txt in (('minute', '202005201615'), ('second', '20200520161530')):
+        results.append(measure('set_end_time strptime {}'.format(name), lambda: strptime_end_time(txt, '50'), args.min_time))
+        results.append(measure('set_end_time {}'.format(name), lambda: SetEndTime.end_time(txt, '50'), args.min_time))
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    add_arguments(parser)
+    parser.add_argument('--min-time', type=float, default=0.2,
+            help='minimal duration in seconds of one timing run')
+    sys.exit(main(benchmark, BASELINE, parser.parse_args()))
@@ -0,0 +1,97 @@
+"""
+Benchmarks the stages of the transformation pipeline separately on synthetic
+messages of growing size: parsing, every operation type, the full transform
+and serialization.
+
+Usage::
+
+    python -m benchmarks.pipeline            # compare with benchmarks/baseline_pipeline.json
+    python -m benchmarks.pipeline --save     # store a new baseline
+"""
+import argparse
+import os
+import sys
+from hl7_transform.field import HL7Field
+from hl7_transform.mapping import HL7Mapping
+from hl7_transform.message import HL7Message, PARSERS
+from hl7_transform.operations import HL7Operation
+from hl7_transform.transform import HL7Transform
+from benchmarks.utils import measure, main, add_arguments
+
+
+BASELINE = os.path.join(os.path.dirname(__file__), 'baseline_pipeline.json')
+OBX_COUNTS = (1, 50, 500)
+
+OPERATIONS = [
+    ('copy_value', ['PID.3.1'], {}),
+    ('add_values', ['OBR.1', 'PID.8'], {'type': 'int'}),
+    ('set_value', [], {'value': 'X'}),
+    ('concatenate_values', ['PID.5.1', 'PID.5.2'], {'separator': ' '}),
+    ('generate_alphanumeric_id', [], {}),
+    ('generate_numeric_id', [], {}),
+    ('generate_current_datetime', [], {}),
+    ('set_end_time', ['OBR.7', 'PID.8'], {}),
+]
+
+MAPPING = '''[
+  {"target_field": "MSH.10",  "operation": "generate_alphanumeric_id"},
+  {"target_field": "PV1.19",  "operation": "copy_value",         "source_field": "PID.3.1"},
+  {"target_field": "PV1.20",  "operation": "add_values",         "source_fields": ["OBR.1", "PID.8"], "args": {"type": "int"}},
+  {"target_field": "PID.5.3", "operation": "set_value",          "args": {"value": "X"}},
+  {"target_field": "PV1.21",  "operation": "concatenate_values", "source_fields": ["PID.5.1", "PID.5.2"], "args": {"separator": " "}},
+  {"target_field": "OBR.8",   "operation": "set_end_time",       "source_fields": ["OBR.7", "PID.8"]},
+  {"target_field": "ZBE.1.1", "operation": "generate_numeric_id"},
+  {"target_field": "ZBE.2",   "operation": "generate_current_datetime"}
+]'''
+
+
+def make_message(obx_count):
+    """
+    Creates a synthetic ORU^R01 message with 4 + `obx_count` segments.
+    """
+    segments = [
+        'MSH|^~\\&|LAB|HOSP|EHR|HOSP|20200522153917||ORU^R01|MSG00001|P|2.5.1',
+        'PID|1||19619205^^^Doctolib^PI||Test^Otto^^^^^L||19900101|30|||Wilhelmstrasse 118^^Berlin^^11111',
+        'PV1|1|O|WARD^101^1',
+        'OBR|1|845439^GHH OE|1045813^GHH LAB|1554-5^GLUCOSE|||202005221530',
+    ]
+    for index in range(1, obx_count + 1):
+        segments.append('OBX|{}|NM|1554-5^GLUCOSE^LN||{}|mg/dl|70-105|N|||F'.format(index, 80 + index % 40))
+    return '\n'.join(segments)
+
+
+def benchmark(args):
+    results = []
+    mapping = HL7Mapping.from_string(MAPPING)
+    transform = HL7Transform(mapping)
+    for obx_count in args.sizes:
+        txt = make_message(obx_count)
+        size = '[{} segments]'.format(4 + obx_count)
+        for parser in args.parsers:
+            message = HL7Message.from_string(txt, parser)
+            results.append(measure('parse {} {}'.format(parser, size),
+                                   lambda: HL7Message.from_string(txt, parser), args.min_time))
+            for name, source_fields, op_args in OPERATIONS:
+                operation = HL7Operation.from_name(name, source_fields, dict(op_args))
+                results.append(measure('{} {} {}'.format(name, parser, size),
+                                       lambda: operation(message), args.min_time))
+            setter = HL7Field('OBX.5')
+            results.append(measure('set field {} {}'.format(parser, size),
+                                   lambda: message.__setitem__(setter, '100'), args.min_time))
+            transform(message)
+            results.append(measure('transform {} {}'.format(parser, size),
+                                   lambda: transform(message), args.min_time))
+            results.append(measure('serialize {} {}'.format(parser, size),
+                                   message.to_string, args.min_time))
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    add_arguments(parser)
+    parser.add_argument('--sizes', type=int, nargs='+', default=OBX_COUNTS,
+            help='numbers of OBX segments of the synthetic messages')
+    parser.add_argument('--parsers', nargs='+', default=PARSERS, choices=PARSERS)
+    parser.add_argument('--min-time', type=float, default=0.2,
+            help='minimal duration in seconds of one timing run')
+    sys.exit(main(benchmark, BASELINE, parser.parse_args()))
@@ -0,0 +1,150 @@
+"""
+Benchmarks the start-up cost of hl7_transform: the time and memory of importing
+its modules in a fresh interpreter, the latency of the first hl7apy message
+with and without preloading, and the latency of single CLI calls,
+with and without a transform daemon.
+
+Usage::
+
+    python -m benchmarks.startup            # compare with benchmarks/baseline_startup.json
+    python -m benchmarks.startup --save     # store a new baseline
+"""
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+from time import perf_counter
+from hl7_transform.daemon import HL7TransformDaemon
+from benchmarks.utils import Result, main, add_arguments
+
+
+BASELINE = os.path.join(os.path.dirname(__file__), 'baseline_startup.json')
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MAPPING = os.path.join(ROOT, 'hl7_transform', 'test', 'test_transform.json')
+MESSAGE = os.path.join(ROOT, 'hl7_transform', 'test', 'test_msg.hl7')
+
+MODULES = [
+    'hl7_transform',
+    'hl7_transform.__main__',
+    'hl7_transform.client',
+    'hl7_transform.message',
+    'hl7_transform.mapping',
+    'hl7_transform.transform',
+    'hl7apy.parser',
+]
+
+# Imports a module in a fresh interpreter and prints its import time,
+# or the peak memory allocated by the import, which slows the import down.
+IMPORT_SCRIPT = '''
+import sys, tracemalloc
+from time import perf_counter
+if sys.argv[2] == 'memory':
+    tracemalloc.start()
+start = perf_counter()
+__import__(sys.argv[1])
+seconds = perf_counter() - start
+print(tracemalloc.get_traced_memory()[1] if sys.argv[2] == 'memory' else seconds)
+'''
+
+# Parses a message with hl7apy in a fresh interpreter after importing the modules,
+# optionally preloading all HL7 versions first, and prints the time of the preload,
+# of the first and of the second message.
+FIRST_MESSAGE_SCRIPT = '''
+import sys
+from time import perf_counter
+from hl7_transform.message import HL7Message, preload_hl7apy
+import hl7apy.parser
+with open(sys.argv[1]) as f:
+    txt = f.read().strip()
+start = perf_counter()
+if sys.argv[2] == 'preload':
+    preload_hl7apy()
+times = [perf_counter() - start]
+for _ in range(2):
+    start = perf_counter()
+    HL7Message.from_string(txt)
+    times.append(perf_counter() - start)
+print(*times)
+'''
+
+
+def run(command):
+    return subprocess.run(command, cwd=ROOT, check=True, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL).stdout
+
+
+def measure_import(module, repeat):
+    """
+    :return: A :class:`Result` of the fastest of `repeat` imports of a module.
+    """
+    seconds = min(float(run([sys.executable, '-c', IMPORT_SCRIPT, module, 'time'])) for _ in range(repeat))
+    peak = int(run([sys.executable, '-c', IMPORT_SCRIPT, module, 'memory']))
+    return Result('import {}'.format(module), 1. / seconds, peak / 1024.)
+
+
+def measure_first_message(repeat):
+    """
+    :return: :class:`Result` objects of the fastest of `repeat` runs of the first and
+        the second message in a fresh interpreter, without and with preloading, and of the preload.
+        Memory is not measured.
+    """
+    results = []
+    for mode in ('cold', 'preload'):
+        runs = [[float(t) for t in run([sys.executable, '-c', FIRST_MESSAGE_SCRIPT, MESSAGE, mode]).split()]
+                for _ in range(repeat)]
+        preload, first, second = (min(times) for times in zip(*runs))
+        if mode == 'preload':
+            results.append(Result('preload all versions', 1. / preload, 0.))
+        results.append(Result('first message {}'.format(mode), 1. / first, 0.))
+        results.append(Result('second message {}'.format(mode), 1. / second, 0.))
+    return results
+
+
+def measure_command(name, arguments, repeat):
+    """
+    :return: A :class:`Result` of the fastest of `repeat` runs of the CLI.
+        Memory is not measured.
+    """
+    command = [sys.executable, '-m', 'hl7_transform'] + arguments
+    run(command)
+    best = None
+    for _ in range(repeat):
+        start = perf_counter()
+        run(command)
+        seconds = perf_counter() - start
+        best = seconds if best is None else min(best, seconds)
+    return Result(name, 1. / best, 0.)
+
+
+def benchmark(args):
+    # the first run may compile the modules
+    run([sys.executable, '-c', 'import hl7_transform.__main__, hl7apy.parser'])
+    results = [measure_import(module, args.repeat) for module in MODULES]
+    results.extend(measure_first_message(args.repeat))
+    results.append(measure_command('cli --help', ['--help'], args.repeat))
+    for parser in ('hl7apy', 'native'):
+        results.append(measure_command('cli transform {}'.format(parser),
+                                       [MAPPING, '-m', MESSAGE, '--parser', parser], args.repeat))
+    with tempfile.TemporaryDirectory() as directory:
+        daemon = HL7TransformDaemon(os.path.join(directory, 'daemon.sock'), preload=[MAPPING])
+        thread = threading.Thread(target=daemon.serve_forever)
+        thread.start()
+        try:
+            for parser in ('hl7apy', 'native'):
+                results.append(measure_command('cli transform {} --connect'.format(parser),
+                                               [MAPPING, '-m', MESSAGE, '--parser', parser,
+                                                '--connect', daemon.server_address], args.repeat))
+        finally:
+            daemon.shutdown()
+            thread.join()
+            daemon.server_close()
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    add_arguments(parser)
+    parser.add_argument('--repeat', type=int, default=10,
+            help='number of runs of every measurement, the fastest is reported (default: 10)')
+    sys.exit(main(benchmark, BASELINE, parser.parse_args()))
@@ -0,0 +1,98 @@
+"""
+Helper functions to time benchmark stages and compare them with a stored baseline.
+"""
+import json
+import os
+import timeit
+import tracemalloc
+
+
+class Result:
+    """
+    Throughput and memory of one benchmark stage.
+    """
+    def __init__(self, name, ops_per_sec, peak_kib):
+        self.name = name
+        self.ops_per_sec = ops_per_sec
+        self.peak_kib = peak_kib
+
+    def to_dict(self):
+        return {'ops_per_sec': self.ops_per_sec, 'peak_kib': self.peak_kib}
+
+
+def measure(name, func, min_time=0.2, repeat=3):
+    """
+    Measures throughput (best of `repeat` runs of at least `min_time` seconds)
+    and peak memory allocated by a single call of `func`.
+    """
+    timer = timeit.Timer(func)
+    number, _ = timer.autorange()
+    number = max(1, int(number * min_time / 0.2))
+    best = min(timer.repeat(repeat, number)) / number
+    tracemalloc.start()
+    func()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return Result(name, 1. / best, peak / 1024.)
+
+
+def load_baseline(path):
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+
+def save_baseline(path, results):
+    with open(path, 'w') as f:
+        json.dump({result.name: result.to_dict() for result in results}, f, indent=2, sort_keys=True)
+        f.write('\n')
+
+
+def compare(results, baseline, threshold=0.5):
+    """
+    Prints a report of the results and flags regressions: stages that are
+    slower or allocate more memory than the baseline by more than `threshold`.
+
+    :return: A list of names of regressed stages.
+    """
+    regressions = []
+    print('{:<48} {:>12} {:>12} {:>10} {:>10}'.format('stage', 'ops/s', 'baseline', 'peak KiB', 'baseline'))
+    for result in results:
+        base = baseline.get(result.name)
+        flag = ''
+        if base is not None:
+            if result.ops_per_sec < base['ops_per_sec'] * (1 - threshold) or result.peak_kib > base['peak_kib'] * (1 + threshold):
+                regressions.append(result.name)
+                flag = '  REGRESSION'
+        print('{:<48} {:>12.1f} {:>12} {:>10.1f} {:>10}{}'.format(
+            result.name, result.ops_per_sec,
+            '-' if base is None else '{:.1f}'.format(base['ops_per_sec']),
+            result.peak_kib,
+            '-' if base is None else '{:.1f}'.format(base['peak_kib']),
+            flag))
+    return regressions
+
+
+def main(benchmark, baseline_path, args):
+    """
+    Runs a benchmark function returning a list of :class:`Result`,
+    compares against or saves the baseline and returns the exit code.
+    """
+    results = benchmark(args)
+    if args.save:
+        save_baseline(baseline_path, results)
+        print('Saved baseline to {}'.format(baseline_path))
+        return 0
+    regressions = compare(results, load_baseline(baseline_path), args.threshold)
+    if regressions:
+        print('{} stage(s) regressed: {}'.format(len(regressions), ', '.join(regressions)))
+        return 1
+    return 0
+
+
+def add_arguments(parser):
+    parser.add_argument('--save', action='store_true',
+            help='store the results as the new baseline instead of comparing')
+    parser.add_argument('--threshold', type=float, default=0.5,
+            help='relative slowdown or memory growth flagged as regression (default: 0.5)')
@@ -1,4 +1,6 @@
-from hl7apy.exceptions import HL7apyException
-
-
-APIError = HL7apyException
+def __getattr__(name):
+    # hl7apy is imported on first use, so that importing hl7_transform stays fast
+    if name == 'APIError':
+        from hl7apy.exceptions import HL7apyException
+        return HL7apyException
+    raise AttributeError('module {!r} has no attribute {!r}'.format(__name__, name))
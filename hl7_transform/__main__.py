@@ -5,47 +5,342 @@ This package allows transformation of HL7 messages using field mapping.
 :date   26-May-2020
 """
 import argparse
-from hl7_transform.mapping import HL7Mapping
-from hl7_transform.transform import HL7Transform
-from hl7_transform.message import HL7Message
+import sys
+from contextlib import nullcontext
+from hl7_transform.message import PARSERS, HL7_VERSIONS
+
+# The modules of the other modes, and hl7apy, are imported by the functions
+# that use them, so that e.g. --help or the client mode start quickly.
 
 
 def main_cli(args):
-    if args.type == 'json':
-        mapping = HL7Mapping.from_json(args.mappingfile)
-    elif args.type == 'csv':
-        mapping = HL7Mapping.from_csv(args.mappingfile)
+    from hl7_transform.mapping import HL7Mapping
+    from hl7_transform.mapping_cache import load_mapping
+    from hl7_transform.message import HL7Message
+    from hl7_transform.metrics import HL7Metrics
+    from hl7_transform.result_cache import HL7ResultCache
+    from hl7_transform.transform import HL7Transform
+    parser = getattr(args, 'parser', 'hl7apy')
+    if getattr(args, 'batch', None) and getattr(args, 'workers', None):
+        main_parallel(args)
+        return
+    if getattr(args, 'mapping_cache', None):
+        mapping = load_mapping(args.mappingfile, args.type, args.mapping_cache)
     else:
-        raise TypeError('Unsupported mapping file type. Currently supported are: json, csv.')
-    transform = HL7Transform(mapping)
-    if args.message:
-        message = HL7Message.from_file(args.message)
+        mapping = HL7Mapping.from_file(args.mappingfile, args.type)
+    if getattr(args, 'optimize', False):
+        mapping = optimize_mapping(mapping, args.message)
+    metrics = HL7Metrics() if getattr(args, 'metrics', None) else None
+    on_error = getattr(args, 'on_error', 'raise')
+    if getattr(args, 'batch', None) and getattr(args, 'columnar', False):
+        from hl7_transform.columnar import HL7BatchTransform
+        transform = HL7BatchTransform(mapping, metrics, on_error)
     else:
-        message = HL7Message.new()
-    message_transformed = transform(message)
-    if args.out is not None:
-        with open(args.out, 'w') as f_out:
-            f_out.write(message_transformed.to_string())
+        result_cache = HL7ResultCache(args.result_cache) if getattr(args, 'result_cache', None) else None
+        transform = HL7Transform(mapping, metrics, on_error, result_cache=result_cache)
+    if getattr(args, 'listen', None):
+        main_server(transform, args.listen, getattr(args, 'forward', None), parser,
+                    getattr(args, 'preload', None))
+        return
+    if getattr(args, 'batch', None):
+        main_batch(transform, args.batch, args.out, parser, skip_invalid=on_error != 'raise',
+                   batch_size=getattr(args, 'chunk_size', 100))
+    else:
+        measure = metrics.measure if metrics is not None else nullcontext
+        with measure('parse'):
+            if args.message:
+                message = HL7Message.from_file(args.message, parser)
+            else:
+                message = HL7Message.new(parser)
+        message_transformed = transform(message)
+        with measure('serialize'):
+            txt = message_transformed.to_string()
+        write_message(txt, args.out)
+    if metrics is not None:
+        write_metrics(metrics, args.metrics)
+
+
+def write_message(txt, out=None):
+    """
+    Writes a transformed message to a file, or to stdout if `out` is None.
+    """
+    if out is not None:
+        with open(out, 'w') as f_out:
+            f_out.write(txt)
     else:
-        print(message_transformed.to_string())
+        print(txt)
+
+
+def optimize_mapping(mapping, message_path=None):
+    """
+    Removes no-op and dead rules from a mapping and reorders it, reporting
+    the changes on stderr. The segments of the message file, if given,
+    are assumed to be present in all input messages.
+    """
+    from hl7_transform.analysis import HL7MappingAnalysis
+    input_segments = None
+    if message_path is not None:
+        with open(message_path) as f:
+            input_segments = [line[:3] for line in f.read().replace('\r', '\n').splitlines() if line]
+    analysis = HL7MappingAnalysis(mapping, input_segments)
+    print(analysis.report(), file=sys.stderr)
+    return analysis.optimized_mapping()
+
+
+def write_metrics(metrics, path):
+    """
+    Writes metrics to a JSON file if the path ends with .json,
+    in the Prometheus text format otherwise.
+    """
+    import json
+    with open(path, 'w') as f:
+        if path.endswith('.json'):
+            json.dump(metrics.to_dict(), f, indent=2)
+        else:
+            f.write(metrics.to_prometheus())
+
+
+def main_batch(transform, source, out, parser='hl7apy', skip_invalid=False, batch_size=100):
+    """
+    Transforms every message of a batch source using one transform
+    and writes the results incrementally.
+    If the transform has metrics, parsing and serialization are timed as well.
+
+    :param batch_size: Number of messages transformed at once by an :class:`HL7BatchTransform`.
+    """
+    from hl7_transform.batch import write_messages
+    from hl7_transform.columnar import HL7BatchTransform
+    messages = parse_messages(source, parser, transform.metrics, skip_invalid)
+    if isinstance(transform, HL7BatchTransform):
+        messages = transform.stream(messages, batch_size)
+    else:
+        messages = (transform(message) for message in messages)
+    if out is not None:
+        with open(out, 'w') as f_out:
+            write_messages(messages, f_out, transform.metrics)
+    else:
+        write_messages(messages, sys.stdout, transform.metrics)
+
+
+def parse_messages(source, parser, metrics=None, skip_invalid=False):
+    """
+    Parses the messages of a batch source one by one.
+
+    :param skip_invalid: If True, messages that cannot be parsed are logged and skipped.
+    """
+    from hl7_transform import APIError
+    from hl7_transform.batch import read_messages
+    from hl7_transform.message import HL7Message
+    from hl7_transform.transform import logger
+    measure = metrics.measure if metrics is not None else nullcontext
+    for index, txt in enumerate(read_messages(source)):
+        try:
+            with measure('parse'):
+                message = HL7Message.from_string(txt, parser)
+        except APIError as e:
+            if not skip_invalid:
+                raise
+            logger.warning('Message %d skipped, it could not be parsed. Reason: %s', index, e)
+            continue
+        yield message
+
+
+def main_parallel(args):
+    """
+    Transforms every message of a batch source in a pool of worker processes.
+    Failed messages are reported on stderr and skipped, with the log error policy
+    failed rules are skipped and logged.
+    """
+    from hl7_transform.batch import read_messages
+    from hl7_transform.parallel import HL7ParallelTransform
+    from hl7_transform.transform import logger
+    transform = HL7ParallelTransform(args.mappingfile, args.type,
+                                     parser=getattr(args, 'parser', 'hl7apy'),
+                                     workers=args.workers,
+                                     chunk_size=getattr(args, 'chunk_size', 100),
+                                     mapping_cache=getattr(args, 'mapping_cache', None),
+                                     optimize=getattr(args, 'optimize', False),
+                                     ordered=not getattr(args, 'unordered', False),
+                                     preload=getattr(args, 'preload', None),
+                                     on_error='collect' if getattr(args, 'on_error', 'raise') == 'log' else 'raise')
+    f_out = open(args.out, 'w') if args.out is not None else sys.stdout
+    try:
+        for result in transform(read_messages(args.batch)):
+            for warning in result.warnings:
+                logger.warning('%s in message %d', warning, result.index)
+            if result.ok:
+                f_out.write(result.message)
+                f_out.write('\n')
+            else:
+                print('Message {} failed. Reason: {}'.format(result.index, result.error), file=sys.stderr)
+    finally:
+        if f_out is not sys.stdout:
+            f_out.close()
+
+
+def parse_address(address):
+    host, _, port = address.rpartition(':')
+    return host or '127.0.0.1', int(port)
+
+
+def main_server(transform, listen, forward=None, parser='hl7apy', preload=None):
+    """
+    Runs an MLLP server that transforms incoming messages and forwards them.
+    The hl7apy reference structures of the `preload` versions are loaded first.
+    """
+    import asyncio
+    from hl7_transform.message import preload_hl7apy
+    from hl7_transform.mllp import HL7MLLPServer
+    if preload is not None:
+        preload_hl7apy(preload)
+    downstream = parse_address(forward) if forward else None
+    server = HL7MLLPServer(transform, downstream, parser)
+    asyncio.run(server.serve_forever(*parse_address(listen)))
+
+
+def main_client(args):
+    """
+    Sends the message to a running transform daemon and writes the transformed message.
+    Warnings of skipped rules and the report of an optimized mapping are printed on stderr.
+
+    :return: The exit code, 1 if the daemon could not be reached or failed.
+    """
+    from hl7_transform.client import request, DaemonError
+    txt = None
+    if args.message:
+        with open(args.message) as f:
+            txt = f.read().strip()
+    try:
+        response = request(args.connect, args.mappingfile, txt, args.type, args.parser, args.on_error, args.optimize)
+    except (OSError, DaemonError) as e:
+        print('hl7_transform: {}'.format(e), file=sys.stderr)
+        return 1
+    for warning in response['warnings']:
+        print('WARNING hl7_transform.transform: {}'.format(warning), file=sys.stderr)
+    if 'report' in response:
+        print(response['report'], file=sys.stderr)
+    write_message(response['message'], args.out)
+    return 0
+
+
+def main_daemon(args):
+    """
+    Runs a transform daemon on a Unix socket until it is interrupted or terminated.
+    The mapping file, if given, is loaded before the first request.
+    """
+    import signal
+    from hl7_transform.daemon import HL7TransformDaemon
+    from hl7_transform.result_cache import HL7ResultCache
+    preload = [args.mappingfile] if args.mappingfile else []
+    result_cache = HL7ResultCache(args.result_cache) if args.result_cache else None
+    daemon = HL7TransformDaemon(args.daemon, args.mapping_cache, preload=preload, mapping_type=args.type,
+                                result_cache=result_cache,
+                                preload_versions=getattr(args, 'preload', None) or HL7_VERSIONS)
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    try:
+        daemon.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        daemon.server_close()
 
 
 def main():
     parser = argparse.ArgumentParser(
             description="""Transform HL7 messages using a mapping scheme.""")
     parser.add_argument('mappingfile',
-            help='path to file containing field mapping, e.g. mapping.json',
+            help='path to file containing field mapping, e.g. mapping.json. '
+                 'Optional with --daemon, which then loads it on start-up',
+            nargs='?',
             type=str)
     parser.add_argument('-m', '--message',
             help="path to the HL7 message file, e.g. siu_s12_in.hl7")
+    parser.add_argument('-b', '--batch',
+            help="path to a directory or glob pattern of HL7 message files, or - to read "
+                 "a stream of messages (optionally MLLP or FHS/BHS framed) from stdin")
+    parser.add_argument('-j', '--workers',
+            help="transform a batch in parallel using this number of worker processes",
+            type=int)
+    parser.add_argument('--chunk-size',
+            help="number of messages sent to a worker process, or transformed by --columnar, at once (default: 100)",
+            default=100,
+            type=int)
+    parser.add_argument('--unordered',
+            help="with --workers, write messages as soon as they are transformed instead of in input order",
+            action='store_true')
+    parser.add_argument('--columnar',
+            help="with --batch, apply every rule to a chunk of messages at once, "
+                 "which is faster for large batches",
+            action='store_true')
+    parser.add_argument('--listen',
+            help="run an MLLP server on [HOST:]PORT that transforms incoming messages, e.g. 0.0.0.0:2575")
+    parser.add_argument('--forward',
+            help="with --listen, forward transformed messages to the MLLP endpoint at HOST:PORT")
+    parser.add_argument('--metrics',
+            help="record timings and counters per rule, operation and stage, and write them "
+                 "to this file (JSON if the name ends with .json, Prometheus text format otherwise)")
+    parser.add_argument('--on-error',
+            help="raise (default) stops at the first failing rule, log skips failing rules "
+                 "and unparsable batch messages and logs a warning",
+            default='raise',
+            choices=('raise', 'log'))
     parser.add_argument('-o', '--out',
             help="path to the output HL7 message file, e.g. siu_s12_out.hl7")
     parser.add_argument('--type',
             help='mapping file type, can be json (default) or csv',
             default='json',
             type=str)
+    parser.add_argument('--optimize',
+            help="remove mapping rules that do not change the output and reorder the rules, "
+                 "reporting the changes on stderr",
+            action='store_true')
+    parser.add_argument('--mapping-cache',
+            help='directory where parsed mappings are cached between invocations')
+    parser.add_argument('--parser',
+            help='message parser, can be hl7apy (default), native (faster, does not validate messages) '
+                 'or lazy (native, splits segments only when accessed)',
+            default='hl7apy',
+            choices=PARSERS)
+    parser.add_argument('--result-cache',
+            metavar='SIZE',
+            help="keep the transformed messages of up to SIZE distinct input messages in memory, "
+                 "so that messages sent again, e.g. with --listen or --daemon, are not transformed again. "
+                 "Ignored for mappings that generate IDs or timestamps",
+            type=int)
+    parser.add_argument('--daemon',
+            metavar='SOCKET',
+            help="run a daemon on the Unix socket SOCKET that keeps mappings and hl7apy loaded "
+                 "and transforms the messages sent with --connect")
+    parser.add_argument('--connect',
+            metavar='SOCKET',
+            help="send the message to the daemon on the Unix socket SOCKET instead of "
+                 "transforming it in this process")
+    parser.add_argument('--preload',
+            metavar='VERSION',
+            nargs='*',
+            help="with --workers, --listen or --daemon, load the hl7apy reference structures of these HL7 versions, "
+                 "or of all versions {}, before the first message. Forked workers share them with the parent "
+                 "process. --daemon preloads all versions by default".format(' '.join(HL7_VERSIONS)))
 
     args = parser.parse_args()
+    if args.preload == []:
+        args.preload = HL7_VERSIONS
+    elif args.preload and not set(args.preload) <= set(HL7_VERSIONS):
+        parser.error('--preload supports the HL7 versions {}'.format(', '.join(HL7_VERSIONS)))
+    if args.on_error == 'log':
+        import logging
+        logging.basicConfig(format='%(levelname)s %(name)s: %(message)s')
+    if args.daemon:
+        main_daemon(args)
+        return
+    if args.mappingfile is None:
+        parser.error('the following arguments are required: mappingfile')
+    if args.batch and args.workers and (args.metrics or args.result_cache):
+        parser.error('--workers does not support --metrics or --result-cache')
+    if args.connect:
+        if args.batch or args.listen or args.metrics:
+            parser.error('--connect only transforms single messages, it cannot be combined with --batch, --listen or --metrics')
+        sys.exit(main_client(args))
     main_cli(args)
 
 
@@ -0,0 +1,234 @@
+"""
+This file contains a static analysis of mappings, which finds rules that
+do not change the transformed message and computes a rule order that
+needs fewer writes of buffered values during transformation.
+
+The analysis builds a dependency graph between the rules of a mapping from
+the fields every rule reads (its source fields and condition fields, see
+:meth:`HL7Operation.reads`) and the field it writes:
+
+- a rule that reads a field depends on the earlier rules that write into it,
+- a rule that writes a field depends on the earlier rules that read or write it,
+- rules that write into different segments that may have to be created
+  keep their order, so that new segments are appended in the same order.
+
+Example usage::
+
+    analysis = HL7MappingAnalysis(mapping, input_segments=['MSH', 'PID', 'PV1'])
+    print(analysis.report())
+    transform = HL7Transform(analysis.optimized_mapping())
+"""
+from hl7_transform.operations import CopyValue
+from hl7_transform.mapping import HL7Mapping
+
+
+def overlaps(read, write):
+    """
+    Returns True if writing the field `write` can change the value of the
+    field `read`, or whether it can be read at all. Writes pad the segment
+    with the fields, components and sub-components before the written one.
+    Repetitions are not distinguished, since written values may contain repetitions.
+    """
+    if read.segment != write.segment:
+        return False
+    if read.occurrence is not None and read.occurrence != (write.occurrence or 1):
+        return False
+    for read_part, write_part in ((read.field, write.field),
+                                  (read.component, write.component),
+                                  (read.sub_component, write.sub_component)):
+        if read_part == 0 or write_part == 0 or write_part > read_part:
+            return True
+        if write_part < read_part:
+            return False
+    return True
+
+
+def conflicts(write, other):
+    """
+    Returns True if the result of writing the fields `write` and `other`
+    depends on the order of the writes.
+    """
+    if (write.segment, write.occurrence or 1, write.field) != (other.segment, other.occurrence or 1, other.field):
+        return False
+    if write.component == 0 or other.component == 0:
+        return True
+    if write.component != other.component:
+        return False
+    return write.sub_component == 0 or other.sub_component == 0 or write.sub_component == other.sub_component
+
+
+def covers(write, earlier):
+    """
+    Returns True if writing the field `write` overwrites everything written into `earlier`.
+    """
+    if (write.segment, write.occurrence or 1, write.field, write.repetition) != \
+            (earlier.segment, earlier.occurrence or 1, earlier.field, earlier.repetition):
+        return False
+    if write.component == 0:
+        return True
+    return write.component == earlier.component and write.sub_component in (0, earlier.sub_component)
+
+
+class HL7MappingAnalysis:
+    """
+    The dependency graph of the rules of an :class:`HL7Mapping` and the rules
+    that can be removed without changing the transformed messages:
+
+    - no-op rules: copies of a field into itself,
+    - dead writes: rules whose target field is completely overwritten by a
+      later rule that cannot fail, with no rule reading the field in between.
+
+    Removed rules do not report errors any more, e.g. a self-copy of a missing field.
+    Rules are numbered by their position in the flat list of rules, like in :class:`TransformError`.
+    """
+    def __init__(self, mapping, input_segments=None):
+        """
+        :param mapping: The :class:`HL7Mapping` to analyze.
+        :param input_segments: The names of the segments every input message
+            contains. Rules that write into other segments keep their order,
+            and reads of fields in other segments that are not written by an
+            earlier rule are reported in :attr:`unpopulated_reads`.
+            If None, only the MSH segment is known to exist and no reads are reported.
+        """
+        self.steps = [step for rule in mapping for step in rule.items()]
+        self.input_segments = None if input_segments is None else set(input_segments) | {'MSH'}
+        self.reads = [operation.reads() for target_field, operation in self.steps]
+        self.no_ops = [rule for rule in range(len(self.steps)) if self.is_no_op(rule)]
+        self.dead_writes = self.find_dead_writes()
+        self.removed = sorted(set(self.no_ops) | set(self.dead_writes))
+        self.dependencies = self.build_dependencies()
+        self.unpopulated_reads = self.find_unpopulated_reads()
+        self.order = self.optimize_order()
+
+    def is_no_op(self, rule):
+        """
+        Returns True if a rule copies a field into itself. Without segment
+        occurrence, this is only certain for the MSH segment, since other
+        copies may read from a later segment than the one they write into.
+        """
+        target_field, operation = self.steps[rule]
+        if operation.__class__ is not CopyValue or operation.field != target_field:
+            return False
+        return target_field.occurrence is not None or target_field.segment == 'MSH'
+
+    def find_dead_writes(self):
+        """
+        :return: A dictionary of the rules whose writes are overwritten,
+            mapped to the rule that overwrites them.
+        """
+        dead_writes = {}
+        for rule, (target_field, operation) in enumerate(self.steps):
+            if rule in self.no_ops:
+                continue
+            for later in range(rule + 1, len(self.steps)):
+                later_field, later_operation = self.steps[later]
+                if any(overlaps(field, target_field) for field in self.reads[later]):
+                    break
+                if later not in self.no_ops and not self.reads[later] and covers(later_field, target_field):
+                    dead_writes[rule] = later
+                    break
+                if self.may_reorder_segments(later_field, target_field):
+                    # the removed write might have created its segment before this one
+                    break
+        return dead_writes
+
+    def exists(self, field):
+        """
+        Returns True if the segment of a field exists in every input message.
+        """
+        if (field.occurrence or 1) > 1:
+            return False
+        return field.segment == 'MSH' or (self.input_segments is not None and field.segment in self.input_segments)
+
+    def may_reorder_segments(self, field, other):
+        """
+        Returns True if swapping writes into the fields can change the order
+        in which their segments are created.
+        """
+        return field.segment != other.segment and not self.exists(field) and not self.exists(other)
+
+    def build_dependencies(self):
+        """
+        :return: A dictionary of every kept rule to the set of earlier kept rules it depends on.
+        """
+        kept = [rule for rule in range(len(self.steps)) if rule not in self.removed]
+        dependencies = {rule: set() for rule in kept}
+        for position, rule in enumerate(kept):
+            target_field = self.steps[rule][0]
+            for earlier in kept[:position]:
+                earlier_field = self.steps[earlier][0]
+                if any(overlaps(field, earlier_field) for field in self.reads[rule]) or \
+                        any(overlaps(field, target_field) for field in self.reads[earlier]) or \
+                        conflicts(target_field, earlier_field) or \
+                        self.may_reorder_segments(target_field, earlier_field):
+                    dependencies[rule].add(earlier)
+        return dependencies
+
+    def find_unpopulated_reads(self):
+        """
+        :return: A list of (rule, field) tuples of reads from segments that are
+            not in the input messages, of fields that no earlier rule writes into.
+        """
+        if self.input_segments is None:
+            return []
+        unpopulated = []
+        for rule, fields in enumerate(self.reads):
+            for field in fields:
+                if field.segment in self.input_segments:
+                    continue
+                if not any(overlaps(field, self.steps[earlier][0]) for earlier in range(rule)):
+                    unpopulated.append((rule, field))
+        return unpopulated
+
+    def optimize_order(self):
+        """
+        Orders the kept rules so that rules reading from a segment are executed,
+        where possible, before rules writing into it. This reduces the number
+        of times buffered writes are applied before a read, see :class:`HL7TransformPlan`.
+        Among the rules that are ready, the first in mapping order is preferred.
+
+        :return: The list of kept rules, in execution order.
+        """
+        remaining = {rule: set(dependencies) for rule, dependencies in self.dependencies.items()}
+        order = []
+        pending = set()
+        while remaining:
+            ready = [rule for rule in sorted(remaining) if not remaining[rule]]
+            for rule in ready:
+                if not any(field.segment in pending for field in self.reads[rule]):
+                    break
+            else:
+                rule = ready[0]
+                pending = set()
+            pending.add(self.steps[rule][0].segment)
+            order.append(rule)
+            del remaining[rule]
+            for dependencies in remaining.values():
+                dependencies.discard(rule)
+        return order
+
+    def optimized_mapping(self):
+        """
+        Returns the mapping without removed rules, in optimized order.
+        """
+        return HL7Mapping({self.steps[rule][0]: self.steps[rule][1]} for rule in self.order)
+
+    def report(self):
+        """
+        Describes the removed rules, the reads of unpopulated fields and the optimized order.
+        """
+        lines = []
+        for rule in self.no_ops:
+            lines.append('Rule {} ({} {}) removed: copies the field into itself'.format(rule, self.name(rule), self.steps[rule][1]))
+        for rule, later in sorted(self.dead_writes.items()):
+            lines.append('Rule {} ({} {}) removed: overwritten by rule {} ({})'.format(
+                rule, self.name(rule), self.steps[rule][1], later, self.name(later)))
+        for rule, field in self.unpopulated_reads:
+            lines.append('Rule {} ({} {}) reads {}, which is never populated'.format(rule, self.name(rule), self.steps[rule][1], field.name))
+        if self.order != sorted(self.order):
+            lines.append('Optimized rule order: {}'.format(', '.join(str(rule) for rule in self.order)))
+        lines.append('{} of {} rules kept'.format(len(self.order), len(self.steps)))
+        return '\n'.join(lines)
+
+    def name(self, rule):
+        return self.steps[rule][0].name
@@ -0,0 +1,289 @@
+"""
+This file contains functions to read and write batches of HL7 messages.
+
+A batch can be a directory of message files, a glob pattern or a stream
+(e.g. stdin) of messages. Messages in a stream can be separated by MLLP
+framing, by HL7 batch envelopes (FHS/BHS/BTS/FTS) or simply follow each other.
+Large archive files can be scanned without reading them, see :class:`HL7Archive`.
+"""
+import glob
+import heapq
+import mmap
+import os
+import sys
+from hl7_transform.message import HL7Message
+
+
+MLLP_START_BLOCK = '\x0b'
+MLLP_END_BLOCK = '\x1c'
+ENVELOPE_SEGMENTS = ('FHS', 'BHS', 'BTS', 'FTS')
+
+BOUNDARY_TOKENS = tuple(separator + name.encode()
+                        for separator in (b'\r', b'\n')
+                        for name in ('MSH',) + ENVELOPE_SEGMENTS) + (b'\x0b', b'\x1c')
+"""Byte sequences where a message starts or ends: segments MSH and
+FHS/BHS/BTS/FTS at the start of a line, MLLP start and end blocks."""
+
+
+def split_messages(lines):
+    """
+    Splits an iterable of text lines into HL7 messages.
+
+    A new message starts at every MSH segment and at every MLLP start block.
+    A message ends at an MLLP end block. Batch envelope segments are dropped.
+
+    :param lines: An iterable of strings, e.g. an open file.
+    :return: A generator of message strings, segments separated by newlines.
+    """
+    segments = []
+    for line in lines:
+        for segment in line.split('\r'):
+            segment = segment.rstrip('\n')
+            if segment.startswith(MLLP_START_BLOCK):
+                if segments:
+                    yield '\n'.join(segments)
+                    segments = []
+                segment = segment[1:]
+            if MLLP_END_BLOCK in segment:
+                segment = segment[:segment.index(MLLP_END_BLOCK)]
+                if segment:
+                    segments.append(segment)
+                if segments:
+                    yield '\n'.join(segments)
+                    segments = []
+                continue
+            if not segment.strip():
+                continue
+            if segment[:3] in ENVELOPE_SEGMENTS or segment.startswith('MSH'):
+                if segments:
+                    yield '\n'.join(segments)
+                    segments = []
+                if segment[:3] in ENVELOPE_SEGMENTS:
+                    continue
+            segments.append(segment)
+    if segments:
+        yield '\n'.join(segments)
+
+
+def iter_paths(source):
+    """
+    Lists message files of a batch source.
+
+    :param source: A directory or a glob pattern.
+    :return: A sorted list of file paths.
+    """
+    if os.path.isdir(source):
+        paths = (os.path.join(source, name) for name in os.listdir(source))
+    else:
+        paths = glob.glob(source)
+    return sorted(path for path in paths if os.path.isfile(path))
+
+
+def read_messages(source):
+    """
+    Reads HL7 messages from a batch source one by one,
+    without loading the whole batch into memory.
+
+    :param source: A directory, a glob pattern or '-' for stdin.
+    :return: A generator of message strings.
+    """
+    if source == '-':
+        yield from split_messages(sys.stdin)
+        return
+    for path in iter_paths(source):
+        with open(path) as f:
+            yield from split_messages(f)
+
+
+def write_messages(messages, f, metrics=None):
+    """
+    Writes HL7 messages to an open file as they arrive, one after another.
+
+    :param messages: An iterable of :class:`HL7Message`.
+    :param f: A writable text file.
+    :param metrics: An optional :class:`HL7Metrics` that times serialization.
+    :return: The number of written messages.
+    """
+    count = 0
+    for message in messages:
+        if metrics is None:
+            message.write(f)
+        else:
+            with metrics.measure('serialize'):
+                message.write(f)
+        count += 1
+    return count
+
+
+class HL7Archive:
+    """
+    A memory-mapped batch file of HL7 messages.
+
+    Iterating over an archive scans the file for message boundaries and
+    yields an :class:`ArchiveMessage` per message, which only holds
+    its byte offsets. Messages are decoded and parsed only when requested,
+    so scanning uses constant memory regardless of the file size.
+    Boundaries are the same as for :func:`split_messages`.
+
+    Example usage::
+
+        with HL7Archive('archive.hl7') as archive:
+            for entry in archive:
+                if entry.header().split('|')[8].startswith('ORU'):
+                    message = transform(entry.parse('native'))
+    """
+    def __init__(self, path, encoding='utf-8'):
+        """
+        :param path: Path to the archive file.
+        :param encoding: Encoding of the messages.
+        """
+        self.path = path
+        self.encoding = encoding
+        self._file = open(path, 'rb')
+        if os.fstat(self._file.fileno()).st_size == 0:
+            self.mmap = b''
+        else:
+            self.mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+            if hasattr(self.mmap, 'madvise'):
+                self.mmap.madvise(mmap.MADV_SEQUENTIAL)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        """
+        Unmaps the file. Memoryviews returned by :attr:`ArchiveMessage.data`
+        must be released before.
+        """
+        if isinstance(self.mmap, mmap.mmap):
+            self.mmap.close()
+        self._file.close()
+
+    def boundaries(self):
+        """
+        Scans the archive for the tokens of :data:`BOUNDARY_TOKENS`,
+        using one :meth:`mmap.find` per token occurrence.
+
+        :return: A generator of (position, token) tuples in file order.
+        """
+        data = self.mmap
+        if data[:3].decode('ascii', errors='replace') in ENVELOPE_SEGMENTS:
+            yield -1, b'\n' + data[:3]
+        heap = []
+        for token in BOUNDARY_TOKENS:
+            position = data.find(token)
+            if position != -1:
+                heap.append((position, token))
+        heapq.heapify(heap)
+        while heap:
+            position, token = heap[0]
+            next_position = data.find(token, position + 1)
+            if next_position == -1:
+                heapq.heappop(heap)
+            else:
+                heapq.heapreplace(heap, (next_position, token))
+            yield position, token
+
+    def spans(self):
+        """
+        Scans the archive for messages.
+
+        :return: A generator of (start, end) byte offsets of the messages,
+            without framing characters and surrounding whitespace.
+        """
+        data = self.mmap
+        start = 0
+        for position, token in self.boundaries():
+            if len(token) == 1:
+                # MLLP block
+                end, next_start = position, position + 1
+            elif token.endswith(b'MSH'):
+                end = next_start = position + 1
+            else:
+                # skip the envelope segment
+                end = position + 1
+                next_start = len(data)
+                for separator in (b'\r', b'\n'):
+                    segment_end = data.find(separator, end, next_start)
+                    if segment_end != -1:
+                        next_start = segment_end
+            span = self._strip(start, end)
+            if span is not None:
+                yield span
+            start = next_start
+        span = self._strip(start, len(data))
+        if span is not None:
+            yield span
+
+    def _strip(self, start, end):
+        data = self.mmap
+        while start < end and data[start] in b' \t\r\n':
+            start += 1
+        while end > start and data[end - 1] in b' \t\r\n':
+            end -= 1
+        return (start, end) if start < end else None
+
+    def __iter__(self):
+        for start, end in self.spans():
+            yield ArchiveMessage(self, start, end)
+
+
+class ArchiveMessage:
+    """
+    A message of an :class:`HL7Archive`, identified by its byte offsets.
+    """
+    __slots__ = ('archive', 'start', 'end')
+
+    def __init__(self, archive, start, end):
+        self.archive = archive
+        self.start = start
+        self.end = end
+
+    def __len__(self):
+        return self.end - self.start
+
+    def __repr__(self):
+        return '<ArchiveMessage {}:{}>'.format(self.start, self.end)
+
+    @property
+    def data(self):
+        """
+        A memoryview of the message bytes in the mapped file, without copy.
+        """
+        return memoryview(self.archive.mmap)[self.start:self.end]
+
+    def header(self):
+        """
+        Decodes only the first segment of the message, e.g. to select
+        messages by type without parsing them.
+        """
+        data = self.archive.mmap
+        end = self.end
+        for separator in (b'\r', b'\n'):
+            position = data.find(separator, self.start, end)
+            if position != -1:
+                end = position
+        return self._decode(self.start, end)
+
+    def text(self):
+        """
+        Decodes the message.
+        """
+        return self._decode(self.start, self.end)
+
+    def parse(self, parser='hl7apy'):
+        """
+        Decodes and parses the message.
+
+        :param parser: Message parser, see :data:`hl7_transform.message.PARSERS`.
+        :return: An :class:`HL7Message`.
+        """
+        return HL7Message.from_string(self.text(), parser)
+
+    def _decode(self, start, end):
+        with memoryview(self.archive.mmap) as view:
+            with view[start:end] as message:
+                return str(message, self.archive.encoding, errors='replace')
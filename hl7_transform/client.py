@@ -0,0 +1,54 @@
+"""
+This file contains the client of the transform daemon, see :mod:`hl7_transform.daemon`.
+
+The client only depends on the standard library, so that a CLI call in
+client mode (``--connect``) does not pay for importing hl7apy or the mapping
+modules. Requests and responses are JSON objects, one per line.
+"""
+import json
+import os
+import socket
+
+
+class DaemonError(RuntimeError):
+    """
+    Raised when the daemon could not transform a message.
+    """
+
+
+def request(socket_path, mapping_path, message=None, mapping_type='json', parser='hl7apy',
+            on_error='raise', optimize=False, timeout=60):
+    """
+    Sends a message to a transform daemon and waits for the transformed message.
+
+    :param socket_path: Path to the Unix socket of the daemon.
+    :param mapping_path: Path to the mapping file. Relative paths are resolved
+        in the current directory, the daemon reloads the mapping when the file changes.
+    :param message: The message as a string, None to transform a new empty message.
+    :param on_error: raise (default) fails on the first failing rule, log skips
+        failing rules and returns the warnings in the response.
+    :param optimize: If True, the daemon removes rules that do not change the output,
+        see :class:`HL7MappingAnalysis`.
+    :return: The response, a dictionary with the transformed `message`, the
+        `warnings` of skipped rules and, if optimized, the analysis `report`.
+    """
+    payload = {
+        'mapping': os.path.abspath(mapping_path),
+        'type': mapping_type,
+        'parser': parser,
+        'on_error': on_error,
+        'optimize': optimize,
+        'message': message,
+    }
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as connection:
+        connection.settimeout(timeout)
+        connection.connect(socket_path)
+        connection.sendall(json.dumps(payload).encode() + b'\n')
+        with connection.makefile('rb') as f:
+            line = f.readline()
+    if not line:
+        raise DaemonError('The daemon closed the connection without a response')
+    response = json.loads(line)
+    if 'error' in response:
+        raise DaemonError(response['error'])
+    return response
@@ -0,0 +1,277 @@
+"""
+This file contains a columnar transform engine for large batches of messages,
+e.g. for backfills that apply one mapping to an archive.
+
+Instead of executing all rules on one message before the next message,
+every rule is executed once for the whole batch: the values of a source field
+are read from all messages into a column, the operation is evaluated on
+whole columns and the resulting column is written back into the messages.
+
+Example usage::
+
+    transform = HL7BatchTransform(mapping)
+    for message in transform.stream(parse_messages('archive/*.hl7', 'native'), batch_size=1000):
+        out.write(message.to_string())
+"""
+from itertools import islice
+from time import perf_counter
+from hl7_transform.operations import (AddValues, Concatenate, CopyValue, LookupValue, SetEndTime, SetValue,
+                                      AddDuration, SubtractDuration, ConvertTimezone, TruncateDatetime, FormatDatetime, ComputeAge)
+from hl7_transform.conditions import SKIP
+from hl7_transform.transform import HL7Transform, HL7RoutedPlan, TransformError, ERRORS
+
+
+class Column:
+    """
+    The values of one field across a batch of messages.
+
+    Rows that could not be read or computed are listed in `errors`,
+    keyed by row, with the exception that caused the failure.
+    Their value is None.
+    """
+    __slots__ = ('values', 'errors')
+
+    def __init__(self, values, errors=None):
+        self.values = values
+        self.errors = errors if errors is not None else {}
+
+    def __len__(self):
+        return len(self.values)
+
+
+def map_columns(function, columns):
+    """
+    Applies a function to the rows of some columns.
+
+    The function is mapped over the whole columns at once. Rows are only
+    evaluated one by one if a source row failed or the function raises.
+    A row fails with the error of its first failed source column.
+    """
+    errors = {}
+    for column in reversed(columns):
+        errors.update(column.errors)
+    value_lists = [column.values for column in columns]
+    if not errors:
+        try:
+            return Column(list(map(function, *value_lists)))
+        except ERRORS:
+            pass
+    values = []
+    for row, args in enumerate(zip(*value_lists)):
+        if row in errors:
+            values.append(None)
+            continue
+        try:
+            values.append(function(*args))
+        except ERRORS as e:
+            values.append(None)
+            errors[row] = e
+    return Column(values, errors)
+
+
+def copy_value(operation, read, size):
+    return read(operation.field)
+
+
+def set_value(operation, read, size):
+    return Column([operation.value] * size)
+
+
+def add_values(operation, read, size):
+    convert_to_type = operation.convert_to_type
+    return map_columns(lambda *values: str(sum(map(convert_to_type, values))),
+                       [read(field) for field in operation.source_fields])
+
+
+def concatenate(operation, read, size):
+    separator = operation.separator
+    return map_columns(lambda *values: separator.join(values),
+                       [read(field) for field in operation.fields])
+
+
+def set_end_time(operation, read, size):
+    return map_columns(SetEndTime.end_time, [read(operation.dt), read(operation.duration)])
+
+
+def lookup_value(operation, read, size):
+    return map_columns(operation.translate, [read(field) for field in operation.fields])
+
+
+def date_operation(operation, read, size):
+    return map_columns(operation.compute, [read(field) for field in operation.fields])
+
+
+COLUMN_OPERATIONS = {
+    CopyValue:          copy_value,
+    SetValue:           set_value,
+    AddValues:          add_values,
+    Concatenate:        concatenate,
+    SetEndTime:         set_end_time,
+    LookupValue:        lookup_value,
+    AddDuration:        date_operation,
+    SubtractDuration:   date_operation,
+    ConvertTimezone:    date_operation,
+    TruncateDatetime:   date_operation,
+    FormatDatetime:     date_operation,
+    ComputeAge:         date_operation,
+}
+"""Column implementations of operations, keyed by operation class.
+Operations of other classes, including subclasses of these, are evaluated message by message."""
+
+
+class HL7BatchTransform(HL7Transform):
+    """
+    Applies an :class:`HL7Mapping` to a batch of messages rule by rule,
+    evaluating the operations in :data:`COLUMN_OPERATIONS` on whole columns.
+
+    The transformed messages are the same as with :class:`HL7Transform`.
+    Failed rules are handled by the error policy in rule order across the batch,
+    instead of message order. With the raise policy, the messages of a batch
+    are left partially transformed when an error is raised.
+
+    With metrics, every message of a batch counts as a call of each rule,
+    while the transform stage is timed once per batch.
+    """
+    def __call__(self, messages, copy=False):
+        """
+        Applies the transformation to a batch of messages, modifying the messages.
+
+        :param messages: A list of :class:`HL7Message`.
+        :param copy: If True, the input messages are left unchanged and
+            transformed copies are returned.
+        :return: The list of transformed messages.
+        :raises TransformError: If a rule fails and the error policy is raise.
+        """
+        if copy:
+            messages = [message.copy() for message in messages]
+        if self.metrics is not None:
+            with self.metrics.measure('transform'):
+                return self.run(messages)
+        return self.run(messages)
+
+    def run(self, messages):
+        if isinstance(self.plan, HL7RoutedPlan):
+            # every group of messages with the same plan is transformed as one batch
+            batches = {}
+            for message in messages:
+                plan = self.plan.select(message)
+                batches.setdefault(id(plan), (plan, []))[1].append(message)
+            for plan, batch in batches.values():
+                BatchReader(plan, batch).run()
+            return messages
+        return BatchReader(self.plan, messages).run()
+
+    def stream(self, messages, batch_size=1000):
+        """
+        Transforms an iterable of messages in batches of `batch_size` messages.
+
+        :return: A generator of transformed messages, in input order.
+        """
+        messages = iter(messages)
+        while True:
+            batch = list(islice(messages, batch_size))
+            if not batch:
+                return
+            yield from self(batch)
+
+
+class BatchReader:
+    """
+    Executes an :class:`HL7TransformPlan` on a batch of messages. Caches read
+    columns and buffers written columns, like :class:`PlanReader`.
+    """
+    def __init__(self, plan, messages):
+        self.plan = plan
+        self.messages = messages
+        self.columns = {}
+        self.pending = []
+        self.pending_segments = set()
+        self.metrics = plan.metrics
+        self.flush_seconds = 0.
+
+    def run(self):
+        size = len(self.messages)
+        metrics = self.metrics
+        for rule, (target_field, operation) in enumerate(self.plan.steps):
+            if metrics is not None:
+                start = perf_counter()
+                flush_seconds = self.flush_seconds
+            evaluate = COLUMN_OPERATIONS.get(type(operation))
+            if evaluate is None:
+                column = self.evaluate_rows(operation)
+            else:
+                column = evaluate(operation, self.read, size)
+            if metrics is not None:
+                metrics.record_rule(target_field, operation, perf_counter() - start - (self.flush_seconds - flush_seconds),
+                                    error=len(column.errors), calls=size)
+            for row in sorted(column.errors):
+                self.fail(rule, row, column.errors[row])
+            self.pending.append((rule, target_field, column))
+            self.pending_segments.add(target_field.segment)
+        self.flush()
+        return self.messages
+
+    def read(self, field):
+        """
+        Returns the column of a field.
+        """
+        if field.segment in self.pending_segments:
+            self.flush()
+        columns = self.columns.setdefault(field.segment, {})
+        column = columns.get(field.name)
+        if column is None:
+            values = []
+            errors = {}
+            for row, message in enumerate(self.messages):
+                try:
+                    values.append(message[field])
+                except ERRORS as e:
+                    values.append(None)
+                    errors[row] = e
+            column = columns[field.name] = Column(values, errors)
+        return column
+
+    def evaluate_rows(self, operation):
+        """
+        Evaluates an operation without column implementation message by message.
+        """
+        self.flush()
+        values = []
+        errors = {}
+        for row, message in enumerate(self.messages):
+            try:
+                values.append(operation(message))
+            except ERRORS as e:
+                values.append(None)
+                errors[row] = e
+        return Column(values, errors)
+
+    def flush(self):
+        """
+        Writes the pending columns into the messages, in rule order.
+        """
+        pending, self.pending = self.pending, []
+        for segment in self.pending_segments:
+            self.columns.pop(segment, None)
+        self.pending_segments = set()
+        messages = self.messages
+        metrics = self.metrics
+        for rule, field, column in pending:
+            if metrics is not None:
+                start = perf_counter()
+            errors = column.errors
+            for row, value in enumerate(column.values):
+                if row in errors or value is SKIP:
+                    continue
+                try:
+                    messages[row][field] = value
+                except ERRORS as e:
+                    self.fail(rule, row, e)
+            if metrics is not None:
+                seconds = perf_counter() - start
+                metrics.record_write(field, seconds)
+                self.flush_seconds += seconds
+
+    def fail(self, rule, row, reason):
+        target_field, operation = self.plan.steps[rule]
+        self.plan.on_error(TransformError(self.plan.rules[rule], target_field, operation, reason, self.messages[row]))
@@ -0,0 +1,264 @@
+"""
+This file contains conditions that restrict mapping rules to some messages.
+
+A rule with a ``when`` condition is only applied to messages that fulfil
+the condition, its operation is not evaluated for other messages::
+
+    [
+        {
+            "target_field": "SCH.9",
+            "operation": "set_end_time",
+            "source_fields": ["SCH.11.4", "SCH.11.3"],
+            "when": {"field": "MSH.9.1", "equals": "SIU"}
+        }
+    ]
+
+Rules can also be grouped under one condition::
+
+    [
+        {
+            "when": {"field": "MSH.9.1", "equals": ["ADT", "ORM"]},
+            "rules": [
+                {"target_field": "PV1.2", "operation": "set_value", "args": {"value": "I"}},
+                {"target_field": "PV1.3", "operation": "copy_value", "source_field": "PID.18",
+                 "when": {"field": "PID.18", "present": true}}
+            ]
+        }
+    ]
+
+Supported conditions are:
+
+- ``{"field": F, "equals": V}``: the value of F is V, or one of the values if V is a list,
+- ``{"field": F, "matches": R}``: the value of F contains a match of the regular expression R,
+- ``{"field": F, "present": true}``: F has a non-empty value (``false`` negates the condition),
+- a list of conditions, which must all be fulfilled.
+"""
+import re
+from abc import ABC, abstractmethod
+from hl7_transform.field import HL7Field
+from hl7_transform.operations import HL7Operation
+
+
+SKIP = object()
+"""Returned by :class:`Conditional` for messages that do not fulfil its condition."""
+
+
+class HL7Condition(ABC):
+    """
+    A condition interface, all conditions must derive from this class.
+    """
+    @abstractmethod
+    def __call__(self, message):
+        """
+        :return: True if the message fulfils the condition.
+        """
+        raise NotImplementedError()
+
+    def restrict(self, field, value):
+        """
+        Simplifies the condition for messages whose `field` has the given value.
+
+        :param value: The value of `field`, or None for messages whose value
+            is not compared with by any :class:`Equals` condition on `field`.
+        :return: True or False if the value decides the condition,
+            otherwise the condition that remains to be evaluated.
+        """
+        return self
+
+    def fields(self):
+        """
+        Returns the list of fields the condition reads from a message.
+        """
+        return [self.field]
+
+    def equals_fields(self):
+        """
+        Returns the fields of the :class:`Equals` conditions this condition requires.
+        """
+        return []
+
+    def compared_values(self, field):
+        """
+        Returns the set of values the :class:`Equals` conditions on `field` compare with.
+        """
+        return frozenset()
+
+    @staticmethod
+    def from_dict(dct):
+        """
+        Creates a condition from its mapping representation, see above.
+        """
+        if isinstance(dct, list):
+            return AllOf([HL7Condition.from_dict(item) for item in dct])
+        field = HL7Field(dct['field'])
+        if 'equals' in dct:
+            return Equals(field, dct['equals'])
+        if 'matches' in dct:
+            return Matches(field, dct['matches'])
+        if 'present' in dct:
+            return Present(field, dct['present'])
+        raise KeyError('{} is not a valid condition. Conditions need one of: equals, matches, present'.format(dct))
+
+
+def read(message, field):
+    try:
+        return message[field]
+    except KeyError:
+        return None
+
+
+class Equals(HL7Condition):
+    """
+    The value of a field is one of the given values.
+    Numbers are compared as strings, e.g. 1 equals the field value ``1``.
+    """
+    def __init__(self, field, values):
+        """
+        :param field: An :class:`HL7Field`.
+        :param values: A value or a list of values, strings or numbers.
+        :raises ValueError: If a value is not a string or a number.
+        """
+        self.field = field
+        if not isinstance(values, (list, tuple, set, frozenset)):
+            values = [values]
+        for value in values:
+            if isinstance(value, bool) or not isinstance(value, (str, int, float)):
+                raise ValueError('{!r} cannot be compared with field {}, values of equals must be strings or numbers'.format(
+                    value, field.name))
+        self.values = frozenset(str(value) for value in values)
+
+    def __call__(self, message):
+        return read(message, self.field) in self.values
+
+    def restrict(self, field, value):
+        if field == self.field:
+            return value in self.values
+        return self
+
+    def equals_fields(self):
+        return [self.field]
+
+    def compared_values(self, field):
+        return self.values if field == self.field else frozenset()
+
+    def __str__(self):
+        return '{} in {}'.format(self.field.name, sorted(self.values))
+
+
+class Matches(HL7Condition):
+    """
+    The value of a field contains a match of a regular expression.
+    """
+    def __init__(self, field, pattern):
+        self.field = field
+        self.pattern = re.compile(pattern)
+
+    def __call__(self, message):
+        value = read(message, self.field)
+        return value is not None and self.pattern.search(value) is not None
+
+    def restrict(self, field, value):
+        if field == self.field and value is not None:
+            return self.pattern.search(value) is not None
+        return self
+
+    def __str__(self):
+        return '{} matches {}'.format(self.field.name, self.pattern.pattern)
+
+
+class Present(HL7Condition):
+    """
+    A field has a non-empty value, or has none if `expected` is False.
+    """
+    def __init__(self, field, expected=True):
+        self.field = field
+        if isinstance(expected, str):
+            # from a CSV file
+            expected = expected.lower() not in ('', '0', 'false', 'no')
+        self.expected = bool(expected)
+
+    def __call__(self, message):
+        return bool(read(message, self.field)) == self.expected
+
+    def restrict(self, field, value):
+        if field == self.field and value is not None:
+            return bool(value) == self.expected
+        return self
+
+    def __str__(self):
+        return '{} {}'.format(self.field.name, 'present' if self.expected else 'absent')
+
+
+class AllOf(HL7Condition):
+    """
+    All of a list of conditions are fulfilled. Evaluation stops at the first
+    condition that is not fulfilled.
+    """
+    def __init__(self, conditions):
+        self.conditions = conditions
+
+    def __call__(self, message):
+        for condition in self.conditions:
+            if not condition(message):
+                return False
+        return True
+
+    def restrict(self, field, value):
+        remaining = []
+        for condition in self.conditions:
+            condition = condition.restrict(field, value)
+            if condition is False:
+                return False
+            if condition is not True:
+                remaining.append(condition)
+        if not remaining:
+            return True
+        return remaining[0] if len(remaining) == 1 else AllOf(remaining)
+
+    def fields(self):
+        return [field for condition in self.conditions for field in condition.fields()]
+
+    def equals_fields(self):
+        return [field for condition in self.conditions for field in condition.equals_fields()]
+
+    def compared_values(self, field):
+        return frozenset().union(*(condition.compared_values(field) for condition in self.conditions))
+
+    def __str__(self):
+        return ' and '.join(str(condition) for condition in self.conditions)
+
+
+class Conditional(HL7Operation):
+    """
+    Applies an operation only to messages that fulfil a condition.
+    For other messages, the operation is not evaluated and :data:`SKIP`
+    is returned, so that the target field is left unchanged.
+    """
+    def __init__(self, operation, condition):
+        self.operation = operation
+        self.condition = condition
+
+    def __call__(self, message):
+        if self.condition(message):
+            return self.operation(message)
+        return SKIP
+
+    def __str__(self):
+        return '<{} when {}>'.format(self.operation.__class__.__name__, self.condition)
+
+    def reads(self):
+        return self.condition.fields() + self.operation.reads()
+
+    @property
+    def deterministic(self):
+        return self.operation.deterministic
+
+    @staticmethod
+    def wrap(operation, condition):
+        """
+        Adds a condition to an operation, combining it with the condition
+        the operation may already have.
+        """
+        if isinstance(operation, Conditional):
+            return Conditional(operation.operation, AllOf([condition, operation.condition]))
+        return Conditional(operation, condition)
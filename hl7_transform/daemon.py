@@ -0,0 +1,176 @@
+"""
+This file contains a persistent transform daemon: a local server on a Unix
+socket that keeps parsed mappings, compiled transforms and hl7apy warm
+between calls, so that shell-driven pipelines do not pay the start-up
+cost of the CLI for every message.
+
+Mappings are loaded through an :class:`HL7MappingCache` and reloaded when
+the mapping file changes. Every connection is served in its own thread and
+may send any number of requests, see :func:`hl7_transform.client.request`
+for the protocol.
+
+The socket is only accessible by the user running the daemon, since
+requests name mapping and lookup table files that the daemon reads.
+
+Example usage::
+
+    daemon = HL7TransformDaemon('/tmp/hl7_transform.sock', preload=['mapping.json'])
+    daemon.serve_forever()
+"""
+import json
+import logging
+import os
+import socket
+import socketserver
+import stat
+import threading
+from hl7_transform.analysis import HL7MappingAnalysis
+from hl7_transform.mapping_cache import HL7MappingCache
+from hl7_transform.message import HL7Message, HL7_VERSIONS, preload_hl7apy
+from hl7_transform.transform import HL7Transform
+
+
+logger = logging.getLogger(__name__)
+
+
+class HL7TransformDaemon(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """
+    A Unix socket server that transforms messages with cached transforms.
+    """
+    daemon_threads = True
+
+    def __init__(self, socket_path, mapping_cache=None, maxsize=32, preload=(), mapping_type='json', result_cache=None,
+                 preload_versions=HL7_VERSIONS):
+        """
+        :param socket_path: Path of the Unix socket. A stale socket file of a
+            daemon that is no longer running is replaced.
+        :param mapping_cache: Directory of the on-disk mapping cache, see :class:`HL7MappingCache`.
+        :param maxsize: Number of mappings kept in memory.
+        :param preload: Paths of mapping files loaded before the first request.
+        :param mapping_type: The file type of the preloaded mappings, json (default) or csv.
+        :param result_cache: An optional :class:`HL7ResultCache` shared by all transforms,
+            so that messages sent again are not transformed again.
+        :param preload_versions: HL7 versions whose hl7apy reference structures are
+            loaded before the first request, see :func:`preload_hl7apy`.
+        """
+        remove_stale_socket(socket_path)
+        self.mappings = HL7MappingCache(mapping_cache, maxsize)
+        self.result_cache = result_cache
+        self._transforms = {}
+        self._lock = threading.Lock()
+        self._request = threading.local()
+        socketserver.UnixStreamServer.__init__(self, socket_path, DaemonHandler, bind_and_activate=False)
+        try:
+            # the socket is created with mode 0600, there is no window in which others can connect
+            umask = os.umask(0o177)
+            try:
+                self.server_bind()
+            finally:
+                os.umask(umask)
+            self.server_activate()
+        except BaseException:
+            self.server_close()
+            raise
+        self.warm_up(preload, mapping_type, preload_versions)
+
+    def warm_up(self, preload=(), mapping_type='json', preload_versions=HL7_VERSIONS):
+        """
+        Loads the mappings and the hl7apy reference structures that the
+        first message would otherwise load.
+        """
+        preload_hl7apy(preload_versions)
+        for path in preload:
+            self.transform_for(os.path.abspath(path), mapping_type, 'raise', False)
+
+    def transform_for(self, path, mapping_type, on_error, optimize):
+        """
+        Returns the transform of a mapping file and error policy, and the
+        analysis report if the mapping is optimized. Transforms are compiled
+        again when the mapping file changes.
+
+        :param on_error: raise or log. Warnings of the log policy are returned to the
+            requester, the daemon keeps no errors between requests.
+        :raises ValueError: If the error policy is not supported.
+        """
+        if on_error not in ('raise', 'log'):
+            raise ValueError('Unsupported error policy {}. Currently supported are: raise, log.'.format(on_error))
+        mapping = self.mappings.load(path, mapping_type)
+        key = (path, mapping_type, on_error, optimize)
+        with self._lock:
+            entry = self._transforms.get(key)
+        if entry is not None and entry[0] is mapping:
+            return entry[1], entry[2]
+        report = None
+        compiled = mapping
+        if optimize:
+            analysis = HL7MappingAnalysis(mapping)
+            report = analysis.report()
+            compiled = analysis.optimized_mapping()
+        transform = HL7Transform(compiled, on_error=self.collect_warning if on_error == 'log' else on_error,
+                                 result_cache=self.result_cache)
+        with self._lock:
+            self._transforms[key] = (mapping, transform, report)
+        return transform, report
+
+    def collect_warning(self, error):
+        self._request.warnings.append('{} Rule {} ({}) skipped in message {}'.format(
+            error, error.rule, error.operation, error.excerpt()))
+
+    def respond(self, request):
+        """
+        Transforms the message of a request.
+
+        :param request: A dictionary, see :func:`hl7_transform.client.request`.
+        :return: The response dictionary.
+        """
+        self._request.warnings = []
+        transform, report = self.transform_for(request['mapping'], request.get('type', 'json'),
+                                               request.get('on_error', 'raise'), request.get('optimize', False))
+        parser = request.get('parser', 'hl7apy')
+        if request.get('message') is None:
+            txt = transform(HL7Message.new(parser)).to_string()
+        else:
+            txt = transform.transform_string(request['message'], parser)
+        response = {'message': txt, 'warnings': self._request.warnings}
+        if report is not None:
+            response['report'] = report
+        return response
+
+    def server_close(self):
+        socketserver.UnixStreamServer.server_close(self)
+        if os.path.exists(self.server_address):
+            os.remove(self.server_address)
+
+
+class DaemonHandler(socketserver.StreamRequestHandler):
+    """
+    Answers every request line of a connection with a response line.
+    """
+    def handle(self):
+        for line in self.rfile:
+            try:
+                response = self.server.respond(json.loads(line))
+            except Exception as e:
+                logger.warning('Request failed. Reason: %s', e)
+                response = {'error': str(e) or e.__class__.__name__}
+            self.wfile.write(json.dumps(response).encode() + b'\n')
+            self.wfile.flush()
+
+
+def remove_stale_socket(socket_path):
+    """
+    Removes the socket file of a daemon that is no longer running.
+
+    :raises OSError: If a daemon is listening on the socket, or the path is not a socket.
+    """
+    if not os.path.exists(socket_path):
+        return
+    if not stat.S_ISSOCK(os.stat(socket_path).st_mode):
+        raise OSError('{} exists and is not a socket'.format(socket_path))
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as connection:
+        try:
+            connection.connect(socket_path)
+        except ConnectionRefusedError:
+            os.remove(socket_path)
+            return
+    raise OSError('A daemon is already listening on {}'.format(socket_path))
@@ -0,0 +1,250 @@
+"""
+This file contains a parser and a formatter of the HL7 date and time types,
+used by the date operations:
+
+- DT, a date: ``YYYY[MM[DD]]``,
+- TM, a time: ``HH[MM[SS[.S[S[S[S]]]]]][+/-ZZZZ]``,
+- DTM, a date and time: ``YYYY[MM[DD[HH[MM[SS[.S[S[S[S]]]]]]]]][+/-ZZZZ]``.
+
+A parsed value keeps its precision, the number of digits of the source,
+so that a computed value is written with the precision it was read with.
+
+The parser is hand-written, since :func:`datetime.strptime` needs a format
+per precision and is several times slower. Parsed values are cached, since
+the fields of a feed often repeat the same timestamps.
+
+Example usage::
+
+    start = HL7DateTime.from_string('20200520161530.25+0200')
+    end = start.add(50, 'minutes')
+    print(end.to_string())  # 20200520170530.25+0200
+"""
+from calendar import monthrange
+from datetime import datetime, timedelta, timezone
+from functools import lru_cache
+
+
+TYPES = ('DTM', 'DT', 'TM')
+
+PRECISIONS = {
+    'year': 4,
+    'month': 6,
+    'day': 8,
+    'hour': 10,
+    'minute': 12,
+    'second': 14,
+}
+"""The precision of each unit, the number of digits of a DTM value."""
+
+UNITS = {
+    'years': 4,
+    'months': 6,
+    'weeks': 8,
+    'days': 8,
+    'hours': 10,
+    'minutes': 12,
+    'seconds': 14,
+}
+"""The units of durations, with the precision a value needs to show them."""
+
+# the precisions without fractional seconds of each type, and the digits a TM value lacks
+_LENGTHS = {
+    'DTM': ((4, 6, 8, 10, 12, 14), ''),
+    'DT': ((4, 6, 8), ''),
+    'TM': ((2, 4, 6), '19000101'),
+}
+
+
+class HL7DateTime:
+    """
+    A DTM, DT or TM value and its precision.
+
+    Values are shared by the cache of :meth:`from_string`, they must not be modified.
+    Operations return new values.
+    """
+    __slots__ = ('value', 'precision', 'type')
+
+    def __init__(self, value, precision=14, type='DTM'):
+        """
+        :param value: A :class:`datetime`, with a time zone if the value has an offset.
+            TM values are on 1 January 1900.
+        :param precision: The number of digits of the value as a DTM, from 4 (year)
+            to 14 (second), 15 to 18 with fractional seconds. TM values count the date, from 10 (hour).
+        :param type: One of :data:`TYPES`.
+        """
+        self.value = value
+        self.precision = precision
+        self.type = type
+
+    @staticmethod
+    def from_string(txt, type='DTM'):
+        """
+        Parses a value of an HL7 date or time type.
+
+        :param txt: The value.
+        :param type: One of :data:`TYPES`.
+        :raises ValueError: If the value is not valid for the type.
+        """
+        return parse_dtm(txt, type)
+
+    def to_string(self):
+        """
+        Formats the value with its precision.
+        """
+        value = self.value
+        precision = self.precision
+        txt = '{:04d}{:02d}{:02d}{:02d}{:02d}{:02d}'.format(
+            value.year, value.month, value.day, value.hour, value.minute, value.second)
+        txt = txt[8 if self.type == 'TM' else 0:precision]
+        if precision > 14:
+            txt += '.' + '{:06d}'.format(value.microsecond)[:precision - 14]
+        if value.tzinfo is not None:
+            txt += format_offset(value.utcoffset())
+        return txt
+
+    def replace(self, value=None, precision=None):
+        """
+        Returns a copy with another value or precision.
+        """
+        return HL7DateTime(self.value if value is None else value,
+                           self.precision if precision is None else precision, self.type)
+
+    def add(self, amount, unit='minutes'):
+        """
+        Adds a duration, keeping the precision unless the unit needs a higher one,
+        e.g. minutes added to a date. Months and years are added to the calendar
+        month, the day is limited to the length of the resulting month.
+
+        :param amount: An integer, negative to subtract the duration.
+        :param unit: One of :data:`UNITS`.
+        :raises ValueError: If the unit is not supported or the result is out of range.
+        """
+        if unit not in UNITS:
+            raise ValueError('Unsupported unit {}. Currently supported are: {}.'.format(unit, ', '.join(UNITS)))
+        value = self.value
+        try:
+            if unit in ('years', 'months'):
+                month = value.year * 12 + value.month - 1 + (amount * 12 if unit == 'years' else amount)
+                year, month = divmod(month, 12)
+                month += 1
+                value = value.replace(year=year, month=month, day=min(value.day, monthrange(year, month)[1]))
+            else:
+                value = value + timedelta(**{unit: amount})
+        except OverflowError as e:
+            raise ValueError('{} {} added to {} is out of range'.format(amount, unit, self.to_string())) from e
+        return HL7DateTime(value, max(self.precision, UNITS[unit]), self.type)
+
+    def truncate(self, precision):
+        """
+        Returns the value shortened to a precision, e.g. to the day.
+
+        :param precision: The number of digits, or one of :data:`PRECISIONS`.
+        :raises ValueError: If a TM value is truncated to a date unit, e.g. to the day.
+        """
+        precision = PRECISIONS.get(precision, precision)
+        if self.type == 'TM' and precision < PRECISIONS['hour']:
+            raise ValueError('A TM value cannot be truncated to a date unit, its lowest precision is the hour')
+        if precision >= self.precision:
+            return self
+        value = self.value
+        scale = 10 ** (20 - precision) if precision > 14 else 1000000
+        value = value.replace(month=value.month if precision >= 6 else 1, day=value.day if precision >= 8 else 1,
+                              hour=value.hour if precision >= 10 else 0, minute=value.minute if precision >= 12 else 0,
+                              second=value.second if precision >= 14 else 0,
+                              microsecond=value.microsecond // scale * scale)
+        return HL7DateTime(value, precision, self.type)
+
+    def __eq__(self, other):
+        if not isinstance(other, HL7DateTime):
+            return NotImplemented
+        return (self.value, self.precision, self.type) == (other.value, other.precision, other.type)
+
+    def __hash__(self):
+        return hash((self.value, self.precision, self.type))
+
+    def __repr__(self):
+        return '<HL7DateTime {} {}>'.format(self.type, self.to_string())
+
+
+@lru_cache(maxsize=4096)
+def parse_dtm(txt, type='DTM'):
+    """
+    Parses a value of an HL7 date or time type, see :meth:`HL7DateTime.from_string`.
+    Results are cached.
+    """
+    try:
+        lengths, prefix = _LENGTHS[type]
+    except KeyError:
+        raise ValueError('Unsupported type {}. Currently supported are: {}.'.format(type, ', '.join(TYPES))) from None
+    tzinfo = None
+    # the offset follows the digits, which are at least 2 of a time or 4 of a date
+    sign = txt.find('+', 2)
+    if sign < 0:
+        sign = txt.find('-', 2)
+    if sign >= 0:
+        if type == 'DT':
+            raise ValueError('{} is not a valid DT value, dates have no time zone'.format(txt))
+        tzinfo = parse_offset(txt[sign:])
+        txt = txt[:sign]
+    digits, dot, fraction = txt.partition('.')
+    if len(digits) not in lengths or not (digits.isascii() and digits.isdigit()):
+        raise ValueError('{} is not a valid {} value'.format(txt, type))
+    precision = len(prefix) + len(digits)
+    microsecond = 0
+    if dot:
+        if len(digits) != lengths[-1] or not 1 <= len(fraction) <= 4 or not (fraction.isascii() and fraction.isdigit()):
+            raise ValueError('{} is not a valid {} value'.format(txt, type))
+        microsecond = int(fraction.ljust(6, '0'))
+        precision += len(fraction)
+    digits = prefix + digits
+    try:
+        value = datetime(int(digits[:4]), int(digits[4:6] or 1), int(digits[6:8] or 1), int(digits[8:10] or 0),
+                         int(digits[10:12] or 0), int(digits[12:14] or 0), microsecond, tzinfo)
+    except ValueError as e:
+        raise ValueError('{} is not a valid {} value: {}'.format(txt, type, e)) from None
+    return HL7DateTime(value, precision, type)
+
+
+def parse_offset(txt):
+    """
+    Returns the fixed time zone of an offset ``+/-ZZZZ``.
+    """
+    if len(txt) != 5 or txt[0] not in '+-' or not (txt[1:].isascii() and txt[1:].isdigit()):
+        raise ValueError('{} is not a valid time zone offset'.format(txt))
+    minutes = int(txt[1:3]) * 60 + int(txt[3:])
+    return fixed_timezone(-minutes if txt[0] == '-' else minutes)
+
+
+@lru_cache(maxsize=None)
+def fixed_timezone(minutes):
+    return timezone(timedelta(minutes=minutes))
+
+
+def format_offset(offset):
+    """
+    Formats a :class:`timedelta` as an offset ``+/-ZZZZ``.
+    """
+    minutes = int(offset.total_seconds()) // 60
+    sign = '-' if minutes < 0 else '+'
+    hours, minutes = divmod(abs(minutes), 60)
+    return '{}{:02d}{:02d}'.format(sign, hours, minutes)
+
+
+@lru_cache(maxsize=None)
+def get_timezone(name):
+    """
+    Returns the time zone of an offset ``+/-ZZZZ``, ``UTC`` or an IANA name, e.g. ``Europe/Berlin``.
+    IANA names need :mod:`zoneinfo`, available from Python 3.9.
+    """
+    if name.upper() in ('UTC', 'Z'):
+        return timezone.utc
+    if name[:1] in ('+', '-'):
+        return parse_offset(name)
+    try:
+        from zoneinfo import ZoneInfo
+    except ImportError:
+        raise ValueError('Time zone {} needs the zoneinfo module of Python 3.9 or later'.format(name)) from None
+    try:
+        return ZoneInfo(name)
+    except (KeyError, ValueError) as e:
+        raise ValueError('{} is not a valid time zone'.format(name)) from e
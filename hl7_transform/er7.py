@@ -0,0 +1,288 @@
+"""
+This file contains a lightweight parser for HL7 messages in ER7 encoding
+(the pipe-delimited text format). It is an alternative to hl7apy for
+transformations that only read and write delimited strings.
+"""
+from datetime import datetime
+
+
+DEFAULT_VERSION = '2.5'
+"""The HL7 version of new messages, the default version of hl7apy."""
+
+
+def parser_error(text):
+    """
+    Returns an hl7apy ParserError, importing hl7apy only when a message is invalid.
+    """
+    from hl7apy.exceptions import ParserError
+    return ParserError(text)
+
+
+class ER7Message:
+    """
+    A compact representation of an HL7 message.
+
+    Every segment is a list of field strings, the list index being the field
+    number and the first item being the segment name. For MSH segments, items
+    1 and 2 hold the field separator and the encoding characters.
+    Fields are kept verbatim and split into repetitions and components
+    only on access, so unmodified fields are serialized byte by byte.
+
+    Messages parsed with `lazy=True` keep every segment but the first as its
+    raw string, until the segment is accessed with :meth:`segment`.
+    Segments that are never accessed are serialized verbatim.
+
+    The ER7 representation of every segment is cached until the segment
+    is modified with :meth:`set`, so serialization only renders modified segments.
+
+    Copies made with :meth:`copy` share the segments with the original message.
+    A shared segment is copied by :meth:`set` before it is modified.
+    """
+    _shared = frozenset()
+
+    def __init__(self, segments, field_separator='|', encoding_chars='^~\\&'):
+        self.segments = segments
+        self.field_separator = field_separator
+        self.encoding_chars = encoding_chars
+        self.component_separator = encoding_chars[0]
+        self.repetition_separator = encoding_chars[1]
+        self.escape_char = encoding_chars[2]
+        self.sub_component_separator = encoding_chars[3]
+        self.build_index()
+
+    @staticmethod
+    def parse(txt, lazy=False):
+        """
+        Splits a message into segments and fields on the encoding characters
+        declared in MSH-1 and MSH-2.
+
+        :param lazy: If True, only split the message into segments.
+            Segments are split into fields on first access.
+        """
+        if not txt.startswith('MSH') or len(txt) < 8:
+            raise parser_error('Invalid message: expected an MSH segment with encoding characters')
+        field_separator = txt[3]
+        lines = [line for line in txt.replace('\n', '\r').split('\r') if line]
+        if lazy:
+            segments = [split_segment(lines[0], field_separator)] + lines[1:]
+        else:
+            segments = [split_segment(line, field_separator) for line in lines]
+        encoding_chars = segments[0][2]
+        if len(encoding_chars) < 4:
+            raise parser_error('Invalid message: MSH-2 must contain at least 4 encoding characters')
+        message = ER7Message(segments, field_separator, encoding_chars)
+        message._rendered = dict(enumerate(lines))
+        return message
+
+    @staticmethod
+    def new(version=DEFAULT_VERSION):
+        """
+        Creates a message that only contains an MSH segment, with the current time
+        in MSH-7 and the HL7 version in MSH-12, like a new hl7apy message.
+
+        :param version: The HL7 version of the message.
+        """
+        return ER7Message([['MSH', '|', '^~\\&', '', '', '', '', datetime.now().strftime('%Y%m%d%H%M%S'),
+                            '', '', '', '', version]])
+
+    def copy(self):
+        """
+        Returns a copy of the message that shares all segments with this message.
+        Modifying either message copies the modified segment first, so the
+        other message is left unchanged.
+        """
+        message = ER7Message.__new__(ER7Message)
+        message.__dict__.update(self.__dict__)
+        message.segments = list(self.segments)
+        message._index = {name: list(positions) for name, positions in self._index.items()}
+        message._rendered = dict(self._rendered)
+        shared = {id(segment) for segment in self.segments if segment.__class__ is not str}
+        # both messages copy a shared segment before modifying it
+        self._shared = shared.union(self._shared)
+        message._shared = set(self._shared)
+        return message
+
+    def build_index(self):
+        """
+        Indexes segment positions by segment name and drops the cached
+        segment representations. Needs to be called after
+        :attr:`segments` has been modified directly.
+        """
+        self._index = {}
+        self._rendered = {}
+        field_separator = self.field_separator
+        for position, segment in enumerate(self.segments):
+            name = segment.partition(field_separator)[0] if segment.__class__ is str else segment[0]
+            self._index.setdefault(name, []).append(position)
+
+    def segment(self, position):
+        """
+        Returns the segment at a position as a list of fields,
+        splitting it if it has not been accessed before.
+        """
+        segment = self.segments[position]
+        if segment.__class__ is str:
+            segment = self.segments[position] = split_segment(segment, self.field_separator)
+        return segment
+
+    def segments_by_name(self, name):
+        """
+        Returns the list of segments of the given name, in message order.
+        """
+        return [self.segment(position) for position in self._index.get(name, ())]
+
+    def segment_string(self, name):
+        """
+        Returns the ER7 representation of the first segment of the given name,
+        None if the message has no such segment.
+        """
+        positions = self._index.get(name)
+        if not positions:
+            return None
+        rendered = self._rendered.get(positions[0])
+        return rendered if rendered is not None else self.render_segment(self.segments[positions[0]])
+
+    def render_segment(self, segment):
+        """
+        Returns the ER7 representation of one segment.
+        """
+        if segment.__class__ is str:
+            return segment
+        if segment[0] == 'MSH':
+            return 'MSH' + self.field_separator + self.field_separator.join(segment[2:])
+        return self.field_separator.join(segment)
+
+    def segment_strings(self):
+        """
+        Returns the list of ER7 representations of the segments, in message order.
+        Only segments modified since the last call are rendered.
+        """
+        rendered = self._rendered
+        strings = []
+        for position, segment in enumerate(self.segments):
+            txt = rendered.get(position)
+            if txt is None:
+                txt = rendered[position] = self.render_segment(segment)
+            strings.append(txt)
+        return strings
+
+    def to_er7(self, segment_separator='\r'):
+        """
+        Returns the ER7 representation of the message.
+        """
+        return segment_separator.join(self.segment_strings())
+
+    def escape(self, value):
+        """
+        Escapes the field, component and repetition separators contained
+        in a component value. Escape sequences already present in the value
+        are kept, so that values read from other components can be copied.
+        """
+        for separator, code in ((self.field_separator, 'F'), (self.component_separator, 'S'), (self.repetition_separator, 'R')):
+            if separator in value:
+                value = value.replace(separator, '{0}{1}{0}'.format(self.escape_char, code))
+        return value
+
+    def get(self, index):
+        """
+        Returns the value of a field, a component or a sub-component, see :class:`HL7Field`.
+        Without segment occurrence, reads from the first segment that contains the field.
+        """
+        positions = self._index.get(index.segment, ())
+        segments = self.segments
+        if index.occurrence is None:
+            for position in positions:
+                segment = segments[position]
+                if segment.__class__ is str:
+                    segment = self.segment(position)
+                if index.field < len(segment):
+                    break
+            else:
+                raise KeyError('Could not retrieve {}'.format(index))
+        elif index.occurrence <= len(positions):
+            segment = self.segment(positions[index.occurrence - 1])
+            if index.field >= len(segment):
+                raise KeyError('Could not retrieve {}'.format(index))
+        else:
+            raise KeyError('Could not retrieve {}'.format(index))
+        value = segment[index.field]
+        if segment[0] == 'MSH' and index.field <= 2:
+            if index.component > 1:
+                raise KeyError('Component {} does not exist'.format(index.component_name))
+            return value
+        if index.repetition == 1:
+            value = value.split(self.repetition_separator, 1)[0]
+        else:
+            repetitions = value.split(self.repetition_separator)
+            if index.repetition > len(repetitions):
+                raise KeyError('Could not retrieve {}'.format(index))
+            value = repetitions[index.repetition - 1]
+        if index.component > 0:
+            components = value.split(self.component_separator)
+            if index.component > len(components):
+                raise KeyError('Component {} does not exist'.format(index.component_name))
+            value = components[index.component - 1]
+            if index.sub_component > 0:
+                sub_components = value.split(self.sub_component_separator)
+                if index.sub_component > len(sub_components):
+                    raise KeyError('Sub-component {} does not exist'.format(index))
+                value = sub_components[index.sub_component - 1]
+        return value
+
+    def set(self, index, value):
+        """
+        Writes the value of a field, a component or a sub-component, adding
+        segment occurrences, fields, repetitions and components as needed.
+        Without segment occurrence, the value is written into the first
+        segment of the given name.
+        """
+        positions = self._index.get(index.segment)
+        occurrence = index.occurrence or 1
+        if positions is None or len(positions) < occurrence:
+            positions = self._index.setdefault(index.segment, [])
+            while len(positions) < occurrence:
+                positions.append(len(self.segments))
+                self.segments.append([index.segment])
+        position = positions[occurrence - 1]
+        segment = self.segments[position]
+        if segment.__class__ is str:
+            segment = self.segment(position)
+        elif self._shared and id(segment) in self._shared:
+            self._shared.discard(id(segment))
+            segment = self.segments[position] = list(segment)
+        self._rendered.pop(position, None)
+        if len(segment) <= index.field:
+            segment.extend([''] * (index.field + 1 - len(segment)))
+        if index.repetition == 1:
+            repetitions = segment[index.field].split(self.repetition_separator, 1)
+        else:
+            repetitions = segment[index.field].split(self.repetition_separator)
+        if len(repetitions) < index.repetition:
+            repetitions.extend([''] * (index.repetition - len(repetitions)))
+        if index.component > 0:
+            components = repetitions[index.repetition - 1].split(self.component_separator)
+            if len(components) < index.component:
+                components.extend([''] * (index.component - len(components)))
+            value = self.escape(value)
+            if index.sub_component > 0:
+                sub_components = components[index.component - 1].split(self.sub_component_separator)
+                if len(sub_components) < index.sub_component:
+                    sub_components.extend([''] * (index.sub_component - len(sub_components)))
+                sub_components[index.sub_component - 1] = value.replace(
+                    self.sub_component_separator, '{0}T{0}'.format(self.escape_char))
+                value = self.sub_component_separator.join(sub_components)
+            components[index.component - 1] = value
+            value = self.component_separator.join(components)
+        repetitions[index.repetition - 1] = value
+        segment[index.field] = self.repetition_separator.join(repetitions)
+
+
+def split_segment(line, field_separator):
+    """
+    Splits the ER7 representation of a segment into a list of fields,
+    see :class:`ER7Message`.
+    """
+    fields = line.split(field_separator)
+    if fields[0] == 'MSH':
+        fields.insert(1, field_separator)
+    return fields
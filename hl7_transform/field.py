@@ -1,27 +1,88 @@
 """
 Encapsulates the functionality of an HL7 field.
 """
+import re
+
+
+FIELD_PATTERN = re.compile(r'^(\w{3})(?:\[(\d+)\])?\.(\d+)(?:\[(\d+)\])?(?:\.(\d+)(?:\.(\d+))?)?$')
 
 
 class HL7Field:
-    def __init__(self, name):
-        self.name = name
-        count = name.count('.')
-        if count < 2:
-            name += '.0'
-        self.segment, self.field, self.component = name.split('.', 3)
-        self.field = int(self.field)
-        self.repetition = 1  # currently fixed
-        self.component = int(self.component)
-        self.sub_component = 1  # currently fixed
+    """
+    The address of a field, a component or a sub-component in an HL7 message,
+    in the form ``SEG[n].F[r].C.S``:
+
+    - ``SEG[n]``: the segment name and, optionally, the segment occurrence `n`
+      (1-based). Without occurrence, values are read from the first segment that
+      contains the field and written into the first segment of that name.
+    - ``F[r]``: the field number and, optionally, the field repetition `r` (1-based, default 1).
+    - ``C``: the optional component number, 0 addresses the whole field.
+    - ``S``: the optional sub-component number, 0 addresses the whole component.
+
+    For example ``PID.3``, ``PID.3.1``, ``PID.3[2].4.1`` or ``OBX[3].5``.
+
+    Fields are immutable and hashable values. Instances are interned:
+    constructing a field from the same path string twice returns the same
+    instance, and its names are computed only once.
+    """
+    __slots__ = ('name', 'segment', 'occurrence', 'field', 'repetition', 'component', 'sub_component',
+                 'field_name', 'component_name', '_key', '_hash')
+
+    _cache = {}
+
+    def __new__(cls, name):
+        instance = cls._cache.get(name)
+        if instance is not None:
+            return instance
+        match = FIELD_PATTERN.match(name)
+        if match is None:
+            raise ValueError('Invalid field address {}, expected SEG[n].F[r].C.S, e.g. PID.3.1'.format(name))
+        segment, occurrence, field, repetition, component, sub_component = match.groups()
+        occurrence = None if occurrence is None else int(occurrence)
+        field = int(field)
+        repetition = 1 if repetition is None else int(repetition)
+        component = 0 if component is None else int(component)
+        sub_component = 0 if sub_component is None else int(sub_component)
+        if occurrence == 0 or repetition == 0:
+            raise ValueError('Invalid field address {}, segment occurrences and repetitions start at 1'.format(name))
+        if sub_component > 0 and component == 0:
+            raise ValueError('Invalid field address {}, a sub-component requires a component'.format(name))
+        instance = object.__new__(cls)
+        key = (segment, occurrence, field, repetition, component, sub_component)
+        setattr_ = object.__setattr__
+        setattr_(instance, 'name', name)
+        setattr_(instance, 'segment', segment)
+        setattr_(instance, 'occurrence', occurrence)
+        setattr_(instance, 'field', field)
+        setattr_(instance, 'repetition', repetition)
+        setattr_(instance, 'component', component)
+        setattr_(instance, 'sub_component', sub_component)
+        setattr_(instance, 'field_name', '{}_{}'.format(segment, field))
+        setattr_(instance, 'component_name', '{}_{}_{}'.format(segment, field, component))
+        setattr_(instance, '_key', key)
+        setattr_(instance, '_hash', hash(key))
+        cls._cache[name] = instance
+        return instance
+
+    def __setattr__(self, name, value):
+        raise AttributeError('HL7Field is immutable')
+
+    def __delattr__(self, name):
+        raise AttributeError('HL7Field is immutable')
+
+    def __reduce__(self):
+        return (HL7Field, (self.name,))
+
+    def __eq__(self, other):
+        if not isinstance(other, HL7Field):
+            return NotImplemented
+        return self._key == other._key
+
+    def __hash__(self):
+        return self._hash
 
     def __str__(self):
         return '({})'.format(self.name)
 
-    @property
-    def field_name(self):
-        return '{}_{}'.format(self.segment, self.field)
-
-    @property
-    def component_name(self):
-        return '{}_{}_{}'.format(self.segment, self.field, self.component)
+    def __repr__(self):
+        return 'HL7Field({!r})'.format(self.name)
@@ -0,0 +1,195 @@
+"""
+This file contains lookup tables that translate codes, e.g. local department
+codes to the codes of a partner system, for the ``lookup_value`` operation.
+
+A table is loaded once into a hashed index and shared by all rules and
+transforms of a process that use the same file. Tables can be read from:
+
+- CSV files, with a header line naming the columns,
+- JSON files, containing either an object that maps codes to values
+  or a list of records (objects) with named columns,
+- SQLite databases (``.db``, ``.sqlite``, ``.sqlite3``), for tables too large to be
+  kept in memory. Values are queried on demand and the most recently used are
+  kept in a bounded cache. The key columns should be indexed.
+
+Multi-column keys are tuples of the values of the key columns.
+"""
+import csv
+import json
+import os
+from functools import lru_cache
+from threading import Lock
+
+
+SQLITE_EXTENSIONS = ('.db', '.sqlite', '.sqlite3')
+
+
+class LookupTable:
+    """
+    An in-memory lookup table, indexed by a dictionary.
+    """
+    def __init__(self, index, path=None):
+        """
+        :param index: A dictionary of keys to values. Keys of multi-column
+            tables are tuples.
+        :param path: The file the table was read from.
+        """
+        self.index = index
+        self.path = path
+        self.stamp = None
+
+    def get(self, key):
+        """
+        :return: The value of the key, or None if the table does not contain the key.
+        """
+        return self.index.get(key)
+
+    def __len__(self):
+        return len(self.index)
+
+    def fingerprint(self):
+        """
+        Identifies the content of the table by its file and the modification
+        time and size of the file when it was loaded, see :func:`load_table`.
+        Tables without a file are identified by their content.
+        """
+        if self.path is None or self.stamp is None:
+            return repr(sorted(self.index.items()))
+        return repr(('LookupTable', self.path, self.stamp))
+
+    @staticmethod
+    def from_records(records, key, value, path=None):
+        """
+        Indexes a list of records (dictionaries) by the key columns.
+        Keys and values are converted to strings, since they are compared with
+        and written to message fields. Records with an empty (null) key or value are skipped.
+
+        :param key: A column name, or a list of column names for multi-column keys.
+        :param value: The name of the column that contains the values.
+        """
+        columns = [key] if isinstance(key, str) else key
+        index = {}
+        for record in records:
+            codes = [record[column] for column in columns]
+            if record[value] is None or None in codes:
+                continue
+            codes = [str(code) for code in codes]
+            index[codes[0] if isinstance(key, str) else tuple(codes)] = str(record[value])
+        return LookupTable(index, path)
+
+    @staticmethod
+    def from_csv(path, key, value):
+        """
+        Reads a lookup table from a CSV file with a header line.
+        """
+        with open(path, newline='') as f:
+            return LookupTable.from_records(csv.DictReader(f), key, value, path)
+
+    @staticmethod
+    def from_json(path, key=None, value=None):
+        """
+        Reads a lookup table from a JSON file. An object is used as index,
+        a list of records is indexed by the key columns.
+        """
+        with open(path) as f:
+            js = json.load(f)
+        if isinstance(js, dict):
+            return LookupTable({code: str(value) for code, value in js.items() if value is not None}, path)
+        if key is None or value is None:
+            raise ValueError('Lookup table {} needs key and value columns'.format(path))
+        return LookupTable.from_records(js, key, value, path)
+
+
+def quote(identifier):
+    return '"{}"'.format(identifier.replace('"', '""'))
+
+
+class SQLiteLookupTable:
+    """
+    A lookup table in an SQLite database. The database is opened read-only,
+    and results, including missing keys, are kept in a least-recently-used
+    cache of `cache_size` keys.
+    """
+    def __init__(self, path, table, key, value, cache_size=65536):
+        """
+        :param table: The name of the database table.
+        :param key: A column name, or a list of column names for multi-column keys.
+        :param value: The name of the column that contains the values.
+        """
+        import sqlite3
+        from pathlib import Path
+        self.path = path
+        self.key = key
+        self.table = table
+        self.query = 'SELECT {} FROM {} WHERE {} LIMIT 1'.format(
+            quote(value), quote(table),
+            ' AND '.join('{} = ?'.format(quote(column)) for column in ([key] if isinstance(key, str) else key)))
+        self._connection = sqlite3.connect('{}?mode=ro'.format(Path(path).absolute().as_uri()), uri=True, check_same_thread=False)
+        self._lock = Lock()
+        self.get = lru_cache(maxsize=cache_size)(self._get)
+        self.stamp = None
+
+    def _get(self, key):
+        parameters = (key,) if isinstance(self.key, str) else key
+        with self._lock:
+            row = self._connection.execute(self.query, parameters).fetchone()
+        return None if row is None or row[0] is None else str(row[0])
+
+    def __len__(self):
+        with self._lock:
+            return self._connection.execute('SELECT COUNT(*) FROM {}'.format(quote(self.table))).fetchone()[0]
+
+    def fingerprint(self):
+        """
+        Identifies the table by its database, query and the modification time
+        and size of the database file when it was opened, see :func:`load_table`.
+        """
+        return repr(('SQLiteLookupTable', self.path, self.query, self.stamp))
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
+
+
+_tables = {}
+_tables_lock = Lock()
+
+
+def load_table(path, key=None, value=None, table=None, cache_size=65536):
+    """
+    Returns the lookup table of a file, loading it only once per process.
+    Tables are reloaded when the file is modified.
+
+    :param path: Path to a CSV, JSON or SQLite file, see above.
+    :param key: A column name, or a list of column names for multi-column keys.
+        Not needed for JSON objects.
+    :param value: The name of the column that contains the values.
+        Not needed for JSON objects.
+    :param table: The name of the table in an SQLite database.
+    :param cache_size: The number of cached keys of an SQLite table.
+    """
+    path = os.path.abspath(path)
+    if isinstance(key, list):
+        key = key[0] if len(key) == 1 else tuple(key)
+    stat = os.stat(path)
+    stamp = (stat.st_mtime_ns, stat.st_size)
+    cache_key = (path, key, value, table, cache_size)
+    with _tables_lock:
+        entry = _tables.get(cache_key)
+        if entry is None or entry[0] != stamp:
+            entry = _tables[cache_key] = (stamp, _load_file(path, key, value, table, cache_size))
+            entry[1].stamp = stamp
+    return entry[1]
+
+
+def _load_file(path, key, value, table, cache_size):
+    extension = os.path.splitext(path)[1].lower()
+    if extension == '.json':
+        return LookupTable.from_json(path, key, value)
+    if key is None or value is None:
+        raise ValueError('Lookup table {} needs key and value columns'.format(path))
+    if extension in SQLITE_EXTENSIONS:
+        if table is None:
+            raise ValueError('Lookup table {} needs the name of the database table'.format(path))
+        return SQLiteLookupTable(path, table, key, value, cache_size)
+    return LookupTable.from_csv(path, key, value)
@@ -5,24 +5,55 @@ import json
 import csv
 from hl7_transform.field import HL7Field
 from hl7_transform.operations import HL7Operation
+from hl7_transform.conditions import HL7Condition, Conditional
 
 
 def my_hook(dct):
     """
     Convert items in JSON dictionary from string to HL7Field.
+
+    Rules with a ``when`` condition get a :class:`Conditional` operation.
+    A group of rules with a common condition is converted to the list of its
+    rules, see :mod:`hl7_transform.conditions`.
     """
     ret = {}
+    condition = dct.get('when')
+    if condition:
+        condition = HL7Condition.from_dict(condition)
     if 'operation' in dct and 'target_field' in dct:
         operation_name, source_fields, args = dct['operation'], dct.get('source_fields', [dct.get('source_field', None)]), dct.get('args', {})
         if len(source_fields) == 1 and source_fields[0] is None:
             source_fields = []
-        ret[HL7Field(dct['target_field'])] = HL7Operation.from_name(operation_name, source_fields, args)
+        operation = HL7Operation.from_name(operation_name, source_fields, args)
+        if condition:
+            operation = Conditional(operation, condition)
+        ret[HL7Field(dct['target_field'])] = operation
+    elif 'rules' in dct:
+        rules = []
+        for rule in flatten(dct['rules']):
+            if condition:
+                rule = {target_field: Conditional.wrap(operation, condition) for target_field, operation in rule.items()}
+            rules.append(rule)
+        return rules
     else:
         for key, value in dct.items():
             ret[key] = value
     return ret
 
 
+def flatten(rules):
+    """
+    Inlines the rules of rule groups into the list of rules.
+    """
+    flat = []
+    for rule in rules:
+        if isinstance(rule, list):
+            flat.extend(flatten(rule))
+        else:
+            flat.append(rule)
+    return flat
+
+
 class HL7Mapping(list):
     """
     Contains field mappings and rules how to map fields.
@@ -35,7 +66,7 @@ class HL7Mapping(list):
         """
         with open(path) as f:
             js = json.load(f, object_hook=my_hook)
-        return HL7Mapping(js)
+        return HL7Mapping(flatten(js))
 
     @staticmethod
     def from_csv(path):
@@ -47,6 +78,8 @@ class HL7Mapping(list):
 
             target_field;operation;args.value
             PID.3;set_value;123^^^DOCTOLIB^PI
+
+        Conditions are given in ``when.*`` columns, e.g. ``when.field`` and ``when.equals``.
         """
         js = []
         with open(path) as csv_file:
@@ -56,21 +89,34 @@ class HL7Mapping(list):
                 for key, value in line.items():
                     if '.' in key:
                         key, subkey = key.split('.', 2)
-                        sub = {}
-                        sub[subkey] = value
-                        dic[key] = sub
+                        if key == 'when' and not value:
+                            # rules without condition leave the condition columns empty
+                            continue
+                        dic.setdefault(key, {})[subkey] = value
                     else:
                         dic[key] = value
-                js.append(dic)
-        js = json.loads(json.dumps(js), object_hook=my_hook)
+                js.append(my_hook(dic))
 
         return HL7Mapping(js)
 
+    @staticmethod
+    def from_file(path, mapping_type='json'):
+        """
+        Initialize mapping from a JSON or CSV file.
+        :param path: Path to the mapping file.
+        :param mapping_type: File type, can be json (default) or csv.
+        """
+        if mapping_type == 'json':
+            return HL7Mapping.from_json(path)
+        elif mapping_type == 'csv':
+            return HL7Mapping.from_csv(path)
+        raise TypeError('Unsupported mapping file type. Currently supported are: json, csv.')
+
     @staticmethod
     def from_string(s):
         """Read mapping scheme from a JSON-formatted string"""
         js = json.loads(s, object_hook=my_hook)
-        return HL7Mapping(js)
+        return HL7Mapping(flatten(js))
 
     def __str__(self):
         ret = []
@@ -0,0 +1,143 @@
+"""
+This file contains a cache for loaded mappings, both in memory and on disk.
+
+Parsing a mapping file creates an :class:`HL7Field` and an :class:`HL7Operation`
+for every rule. The cache keeps the most recently used mappings in memory and
+stores the parsed mappings as pickle files, so that later processes can skip parsing.
+Cached mappings are reused as long as the modification time and size of the
+mapping file, or else its content hash, are unchanged.
+
+The cache directory must only be writable by trusted users, since
+cache files are unpickled.
+"""
+import hashlib
+import os
+import pickle
+from collections import OrderedDict
+from threading import Lock
+from hl7_transform.mapping import HL7Mapping
+
+
+CACHE_VERSION = 3
+
+
+class HL7MappingCache:
+    """
+    A least-recently-used cache of mappings loaded from files, with an
+    optional on-disk cache of parsed mappings.
+
+    Mappings returned from the cache are shared, they must not be modified.
+
+    Example usage::
+
+        cache = HL7MappingCache('/var/cache/hl7_transform', maxsize=100)
+        mapping = cache.load('partners/acme.json')
+    """
+    def __init__(self, cache_dir=None, maxsize=32):
+        """
+        :param cache_dir: Directory for cache files, None disables the on-disk cache.
+        :param maxsize: Number of mappings kept in memory.
+        """
+        self.cache_dir = cache_dir
+        self.maxsize = maxsize
+        self._mappings = OrderedDict()
+        self._lock = Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    def load(self, path, mapping_type='json'):
+        """
+        Returns the mapping of a file, parsing the file only if it is
+        neither in memory nor in the on-disk cache.
+
+        :param path: Path to the mapping file.
+        :param mapping_type: Mapping file type, can be json (default) or csv.
+        """
+        path = os.path.abspath(path)
+        stat = os.stat(path)
+        stamp = (stat.st_mtime_ns, stat.st_size)
+        key = (path, mapping_type)
+        with self._lock:
+            entry = self._mappings.get(key)
+            if entry is not None and entry[0] == stamp:
+                self._mappings.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+        mapping = self._load_file(path, mapping_type, stamp)
+        with self._lock:
+            self._mappings[key] = (stamp, mapping)
+            self._mappings.move_to_end(key)
+            while len(self._mappings) > self.maxsize:
+                self._mappings.popitem(last=False)
+        return mapping
+
+    def clear(self):
+        """
+        Empties the in-memory cache. Cache files are kept.
+        """
+        with self._lock:
+            self._mappings.clear()
+
+    def cache_path(self, path, mapping_type):
+        name = hashlib.sha1('{}\0{}'.format(path, mapping_type).encode()).hexdigest()
+        return os.path.join(self.cache_dir, name + '.pickle')
+
+    def _load_file(self, path, mapping_type, stamp):
+        if self.cache_dir is None:
+            self.misses += 1
+            return HL7Mapping.from_file(path, mapping_type)
+        cache_path = self.cache_path(path, mapping_type)
+        entry = self._read_cache_file(cache_path)
+        if entry is not None and entry['stamp'] == stamp:
+            self.disk_hits += 1
+            return entry['mapping']
+        with open(path, 'rb') as f:
+            content_hash = hashlib.sha256(f.read()).hexdigest()
+        if entry is not None and entry['sha256'] == content_hash:
+            # the file was touched but not modified
+            mapping = entry['mapping']
+            self.disk_hits += 1
+        else:
+            mapping = HL7Mapping.from_file(path, mapping_type)
+            self.misses += 1
+        self._write_cache_file(cache_path, {
+            'version': CACHE_VERSION,
+            'path': path,
+            'stamp': stamp,
+            'sha256': content_hash,
+            'mapping': mapping,
+        })
+        return mapping
+
+    @staticmethod
+    def _read_cache_file(cache_path):
+        try:
+            with open(cache_path, 'rb') as f:
+                entry = pickle.load(f)
+        except (OSError, EOFError, pickle.UnpicklingError, AttributeError, ImportError, TypeError):
+            return None
+        if not isinstance(entry, dict) or entry.get('version') != CACHE_VERSION:
+            return None
+        return entry
+
+    def _write_cache_file(self, cache_path, entry):
+        os.makedirs(self.cache_dir, exist_ok=True)
+        tmp_path = '{}.{}.tmp'.format(cache_path, os.getpid())
+        with open(tmp_path, 'wb') as f:
+            pickle.dump(entry, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, cache_path)
+
+
+_default_caches = {}
+
+
+def load_mapping(path, mapping_type='json', cache_dir=None):
+    """
+    Loads a mapping through a process-wide :class:`HL7MappingCache`
+    (one per cache directory).
+    """
+    cache = _default_caches.get(cache_dir)
+    if cache is None:
+        cache = _default_caches.setdefault(cache_dir, HL7MappingCache(cache_dir))
+    return cache.load(path, mapping_type)
@@ -1,123 +1,380 @@
 """
 This file contains a wrapper for an HL7 message with convenience functions.
 """
-from hl7apy.parser import parse_message
-from hl7apy.core import Message as hl7apy_message
+from hl7_transform.er7 import ER7Message
+
+
+PARSERS = ('hl7apy', 'native', 'lazy')
+
+VALIDATION_LEVELS = ('tolerant', 'strict')
+
+HL7_VERSIONS = ('2.3', '2.3.1', '2.4', '2.5', '2.5.1', '2.6', '2.7', '2.8')
+"""The HL7 versions preloaded by default, see :func:`preload_hl7apy`."""
+
+# a message that is valid in every version, with the version in MSH-12
+WARM_UP_MESSAGE = 'MSH|^~\\&|A|B|C|D|20200101000000||ADT^A01|1|P|{}\rPID|1||1||Doe^John'
+
+_preloaded = set()
+
+
+def parser_backend(parser):
+    """
+    Returns the backend of a parser, see :attr:`HL7Message.backend`.
+    The native and the lazy parser serialize messages the same way.
+    """
+    return 'native' if parser in ('native', 'lazy') else parser
+
+
+def validation_level(validation):
+    """
+    Returns the hl7apy validation level of `tolerant` or `strict`.
+    """
+    if validation not in VALIDATION_LEVELS:
+        raise ValueError('Unsupported validation level {}. Currently supported are: {}.'.format(validation, ', '.join(VALIDATION_LEVELS)))
+    from hl7apy.consts import VALIDATION_LEVEL
+    return VALIDATION_LEVEL.STRICT if validation == 'strict' else VALIDATION_LEVEL.TOLERANT
+
+
+def preload_hl7apy(versions=HL7_VERSIONS, validation_levels=('tolerant',)):
+    """
+    Loads hl7apy, the reference structures of HL7 versions and the modules
+    hl7apy imports while parsing, by parsing a small message per version and
+    validation level. This moves the cost of the first message of every version
+    to start-up, e.g. of a server, or to the parent of a worker pool, whose
+    forked workers then share the loaded structures copy-on-write.
+    Versions and levels that were preloaded before are skipped.
+
+    :param versions: HL7 versions, see :data:`HL7_VERSIONS`.
+    :param validation_levels: hl7apy validation levels, see :data:`VALIDATION_LEVELS`.
+    """
+    from hl7apy import load_library
+    from hl7apy.parser import parse_message
+    for version in versions:
+        for validation in validation_levels:
+            if (version, validation) in _preloaded:
+                continue
+            load_library(version)
+            parse_message(WARM_UP_MESSAGE.format(version), validation_level(validation), find_groups=False)
+            _preloaded.add((version, validation))
 
 
 class HL7Message:
     """
     Encapsulates an HL7 message.
     """
+    backend = 'hl7apy'
+    """The parser backend, messages of different backends may be serialized differently."""
+
     def __init__(self, hl7_message):
         """
         Initialize using a message parsed with hl7 library.
+
+        Field lookups go through an index that is built on first access and
+        kept up to date by :meth:`__setitem__`. If you modify `hl7_message`
+        directly, call :meth:`invalidate_index` afterwards.
         """
         self.hl7_message = hl7_message
+        self.invalidate_index()
+
+    def invalidate_index(self):
+        """
+        Drops the field lookup index, it will be rebuilt on next access.
+        """
+        self._segments = None
+        self._fields = None
+        self._segment_fields = None
+        self._components = {}
+        self._rendered = {}
 
     @staticmethod
-    def from_string(txt):
+    def from_string(txt, parser='hl7apy'):
         """
         Initialize a message from string.
+
+        :param parser: The parser backend, one of :data:`PARSERS`.
+            `hl7apy` (default) builds a validated hl7apy element tree,
+            `native` uses the much faster :class:`ER7Message` splitter,
+            see :class:`NativeHL7Message`. `lazy` is the native parser
+            splitting segments into fields only on first access, which is
+            faster for mappings that touch few segments of large messages.
+
+        hl7apy parses in its cheapest mode, with tolerant validation and without
+        detecting segment groups. The native parsers do not validate messages.
         """
+        if parser == 'native':
+            return NativeHL7Message(ER7Message.parse(txt))
+        if parser == 'lazy':
+            return NativeHL7Message(ER7Message.parse(txt, lazy=True))
+        if parser != 'hl7apy':
+            raise ValueError('Unsupported parser {}. Currently supported are: {}.'.format(parser, ', '.join(PARSERS)))
+        from hl7apy.parser import parse_message
         txt = txt.replace('\n', '\r')
-        return HL7Message(parse_message(txt, find_groups=False))
+        return HL7Message(parse_message(txt, validation_level('tolerant'), find_groups=False))
 
     @staticmethod
-    def from_file(path):
+    def from_file(path, parser='hl7apy'):
         """
         Initialize a message from a file.
         """
         with open(path) as f:
             txt = f.read().strip()
-        return HL7Message.from_string(txt)
+        return HL7Message.from_string(txt, parser)
 
     @staticmethod
-    def new():
-        hl7_message = hl7apy_message()
-        return HL7Message(hl7_message)
+    def new(parser='hl7apy'):
+        if parser in ('native', 'lazy'):
+            return NativeHL7Message(ER7Message.new())
+        from hl7apy.core import Message
+        return HL7Message(Message())
+
+    def copy(self):
+        """
+        Returns an independent copy of the message, parsed again from the
+        ER7 representation of its segments with the validation level of the message.
+        """
+        return self.parsed_like('\r'.join(self.segment_strings()))
+
+    def parsed_like(self, txt):
+        """
+        Parses a message with the parser backend and the validation level of this message.
+        """
+        from hl7apy.parser import parse_message
+        return HL7Message(parse_message(txt.replace('\n', '\r'), self.hl7_message.validation_level, find_groups=False))
 
     def to_string(self):
         """
         Returns a string representation of the encapsulated HL7 message.
         """
-        return self.hl7_message.to_er7().replace('\r', '\n')
+        return '\n'.join(self.segment_strings())
+
+    def segment_strings(self):
+        """
+        Returns the list of ER7 representations of the segments, in message order.
+        Representations are cached per segment until the segment is modified
+        by :meth:`__setitem__`, so only modified segments are rendered.
+        """
+        rendered = self._rendered
+        strings = []
+        for segment in self.hl7_message.children:
+            txt = rendered.get(id(segment))
+            if txt is None:
+                txt = rendered[id(segment)] = segment.to_er7()
+            strings.append(txt)
+        return strings
+
+    def write(self, f, segment_separator='\n'):
+        """
+        Writes the message segment by segment to an open text file,
+        without building the string of the whole message.
+        """
+        for txt in self.segment_strings():
+            f.write(txt)
+            f.write(segment_separator)
+
+    def to_bytes(self, encoding='utf-8', segment_separator='\r'):
+        """
+        Returns the encoded message, with segments separated by carriage
+        returns as required on the wire, e.g. by MLLP.
+        """
+        return segment_separator.encode(encoding).join(txt.encode(encoding) for txt in self.segment_strings())
+
+    def segment_string(self, name):
+        """
+        Returns the ER7 representation of the first segment of the given name,
+        None if the message has no such segment.
+        """
+        if self._fields is None:
+            self._build_index()
+        segments = self._segments.get(name)
+        if not segments:
+            return None
+        txt = self._rendered.get(id(segments[0]))
+        if txt is None:
+            txt = self._rendered[id(segments[0])] = segments[0].to_er7()
+        return txt
+
+    def _build_index(self):
+        """
+        Builds the positional lookup index of the message:
+
+        - the segments of every segment name, in message order,
+        - for every segment, the repetitions of every field name,
+        - for every field name, the repetitions in the first segment that contains the field.
+
+        Components are indexed lazily per field repetition, see :meth:`_get_components`.
+        """
+        self._segments = {}
+        self._fields = {}
+        self._segment_fields = {}
+        self._components = {}
+        for segment in self.hl7_message.children:
+            self._segments.setdefault(segment.name, []).append(segment)
+            fields = self._segment_fields[id(segment)] = {}
+            for field in segment.children:
+                repetitions = fields.get(field.name)
+                if repetitions is None:
+                    repetitions = fields[field.name] = []
+                    self._fields.setdefault(field.name, repetitions)
+                repetitions.append(field)
+
+    def _get_components(self, field):
+        """
+        Returns a dictionary of the components of a field, keyed by component index.
+        """
+        components = self._components.get(id(field))
+        if components is None:
+            components = {}
+            for component_index, component in enumerate(field.children, start=1):
+                if component.long_name is not None:
+                    component_index = int(component.name.split('_')[1])
+                components.setdefault(component_index, component)
+            self._components[id(field)] = components
+        return components
+
+    def _get_repetitions(self, index):
+        """
+        Returns the list of repetitions of the field addressed by `index`,
+        None if the segment or the field does not exist.
+        """
+        if index.occurrence is None:
+            return self._fields.get(index.field_name)
+        segments = self._segments.get(index.segment)
+        if segments is None or len(segments) < index.occurrence:
+            return None
+        return self._segment_fields[id(segments[index.occurrence - 1])].get(index.field_name)
 
     def __getitem__(self, index):
         """
-        Index fields in the HL7 message using HL7Field as key. Can retrieve field or subfield values.
-        """
-        segments = self.hl7_message.children
-        for segment in segments:
-            if segment.name == index.segment:
-                for field in segment.children:
-                    if field.name == index.field_name:
-                        if index.component > 0:
-                            for component_index, component in enumerate(field.children, start=1):
-                                if component.long_name is None:
-                                    comp_name_parts = (None, str(component_index),)
-                                else:
-                                    comp_name_parts = component.name.split('_')
-                                component_name = field.name + '_' + comp_name_parts[1]
-                                if component_name == index.component_name:
-                                    return component.value
-                            raise KeyError('Component {} does not exist'.format(index.component_name))
-                        return field.value
-        raise KeyError('Could not retrieve {}'.format(index))
+        Index fields in the HL7 message using HL7Field as key. Can retrieve field,
+        component or sub-component values.
+        """
+        if self._fields is None:
+            self._build_index()
+        repetitions = self._get_repetitions(index)
+        if repetitions is None or len(repetitions) < index.repetition:
+            raise KeyError('Could not retrieve {}'.format(index))
+        field = repetitions[index.repetition - 1]
+        if index.component > 0:
+            component = self._get_components(field).get(index.component)
+            if component is None:
+                raise KeyError('Component {} does not exist'.format(index.component_name))
+            if index.sub_component > 0:
+                sub_components = component.value.split(self.hl7_message.encoding_chars['SUBCOMPONENT'])
+                if index.sub_component > len(sub_components):
+                    raise KeyError('Sub-component {} does not exist'.format(index))
+                return sub_components[index.sub_component - 1]
+            return component.value
+        return field.value
 
     def __setitem__(self, index, value):
-        def set_component_value(field, index, value):
-            if index.component > 0:
-                for component_index, component in enumerate(field.children, start=1):
-                    if component.long_name is None:
-                        comp_name_parts = (None, str(component_index),)
-                    else:
-                        comp_name_parts = component.name.split('_')
-                    component_name = field.name + '_' + comp_name_parts[1]
-                    if component_name == index.component_name:
-                        component.value = value
-                        return True
-
-            if index.component == 0:
-                str_value = value
-            else:
-                # insert component value in the right position
-                component_separator = self.hl7_message.encoding_chars['COMPONENT']
-                component_dict = {}
-                for component in field.children:
-                    comp_name_parts = component.name.split('_')
-                    component_name = field.name + '_' + comp_name_parts[1]
-                    component_index = int(comp_name_parts[1])
-                    component_dict[component_index] = component.value
-                component_dict[index.component] = value
-
-                comp_value_list = [''] * max(len(component_dict), index.component)
-                for comp_index, comp_value in component_dict.items():
-                    comp_value_list.insert(comp_index - 1, comp_value)
-                str_value = component_separator.join(comp_value_list)
-            field.value = str_value
-            return True
-
-        def set_field_value(segment, index, value):
-            for field in segment.children:
-                if field.name == index.field_name:
-                    res = set_component_value(field, index, value)
-                    if res:
-                        return True
-                    field = value
-                    return True
-
-            field = segment.add_field(index.field_name)
-            set_component_value(field, index, value)
-            return True
-
-        res = False
-        segments = self.hl7_message.children
-        for segment in segments:
-            if segment.name == index.segment:
-                res = set_field_value(segment, index, value)
-                break
-
-        if not res:
+        """
+        Writes a value into the message, adding segment occurrences and
+        field repetitions as needed. Without segment occurrence, the value
+        is written into the first segment of the given name.
+        """
+        if self._fields is None:
+            self._build_index()
+        segments = self._segments.setdefault(index.segment, [])
+        occurrence = index.occurrence or 1
+        while len(segments) < occurrence:
             segment = self.hl7_message.add_segment(index.segment)
-            res = set_field_value(segment, index, value)
+            self._segment_fields[id(segment)] = {}
+            segments.append(segment)
+        segment = segments[occurrence - 1]
+        fields = self._segment_fields[id(segment)]
+        repetitions = fields.get(index.field_name)
+        if repetitions is None:
+            repetitions = [segment.add_field(index.field_name)]
+            fields[index.field_name] = repetitions
+            first = self._fields.get(index.field_name)
+            if first is None or segments.index(first[0].parent) > occurrence - 1:
+                self._fields[index.field_name] = repetitions
+        while len(repetitions) < index.repetition:
+            repetitions.append(segment.add_field(index.field_name))
+        field = repetitions[index.repetition - 1]
+        if index.sub_component > 0:
+            value = self._sub_component_value(field, index, value)
+        self._set_component_value(field, index, value)
+        self._components.pop(id(field), None)
+        self._rendered.pop(id(segment), None)
+
+    def _sub_component_value(self, field, index, value):
+        """
+        Returns the value of the component addressed by `index` with the
+        sub-component replaced by `value`.
+        """
+        component = self._get_components(field).get(index.component)
+        sub_component_separator = self.hl7_message.encoding_chars['SUBCOMPONENT']
+        sub_components = [] if component is None else component.value.split(sub_component_separator)
+        if len(sub_components) < index.sub_component:
+            sub_components.extend([''] * (index.sub_component - len(sub_components)))
+        sub_components[index.sub_component - 1] = value
+        return sub_component_separator.join(sub_components)
+
+    def _set_component_value(self, field, index, value):
+        if index.component > 0:
+            component = self._get_components(field).get(index.component)
+            if component is not None:
+                component.value = value
+                return
+
+        if index.component == 0:
+            str_value = value
+        else:
+            # insert component value in the right position
+            component_separator = self.hl7_message.encoding_chars['COMPONENT']
+            component_dict = {}
+            for component in field.children:
+                comp_name_parts = component.name.split('_')
+                component_index = int(comp_name_parts[1])
+                component_dict[component_index] = component.value
+            component_dict[index.component] = value
+
+            comp_value_list = [''] * max(len(component_dict), index.component)
+            for comp_index, comp_value in component_dict.items():
+                comp_value_list.insert(comp_index - 1, comp_value)
+            str_value = component_separator.join(comp_value_list)
+        field.value = str_value
+
+
+class NativeHL7Message(HL7Message):
+    """
+    Encapsulates an HL7 message parsed with the native :class:`ER7Message` parser.
+
+    Values are read and written as delimited strings, without validation
+    against the HL7 reference structures. Unlike with hl7apy, empty fields
+    and components within a segment can be read and return an empty string,
+    and fields are serialized exactly as they were parsed.
+    """
+    backend = 'native'
+
+    def __init__(self, hl7_message):
+        """
+        Initialize using a message parsed with :class:`ER7Message`.
+        """
+        self.hl7_message = hl7_message
+
+    def invalidate_index(self):
+        self.hl7_message.build_index()
+
+    def copy(self):
+        """
+        Returns a copy-on-write copy of the message: segments are shared
+        until they are modified in either message, see :meth:`ER7Message.copy`.
+        """
+        return NativeHL7Message(self.hl7_message.copy())
+
+    def parsed_like(self, txt):
+        return NativeHL7Message(ER7Message.parse(txt, lazy=True))
+
+    def segment_strings(self):
+        return self.hl7_message.segment_strings()
+
+    def segment_string(self, name):
+        return self.hl7_message.segment_string(name)
+
+    def __getitem__(self, index):
+        return self.hl7_message.get(index)
+
+    def __setitem__(self, index, value):
+        self.hl7_message.set(index, value)
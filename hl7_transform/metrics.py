@@ -0,0 +1,134 @@
+"""
+This file contains opt-in instrumentation: timings and counters per mapping
+rule, per operation class and per pipeline stage (parse, transform, serialize).
+
+Example usage::
+
+    metrics = HL7Metrics()
+    transform = HL7Transform(mapping, metrics=metrics)
+    with metrics.measure('parse'):
+        message = HL7Message.from_string(txt)
+    transform(message)
+    with metrics.measure('serialize'):
+        txt = message.to_string()
+    print(metrics.to_prometheus())
+"""
+from contextlib import contextmanager
+from threading import Lock
+from time import perf_counter
+
+
+class Counter:
+    """
+    Cumulative wall time, number of calls and number of errors.
+    """
+    __slots__ = ('calls', 'errors', 'seconds')
+
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.seconds = 0.
+
+    def to_dict(self):
+        return {'calls': self.calls, 'errors': self.errors, 'seconds': self.seconds}
+
+
+class HL7Metrics:
+    """
+    Collects timings and counters. Instrumentation is disabled unless an
+    instance of this class is passed to :class:`HL7Transform`, so there is
+    no overhead for transforms without metrics.
+
+    Records are serialized by a lock, so one instance can be shared by
+    transforms running in several threads.
+    """
+    def __init__(self):
+        self._lock = Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.rules = {}
+            self.operations = {}
+            self.stages = {}
+
+    def _counter(self, counters, key):
+        counter = counters.get(key)
+        if counter is None:
+            counter = counters[key] = Counter()
+        return counter
+
+    def record_rule(self, target_field, operation, seconds, error=False, calls=1):
+        """
+        Records the execution of a mapping rule.
+
+        :param error: True if the execution failed, or the number of failed
+            messages if the rule was executed on a batch.
+        :param calls: The number of messages the rule was executed on.
+        """
+        with self._lock:
+            for counter in (self._counter(self.rules, target_field.name),
+                            self._counter(self.operations, operation.__class__.__name__)):
+                counter.calls += calls
+                counter.seconds += seconds
+                counter.errors += int(error)
+
+    def record_write(self, target_field, seconds):
+        """
+        Adds the time of writing the result of a rule into the message.
+        """
+        with self._lock:
+            self._counter(self.rules, target_field.name).seconds += seconds
+
+    def record_stage(self, stage, seconds, error=False):
+        with self._lock:
+            counter = self._counter(self.stages, stage)
+            counter.calls += 1
+            counter.seconds += seconds
+            if error:
+                counter.errors += 1
+
+    @contextmanager
+    def measure(self, stage):
+        """
+        Times a block of code as a pipeline stage, e.g. parse or serialize.
+        An exception raised in the block is counted as an error.
+        """
+        start = perf_counter()
+        try:
+            yield
+        except BaseException:
+            self.record_stage(stage, perf_counter() - start, error=True)
+            raise
+        self.record_stage(stage, perf_counter() - start)
+
+    def to_dict(self):
+        """
+        :return: A dictionary with keys rules, operations and stages, each
+            mapping a name to a dictionary of calls, errors and seconds.
+        """
+        with self._lock:
+            return {
+                'rules': {key: counter.to_dict() for key, counter in self.rules.items()},
+                'operations': {key: counter.to_dict() for key, counter in self.operations.items()},
+                'stages': {key: counter.to_dict() for key, counter in self.stages.items()},
+            }
+
+    def to_prometheus(self, prefix='hl7_transform'):
+        """
+        :return: The metrics in the Prometheus text exposition format.
+        """
+        metrics = self.to_dict()
+        lines = []
+        for group, label, counters in (('rule', 'target_field', metrics['rules']),
+                                       ('operation', 'operation', metrics['operations']),
+                                       ('stage', 'stage', metrics['stages'])):
+            for metric, unit in (('seconds', 'Cumulative wall time in seconds'),
+                                 ('calls', 'Number of calls'),
+                                 ('errors', 'Number of errors')):
+                name = '{}_{}_{}_total'.format(prefix, group, metric)
+                lines.append('# HELP {} {} per {}.'.format(name, unit, group))
+                lines.append('# TYPE {} counter'.format(name))
+                for key, counter in counters.items():
+                    lines.append('{}{{{}="{}"}} {}'.format(name, label, key, counter[metric]))
+        return '\n'.join(lines) + '\n'
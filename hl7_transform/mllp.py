@@ -0,0 +1,277 @@
+"""
+This file contains an asyncio MLLP server that transforms messages in flight
+and forwards them to a downstream MLLP endpoint, acting as a minimal
+integration engine.
+
+MLLP (minimal lower layer protocol) frames every message as
+``<VT> message <FS><CR>`` and answers every message with an ACK message.
+"""
+import asyncio
+import logging
+from datetime import datetime
+from hl7_transform.batch import MLLP_START_BLOCK, MLLP_END_BLOCK
+from hl7_transform.er7 import ER7Message
+from hl7_transform.message import HL7Message
+
+
+logger = logging.getLogger(__name__)
+
+START_BLOCK = MLLP_START_BLOCK.encode()
+END_BLOCK = (MLLP_END_BLOCK + '\r').encode()
+
+MAX_MESSAGE_SIZE = 16 * 1024 * 1024
+"""The default maximal size in bytes of a framed message, e.g. of an ORU with embedded documents."""
+
+
+def frame(txt, encoding='utf-8'):
+    """
+    Wraps a message in an MLLP frame. Segments are separated by carriage returns.
+
+    :param txt: The message as a string, or as bytes already encoded with
+        carriage returns, see :meth:`HL7Message.to_bytes`.
+    """
+    if isinstance(txt, bytes):
+        return START_BLOCK + txt + END_BLOCK
+    return START_BLOCK + txt.replace('\n', '\r').encode(encoding) + END_BLOCK
+
+
+async def read_frame(reader, encoding='utf-8'):
+    """
+    Reads one MLLP framed message from a stream.
+
+    :return: The message as a string, None if the connection was closed.
+    :raises asyncio.LimitOverrunError: If the message is larger than the limit of the stream.
+    """
+    try:
+        data = await reader.readuntil(END_BLOCK)
+    except asyncio.IncompleteReadError:
+        return None
+    start = data.find(START_BLOCK)
+    return data[start + 1:-len(END_BLOCK)].decode(encoding, errors='replace')
+
+
+def make_ack(txt, code='AA', text=''):
+    """
+    Creates an acknowledgment for a message.
+
+    :param txt: The acknowledged message.
+    :param code: The acknowledgment code: AA (accept), AE (error) or AR (reject).
+    :param text: An optional text message, e.g. the reason of an error.
+    :return: The ACK message as a string with segments separated by carriage returns.
+    """
+    try:
+        header = ER7Message.parse(txt).segments[0]
+    except Exception:
+        header = ER7Message.new().segments[0]
+    header = header + [''] * (13 - len(header))
+    ack = ER7Message([
+        ['MSH', header[1], header[2], header[5], header[6], header[3], header[4],
+         datetime.now().strftime('%Y%m%d%H%M%S'), '', 'ACK', header[10], header[11], header[12]],
+        ['MSA', code, header[10]],
+    ], header[1], header[2])
+    if text:
+        ack.segments[1].append(ack.escape(text.replace(ack.escape_char, ' ')))
+    trigger_event = header[9].split(ack.component_separator)[1:2]
+    if trigger_event:
+        ack.segments[0][9] += ack.component_separator + trigger_event[0]
+    return ack.to_er7()
+
+
+def ack_code(txt):
+    """
+    Returns the acknowledgment code (MSA-1) of an ACK message, None if there is none.
+    """
+    for segment in txt.replace('\n', '\r').split('\r'):
+        if segment.startswith('MSA'):
+            return segment[4:].split(segment[3:4] or '|', 1)[0]
+    return None
+
+
+class MLLPConnectionPool:
+    """
+    A pool of persistent connections to a downstream MLLP endpoint.
+    At most `size` messages are sent concurrently, further senders wait.
+    """
+    def __init__(self, host, port, size=10, timeout=30, encoding='utf-8', max_message_size=MAX_MESSAGE_SIZE):
+        self.host = host
+        self.port = port
+        self.size = size
+        self.timeout = timeout
+        self.encoding = encoding
+        self.max_message_size = max_message_size
+        self._idle = []
+        self._slots = None
+
+    async def send(self, txt):
+        """
+        Sends a message and waits for the ACK of the downstream endpoint.
+
+        :param txt: The message as a string or as encoded bytes, see :func:`frame`.
+
+        :return: The ACK message as a string.
+        """
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.size)
+        async with self._slots:
+            while self._idle:
+                # an idle connection may have been closed by the endpoint in the meantime
+                reader, writer = self._idle.pop()
+                try:
+                    return await self._send(reader, writer, txt)
+                except ConnectionError:
+                    pass
+            reader, writer = await asyncio.wait_for(asyncio.open_connection(self.host, self.port, limit=self.max_message_size),
+                                                    self.timeout)
+            return await self._send(reader, writer, txt)
+
+    async def _send(self, reader, writer, txt):
+        try:
+            writer.write(frame(txt, self.encoding))
+            await writer.drain()
+            ack = await asyncio.wait_for(read_frame(reader, self.encoding), self.timeout)
+            if ack is None:
+                raise ConnectionError('Connection closed by {}:{}'.format(self.host, self.port))
+        except BaseException:
+            writer.close()
+            raise
+        self._idle.append((reader, writer))
+        return ack
+
+    async def close(self):
+        idle, self._idle = self._idle, []
+        for _, writer in idle:
+            writer.close()
+            await writer.wait_closed()
+
+
+class HL7MLLPServer:
+    """
+    Accepts MLLP framed messages, transforms them, forwards them to a
+    downstream endpoint and acknowledges them upstream.
+
+    Every upstream connection is served in order, the next message is read
+    only after the previous one has been acknowledged. Across connections,
+    at most `max_in_flight` messages are processed at the same time,
+    which applies backpressure to senders when the downstream is slow.
+
+    Example usage::
+
+        server = HL7MLLPServer(HL7Transform(mapping), downstream=('10.0.0.2', 2575))
+        asyncio.run(server.serve_forever('0.0.0.0', 2575))
+    """
+    def __init__(self, transform, downstream=None, parser='native', pool_size=10, max_in_flight=1000, timeout=30, encoding='utf-8',
+                 max_message_size=MAX_MESSAGE_SIZE):
+        """
+        :param transform: The :class:`HL7Transform` applied to every message.
+        :param downstream: A (host, port) tuple of the endpoint transformed messages
+            are forwarded to. If None, messages are only transformed and acknowledged.
+        :param parser: Message parser, see :data:`hl7_transform.message.PARSERS`.
+        :param pool_size: Maximal number of connections to the downstream endpoint.
+        :param max_in_flight: Maximal number of messages processed at the same time.
+        :param timeout: Timeout in seconds for downstream connections and ACKs.
+        :param max_message_size: Maximal size in bytes of a framed message, upstream and downstream.
+            Larger messages are rejected with an AR acknowledgment and their connection is closed.
+        """
+        self.transform = transform
+        self.parser = parser
+        self.encoding = encoding
+        self.pool = None
+        if downstream is not None:
+            self.pool = MLLPConnectionPool(downstream[0], downstream[1], pool_size, timeout, encoding, max_message_size)
+        self.max_in_flight = max_in_flight
+        self.max_message_size = max_message_size
+        self._in_flight = None
+        self.server = None
+
+    async def start(self, host='127.0.0.1', port=2575):
+        """
+        Starts listening. Use port 0 to pick a free port, see :attr:`port`.
+        """
+        self._in_flight = asyncio.Semaphore(self.max_in_flight)
+        self.server = await asyncio.start_server(self.handle_connection, host, port, limit=self.max_message_size)
+        return self.server
+
+    @property
+    def port(self):
+        return self.server.sockets[0].getsockname()[1]
+
+    async def serve_forever(self, host='127.0.0.1', port=2575):
+        await self.start(host, port)
+        async with self.server:
+            await self.server.serve_forever()
+
+    async def close(self):
+        if self.server is not None:
+            self.server.close()
+            await self.server.wait_closed()
+        if self.pool is not None:
+            await self.pool.close()
+
+    async def handle_connection(self, reader, writer):
+        try:
+            while True:
+                try:
+                    txt = await read_frame(reader, self.encoding)
+                except (asyncio.LimitOverrunError, ValueError):
+                    await self.reject_oversized(reader, writer)
+                    break
+                if txt is None:
+                    break
+                async with self._in_flight:
+                    ack = await self.process(txt)
+                writer.write(frame(ack, self.encoding))
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def reject_oversized(self, reader, writer):
+        """
+        Rejects a message larger than :attr:`max_message_size`. The rest of the message
+        cannot be told apart from the next one, so the connection is closed afterwards.
+        """
+        head = (await reader.read(self.max_message_size)).decode(self.encoding, errors='replace')
+        head = head[head.find(MLLP_START_BLOCK) + 1:]
+        logger.warning('Message larger than %d bytes rejected, closing the connection', self.max_message_size)
+        writer.write(frame(make_ack(head, 'AR', 'Message larger than {} bytes'.format(self.max_message_size)), self.encoding))
+        await writer.drain()
+
+    def transform_message(self, txt):
+        """
+        Parses and transforms one message. Runs in a thread of the default
+        executor, so that the event loop keeps serving other connections.
+
+        :return: The transformed message encoded for forwarding and None,
+            or None and the NACK message if the message failed.
+        """
+        try:
+            message = HL7Message.from_string(txt, self.parser)
+        except Exception as e:
+            return None, make_ack(txt, 'AR', 'Invalid message: {}'.format(e))
+        try:
+            message = self.transform(message)
+        except Exception as e:
+            return None, make_ack(txt, 'AE', str(e))
+        return message.to_bytes(self.encoding), None
+
+    async def process(self, txt):
+        """
+        Transforms and forwards one message.
+
+        :return: The ACK message to send upstream.
+        """
+        data, nack = await asyncio.get_event_loop().run_in_executor(None, self.transform_message, txt)
+        if nack is not None:
+            return nack
+        if self.pool is not None:
+            try:
+                downstream_ack = await self.pool.send(data)
+            except (OSError, asyncio.TimeoutError) as e:
+                return make_ack(txt, 'AE', 'Downstream not available: {}'.format(e))
+            except (asyncio.LimitOverrunError, asyncio.IncompleteReadError, ValueError) as e:
+                return make_ack(txt, 'AE', 'Invalid downstream acknowledgment: {}'.format(e))
+            code = ack_code(downstream_ack)
+            if code not in ('AA', 'CA'):
+                return make_ack(txt, 'AE', 'Downstream replied {}'.format(code))
+        return make_ack(txt, 'AA')
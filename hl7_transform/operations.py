@@ -2,10 +2,13 @@
 A list of operations.
 """
 
+from hl7_transform.dtm import HL7DateTime, PRECISIONS, get_timezone
 from hl7_transform.field import HL7Field
-import hashlib
-import random
-from datetime import datetime, timedelta
+from hl7_transform.lookup import load_table
+import os
+from datetime import datetime
+from threading import Lock
+from time import time
 from abc import ABC, abstractmethod
 
 
@@ -13,6 +16,11 @@ class HL7Operation(ABC):
     """
     An Operation interface, all operations must derive from this class.
     """
+    deterministic = True
+    """False for operations whose result is not determined by the message,
+    e.g. generated IDs. Results of mappings with such operations are not cached,
+    see :class:`HL7ResultCache`."""
+
     def __init__(self, source_fields, args):
         raise NotImplementedError()
 
@@ -28,6 +36,13 @@ class HL7Operation(ABC):
     def __str__(self):
         return '<{}>'.format(self.__class__.__name__)
 
+    def reads(self):
+        """
+        Returns the list of fields the operation reads from a message.
+        Operations that read no field, such as :class:`SetValue`, cannot fail.
+        """
+        return []
+
     @staticmethod
     def from_name(name, *args):
         """
@@ -43,6 +58,13 @@ class HL7Operation(ABC):
             - generate_numeric_id:          :class:`GenerateNumericID`,
             - generate_current_datetime:    :class:`GenerateCurrentDatetime`,
             - set_end_time:                 :class:`SetEndTime`,
+            - lookup_value:                 :class:`LookupValue`,
+            - add_duration:                 :class:`AddDuration`,
+            - subtract_duration:            :class:`SubtractDuration`,
+            - convert_timezone:             :class:`ConvertTimezone`,
+            - truncate_datetime:            :class:`TruncateDatetime`,
+            - format_datetime:              :class:`FormatDatetime`,
+            - compute_age:                  :class:`ComputeAge`,
 
         """
         operations = {
@@ -54,6 +76,13 @@ class HL7Operation(ABC):
             'generate_numeric_id':          GenerateNumericID,
             'generate_current_datetime':    GenerateCurrentDatetime,
             'set_end_time':                 SetEndTime,
+            'lookup_value':                 LookupValue,
+            'add_duration':                 AddDuration,
+            'subtract_duration':            SubtractDuration,
+            'convert_timezone':             ConvertTimezone,
+            'truncate_datetime':            TruncateDatetime,
+            'format_datetime':              FormatDatetime,
+            'compute_age':                  ComputeAge,
             # 'delete_segment':               DeleteSegment,
         }
         try:
@@ -95,6 +124,9 @@ class AddValues(HL7Operation):
     def __call__(self, message):
         return str(sum(self.convert_to_type(message[field]) for field in self.source_fields))
 
+    def reads(self):
+        return list(self.source_fields)
+
 
 class CopyValue(HL7Operation):
     """
@@ -118,6 +150,9 @@ class CopyValue(HL7Operation):
     def __call__(self, message):
         return message[self.field]
 
+    def reads(self):
+        return [self.field]
+
 
 class SetValue(HL7Operation):
     """
@@ -140,11 +175,66 @@ class SetValue(HL7Operation):
         return self.value
 
 
-class GenerateAplhanumericID(SetValue):
+class RandomBytes:
+    """
+    A source of random bytes that reads from :func:`os.urandom` in blocks,
+    so that generating an identifier costs a slice instead of a system call.
+    The buffer is discarded in forked child processes, so that worker
+    processes do not generate the same identifiers.
+    """
+    def __init__(self, block_size=4096):
+        self.block_size = block_size
+        self._lock = Lock()
+        self._buffer = b''
+        self._offset = 0
+        if hasattr(os, 'register_at_fork'):
+            os.register_at_fork(after_in_child=self._discard)
+
+    def _discard(self):
+        self._lock = Lock()
+        self._buffer = b''
+        self._offset = 0
+
+    def __call__(self, size):
+        with self._lock:
+            start = self._offset
+            self._offset = end = start + size
+            if end > len(self._buffer):
+                self._buffer = os.urandom(max(self.block_size, size))
+                start = 0
+                self._offset = end = size
+            return self._buffer[start:end]
+
+
+class SecondClock:
+    """
+    Returns the current local time formatted with `time_format`,
+    formatting it only once per second.
+    """
+    def __init__(self, time_format='%Y%m%d%H%M%S'):
+        self.time_format = time_format
+        self._current = (None, None)
+
+    def __call__(self):
+        second = int(time())
+        cached_second, value = self._current
+        if second != cached_second:
+            value = datetime.fromtimestamp(second).strftime(self.time_format)
+            # one tuple, so that concurrent readers never see a second with the value of another
+            self._current = (second, value)
+        return value
+
+
+random_bytes = RandomBytes()
+hl7_clock = SecondClock()
+
+
+class GenerateAplhanumericID(HL7Operation):
     """
     Generates an alphanumeric ID, producing a random string encoded in the
     hexadecimal system of length 32 bytes.
     This is useful for creating random message identifiers.
+    A new ID is generated for every message.
 
     Example usage in a mapping scheme::
 
@@ -155,16 +245,21 @@ class GenerateAplhanumericID(SetValue):
             }
         ]
     """
+    deterministic = False
+
     def __init__(self, source_fields, args):
-        args['value'] = hashlib.md5(str(random.Random().random()).encode()).hexdigest()
-        SetValue.__init__(self, source_fields, args)
+        pass
+
+    def __call__(self, message):
+        return random_bytes(16).hex()
 
 
-class GenerateNumericID(SetValue):
+class GenerateNumericID(HL7Operation):
     """
     Generates an numeric ID, producing a random string encoded with digits
     in decimal system of length 9 digits.
     This is useful for creating random patient or event identifiers.
+    A new ID is generated for every message.
 
     Example usage in a mapping scheme::
 
@@ -175,15 +270,20 @@ class GenerateNumericID(SetValue):
             }
         ]
     """
+    deterministic = False
+
     def __init__(self, source_fields, args):
-        args['value'] = '{:09}'.format(random.Random().randint(0, 1e9))
-        SetValue.__init__(self, source_fields, args)
+        pass
+
+    def __call__(self, message):
+        return '{:09}'.format(int.from_bytes(random_bytes(8), 'big') % 1000000000)
 
 
-class GenerateCurrentDatetime(SetValue):
+class GenerateCurrentDatetime(HL7Operation):
     """
     Generates current datetime as a string in HL7 format.
     This is useful for creating event timestamps.
+    The datetime is taken when the message is transformed.
 
     Example usage in a mapping scheme::
 
@@ -194,9 +294,13 @@ class GenerateCurrentDatetime(SetValue):
             }
         ]
     """
+    deterministic = False
+
     def __init__(self, source_fields, args):
-        args['value'] = datetime.now().strftime('%Y%m%d%H%M%S')
-        SetValue.__init__(self, source_fields, args)
+        pass
+
+    def __call__(self, message):
+        return hl7_clock()
 
 
 class Concatenate(HL7Operation):
@@ -221,6 +325,9 @@ class Concatenate(HL7Operation):
     def __call__(self, message):
         return self.separator.join(message[field] for field in self.fields)
 
+    def reads(self):
+        return list(self.fields)
+
 
 class SetEndTime(HL7Operation):
     """Computes end time based on start time and duration.
@@ -240,9 +347,282 @@ class SetEndTime(HL7Operation):
         self.duration = HL7Field(source_fields[1])
 
     def __call__(self, message):
-        dt_str = message[self.dt]
-        dt_format = ('%Y%m%d%H%M', '%Y%m%d%H%M%S')[len(dt_str) > 12]
-        dt = datetime.strptime(dt_str, dt_format)
-        duration = timedelta(minutes=int(message[self.duration]))
-        end_time = dt + duration
-        return end_time.strftime(dt_format)
+        return self.end_time(message[self.dt], message[self.duration])
+
+    def reads(self):
+        return [self.dt, self.duration]
+
+    @staticmethod
+    def end_time(dt_str, duration_str):
+        """
+        Adds a duration in minutes to a datetime in HL7 format, keeping its precision.
+        """
+        return HL7DateTime.from_string(dt_str).add(int(duration_str), 'minutes').to_string()
+
+
+class DateOperation(HL7Operation):
+    """
+    The base class of the operations on HL7 date and time values, see :mod:`hl7_transform.dtm`.
+    The first source field is the value, of type `args.type`: DTM (default), DT or TM.
+    """
+    def __init__(self, source_fields, args):
+        if not source_fields or source_fields[0] is None:
+            raise RuntimeError("{} needs a source field.".format(self.__class__.__name__))
+        self.fields = [HL7Field(field) for field in source_fields]
+        self.type = args.get('type', 'DTM')
+
+    def __call__(self, message):
+        return self.compute(*(message[field] for field in self.fields))
+
+    def reads(self):
+        return list(self.fields)
+
+    def compute(self, *values):
+        """
+        Returns the result of the operation for the values of the source fields.
+        """
+        raise NotImplementedError()
+
+
+class AddDuration(DateOperation):
+    """
+    Adds a duration to a date and time, keeping its precision, e.g. the
+    duration of an appointment to its start time. The amount is read from the
+    second source field, or given by `args.amount`. `args.unit` is one of
+    years, months, weeks, days, hours, minutes (default) or seconds.
+
+    Example usage in a mapping scheme::
+
+        [
+            {
+                "target_field": "SCH.11.5",
+                "operation": "add_duration",
+                "source_fields": ["SCH.11.4", "SCH.11.3"],
+                "args": {"unit": "minutes"}
+            },
+            {
+                "target_field": "PV1.45",
+                "operation": "add_duration",
+                "source_field": "PV1.44",
+                "args": {"amount": 2, "unit": "days"}
+            }
+        ]
+    """
+    sign = 1
+
+    def __init__(self, source_fields, args):
+        super().__init__(source_fields, args)
+        if len(self.fields) == 1 and 'amount' not in args:
+            raise RuntimeError("{} needs a second source field or args.amount.".format(self.__class__.__name__))
+        self.amount = int(args['amount']) if len(self.fields) == 1 else None
+        self.unit = args.get('unit', 'minutes')
+
+    def compute(self, dt_str, amount=None):
+        amount = self.amount if amount is None else int(amount)
+        return HL7DateTime.from_string(dt_str, self.type).add(self.sign * amount, self.unit).to_string()
+
+
+class SubtractDuration(AddDuration):
+    """
+    Subtracts a duration from a date and time, with the arguments of :class:`AddDuration`.
+
+    Example usage in a mapping scheme::
+
+        [
+            {
+                "target_field": "ZBE.2",
+                "operation": "subtract_duration",
+                "source_field": "SCH.11.4",
+                "args": {"amount": 1, "unit": "hours"}
+            }
+        ]
+    """
+    sign = -1
+
+
+class ConvertTimezone(DateOperation):
+    """
+    Converts a date and time to the time zone `args.timezone`, an offset like
+    ``+0100``, ``UTC`` or an IANA name like ``Europe/Berlin``. Values without
+    an offset are in `args.source_timezone`, or fail the rule if it is not given.
+
+    Example usage in a mapping scheme::
+
+        [
+            {
+                "target_field": "MSH.7",
+                "operation": "convert_timezone",
+                "source_field": "MSH.7",
+                "args": {"timezone": "UTC", "source_timezone": "Europe/Berlin"}
+            }
+        ]
+    """
+    def __init__(self, source_fields, args):
+        super().__init__(source_fields, args)
+        # time zones are resolved when used, so that the operation holds only strings
+        self.timezone = args['timezone']
+        self.source_timezone = args.get('source_timezone')
+        get_timezone(self.timezone)
+        if self.source_timezone is not None:
+            get_timezone(self.source_timezone)
+
+    def compute(self, dt_str):
+        dt = HL7DateTime.from_string(dt_str, self.type)
+        value = dt.value
+        if value.tzinfo is None:
+            if self.source_timezone is None:
+                raise ValueError('{} has no time zone offset and no source_timezone is given'.format(dt_str))
+            value = value.replace(tzinfo=get_timezone(self.source_timezone))
+        return dt.replace(value=value.astimezone(get_timezone(self.timezone))).to_string()
+
+
+class TruncateDatetime(DateOperation):
+    """
+    Shortens a date and time to the precision `args.precision`, one of
+    year, month, day, hour, minute or second. Values with a lower precision are not changed.
+
+    Example usage in a mapping scheme::
+
+        [
+            {
+                "target_field": "PID.7",
+                "operation": "truncate_datetime",
+                "source_field": "PID.7",
+                "args": {"precision": "day"}
+            }
+        ]
+    """
+    def __init__(self, source_fields, args):
+        super().__init__(source_fields, args)
+        self.precision = args['precision']
+        if self.precision not in PRECISIONS:
+            raise ValueError('Unsupported precision {}. Currently supported are: {}.'.format(self.precision, ', '.join(PRECISIONS)))
+        if self.type == 'TM' and PRECISIONS[self.precision] < PRECISIONS['hour']:
+            raise ValueError('TM values cannot be truncated to the {}, only to the hour, minute or second'.format(self.precision))
+
+    def compute(self, dt_str):
+        return HL7DateTime.from_string(dt_str, self.type).truncate(self.precision).to_string()
+
+
+class FormatDatetime(DateOperation):
+    """
+    Formats a date and time with the :meth:`datetime.strftime` format `args.format`,
+    e.g. for a partner system that expects dates in another format.
+
+    Example usage in a mapping scheme::
+
+        [
+            {
+                "target_field": "NTE.3",
+                "operation": "format_datetime",
+                "source_field": "SCH.11.4",
+                "args": {"format": "%d.%m.%Y %H:%M"}
+            }
+        ]
+    """
+    def __init__(self, source_fields, args):
+        super().__init__(source_fields, args)
+        self.format = args['format']
+
+    def compute(self, dt_str):
+        return HL7DateTime.from_string(dt_str, self.type).value.strftime(self.format)
+
+
+class ComputeAge(DateOperation):
+    """
+    Computes the age at the date of the second source field, e.g. of a
+    patient at the time of the message, or at the current date if there is
+    no second source field. `args.unit` is years (default), months or days.
+
+    Example usage in a mapping scheme::
+
+        [
+            {
+                "target_field": "ZPI.1",
+                "operation": "compute_age",
+                "source_fields": ["PID.7", "MSH.7"],
+                "args": {"unit": "years"}
+            }
+        ]
+    """
+    UNITS = ('years', 'months', 'days')
+
+    def __init__(self, source_fields, args):
+        super().__init__(source_fields, args)
+        self.unit = args.get('unit', 'years')
+        if self.unit not in self.UNITS:
+            raise ValueError('Unsupported unit {}. Currently supported are: {}.'.format(self.unit, ', '.join(self.UNITS)))
+        # the age at the current date changes with the day the message is transformed
+        self.deterministic = len(self.fields) > 1
+
+    def compute(self, birth_str, reference_str=None):
+        birth = HL7DateTime.from_string(birth_str, self.type).value.date()
+        if reference_str is None:
+            reference = datetime.now().date()
+        else:
+            reference = HL7DateTime.from_string(reference_str, self.type).value.date()
+        if self.unit == 'days':
+            return str((reference - birth).days)
+        months = (reference.year - birth.year) * 12 + reference.month - birth.month - (reference.day < birth.day)
+        return str(months if self.unit == 'months' else months // 12)
+
+
+class LookupValue(HL7Operation):
+    """
+    Translates the value of a field, or of several fields, with a lookup table,
+    e.g. local department codes to the codes of a partner system.
+    See :mod:`hl7_transform.lookup` for the supported table files.
+
+    The table is loaded once per process and shared by all rules that use it.
+    Keys that are not in the table are translated to `args.default`,
+    or fail the rule if no default is given.
+
+    Example usage in a mapping scheme::
+
+        [
+            {
+                "target_field": "PV1.3.1",
+                "operation": "lookup_value",
+                "source_fields": ["PV1.3.1", "MSH.4"],
+                "args": {
+                    "table": "tables/departments.csv",
+                    "key": ["local_code", "facility"],
+                    "value": "partner_code",
+                    "default": "UNKNOWN"
+                }
+            }
+        ]
+
+    Further arguments are `args.table_name`, the table in an SQLite database,
+    and `args.cache_size`, the number of keys cached from an SQLite table.
+    """
+    def __init__(self, source_fields, args):
+        if not source_fields:
+            raise RuntimeError("LookupValue needs at least one source field.")
+        self.fields = [HL7Field(field) for field in source_fields]
+        self.args = args
+        self.default = args.get('default')
+        self.table = load_table(args['table'], args.get('key'), args.get('value'),
+                                args.get('table_name'), int(args.get('cache_size', 65536)))
+
+    def __call__(self, message):
+        return self.translate(*(message[field] for field in self.fields))
+
+    def reads(self):
+        return list(self.fields)
+
+    def translate(self, *values):
+        """
+        Returns the value of the key formed by the given field values.
+        """
+        key = values[0] if len(values) == 1 else values
+        value = self.table.get(key)
+        if value is None:
+            if self.default is None:
+                raise KeyError('{} is not in lookup table {}'.format(key, self.table.path))
+            return self.default
+        return value
+
+    def __reduce__(self):
+        # pickle the arguments, not the table, the table is loaded again
+        return (LookupValue, ([field.name for field in self.fields], dict(self.args, table=self.table.path)))
@@ -0,0 +1,182 @@
+"""
+This file contains a parallel executor that transforms large numbers of
+messages using a pool of worker processes.
+"""
+import gc
+import multiprocessing
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from itertools import islice
+from hl7_transform.analysis import HL7MappingAnalysis
+from hl7_transform.mapping import HL7Mapping
+from hl7_transform.mapping_cache import load_mapping
+from hl7_transform.message import HL7Message, preload_hl7apy
+from hl7_transform.transform import HL7Transform
+
+
+class TransformResult:
+    """
+    The outcome of transforming one message in a worker process.
+    """
+    def __init__(self, index, message=None, error=None, warnings=()):
+        """
+        :param index: Position of the message in the input sequence.
+        :param message: The transformed message as a string, None if transformation failed.
+        :param error: Description of the failure, None if transformation succeeded.
+        :param warnings: Descriptions of the rules that failed and were skipped,
+            with the collect error policy.
+        """
+        self.index = index
+        self.message = message
+        self.error = error
+        self.warnings = warnings
+
+    @property
+    def ok(self):
+        return self.error is None
+
+    def __repr__(self):
+        return '<TransformResult {} {}>'.format(self.index, 'ok' if self.ok else self.error)
+
+
+_worker = {}
+
+
+def _init_worker(mapping_path, mapping_type, parser, mapping_cache=None, optimize=False, preload=None, on_error='raise'):
+    """
+    Loads the mapping once per worker process, and the hl7apy reference
+    structures unless they were inherited from the parent process.
+    """
+    if preload is not None:
+        preload_hl7apy(preload)
+    if mapping_cache is not None:
+        mapping = load_mapping(mapping_path, mapping_type, mapping_cache)
+    else:
+        mapping = HL7Mapping.from_file(mapping_path, mapping_type)
+    if optimize:
+        mapping = HL7MappingAnalysis(mapping).optimized_mapping()
+    _worker['transform'] = HL7Transform(mapping, on_error=on_error)
+    _worker['parser'] = parser
+
+
+def _transform_chunk(chunk):
+    transform, parser = _worker['transform'], _worker['parser']
+    results = []
+    for index, txt in chunk:
+        try:
+            message = transform(HL7Message.from_string(txt, parser))
+            warnings = ['{} Rule {} ({}) skipped'.format(error, error.rule, error.operation) for error in transform.errors]
+            transform.errors.clear()
+            results.append(TransformResult(index, message.to_string(), warnings=warnings))
+        except Exception as e:
+            results.append(TransformResult(index, error='{}: {}'.format(e.__class__.__name__, e)))
+    return results
+
+
+class HL7ParallelTransform:
+    """
+    Applies a mapping to a stream of messages in parallel, sharding the
+    messages in chunks across a :class:`ProcessPoolExecutor`.
+
+    Example usage::
+
+        transform = HL7ParallelTransform('mapping.json', workers=8)
+        for result in transform(read_messages('archive/*.hl7')):
+            if result.ok:
+                out.write(result.message)
+    """
+    def __init__(self, mapping_path, mapping_type='json', parser='hl7apy', workers=None, chunk_size=100, ordered=True, mapping_cache=None, optimize=False,
+                 preload=None, on_error='raise'):
+        """
+        :param mapping_path: Path to the mapping file, loaded once by every worker.
+        :param mapping_type: Mapping file type, can be json (default) or csv.
+        :param parser: Message parser, see :data:`hl7_transform.message.PARSERS`.
+        :param workers: Number of worker processes, defaults to the number of CPUs.
+        :param chunk_size: Number of messages sent to a worker at once.
+        :param ordered: If True, results are returned in input order,
+            otherwise as soon as they are available.
+        :param mapping_cache: Optional directory of the on-disk mapping cache,
+            see :class:`HL7MappingCache`.
+        :param optimize: If True, workers apply the optimized mapping of an
+            :class:`HL7MappingAnalysis`.
+        :param preload: Optional HL7 versions whose hl7apy reference structures are
+            loaded before the workers start, see :func:`preload_hl7apy`. Where
+            available, workers are then forked, so that they share the loaded
+            structures with the parent process instead of loading them again.
+        :param on_error: The error policy of the workers, raise (default) fails a message
+            at its first failing rule, collect skips failing rules and lists them in
+            :attr:`TransformResult.warnings`.
+        """
+        if on_error not in ('raise', 'collect'):
+            raise ValueError('Unsupported error policy {}. Currently supported are: raise, collect.'.format(on_error))
+        self.mapping_path = mapping_path
+        self.mapping_type = mapping_type
+        self.parser = parser
+        self.workers = workers
+        self.chunk_size = chunk_size
+        self.ordered = ordered
+        self.mapping_cache = mapping_cache
+        self.optimize = optimize
+        self.preload = preload
+        self.on_error = on_error
+
+    def _chunks(self, messages):
+        messages = enumerate(messages)
+        while True:
+            chunk = list(islice(messages, self.chunk_size))
+            if not chunk:
+                return
+            yield chunk
+
+    def __call__(self, messages):
+        """
+        Transforms messages in parallel. Messages are read lazily from the
+        input, only a bounded number of chunks is in flight at any time.
+        A failing message is reported in its result and does not stop the batch.
+
+        :param messages: An iterable of message strings.
+        :return: A generator of :class:`TransformResult`.
+        """
+        workers = self.workers or os.cpu_count() or 1
+        context = None
+        if self.preload is not None:
+            preload_hl7apy(self.preload)
+            if 'fork' in multiprocessing.get_all_start_methods():
+                context = multiprocessing.get_context('fork')
+                # objects that survive a collection are moved to the permanent generation,
+                # so that the garbage collector of the workers does not write to their pages
+                gc.collect()
+                gc.freeze()
+        try:
+            with ProcessPoolExecutor(max_workers=workers,
+                                     mp_context=context,
+                                     initializer=_init_worker,
+                                     initargs=(self.mapping_path, self.mapping_type, self.parser, self.mapping_cache, self.optimize,
+                                               self.preload, self.on_error)) as executor:
+                max_in_flight = 2 * workers
+                chunks = self._chunks(messages)
+                in_flight = deque()
+                for chunk in chunks:
+                    in_flight.append(executor.submit(_transform_chunk, chunk))
+                    if len(in_flight) >= max_in_flight:
+                        yield from self._collect(in_flight)
+                while in_flight:
+                    yield from self._collect(in_flight)
+        finally:
+            if context is not None:
+                gc.unfreeze()
+
+    def _collect(self, in_flight):
+        """
+        Waits for the oldest chunk if ordered, for any chunk otherwise,
+        and returns its results.
+        """
+        if self.ordered:
+            return in_flight.popleft().result()
+        done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+        results = []
+        for future in done:
+            in_flight.remove(future)
+            results.extend(future.result())
+        return results
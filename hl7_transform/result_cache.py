@@ -0,0 +1,192 @@
+"""
+This file contains a content-addressed cache of transformed messages, for
+interfaces that send the same message more than once, e.g. on replays and retries.
+
+A result is keyed by the hash of the message text, the parser backend and
+the fingerprint of the mapping, a hash of its rules, so that a cache can be shared by several
+transforms and persisted between processes. Mappings with operations whose
+result is not determined by the message, e.g. ``generate_numeric_id``,
+are not cached, see :attr:`HL7Operation.deterministic`.
+
+Example usage::
+
+    transform = HL7Transform(mapping, result_cache=HL7ResultCache(maxsize=10000))
+    txt = transform.transform_string(txt, 'native')
+    print(transform.result_cache.to_dict())
+"""
+import hashlib
+import os
+import re
+from collections import OrderedDict
+from threading import Lock
+from hl7_transform.field import HL7Field
+
+
+class HL7ResultCache:
+    """
+    A least-recently-used cache of transformed messages, bounded by the number
+    of messages and optionally by their total length, with an optional
+    on-disk cache that is not bounded.
+
+    The cache directory must only be writable by trusted users, since
+    cached messages are returned without being transformed again.
+    """
+    def __init__(self, maxsize=1024, max_chars=None, cache_dir=None):
+        """
+        :param maxsize: Number of messages kept in memory.
+        :param max_chars: Total number of characters of the messages kept in memory,
+            None for no limit.
+        :param cache_dir: Directory for cache files, None disables the on-disk cache.
+        """
+        self.maxsize = maxsize
+        self.max_chars = max_chars
+        self.cache_dir = cache_dir
+        self._results = OrderedDict()
+        self._chars = 0
+        self._lock = Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.bypassed = 0
+
+    @staticmethod
+    def key(fingerprint, txt, backend):
+        """
+        Returns the key of a message transformed by the mapping with the given fingerprint.
+        Segments may be separated by carriage returns or line feeds.
+
+        :param backend: The parser backend of the message, see :attr:`HL7Message.backend`,
+            since the backends serialize some messages differently.
+        """
+        digest = hashlib.sha256('{}:{}'.format(fingerprint, backend).encode())
+        digest.update(txt.replace('\r', '\n').encode('utf-8', 'surrogatepass'))
+        return digest.hexdigest()
+
+    def get(self, key):
+        """
+        :return: The cached message text of a key, None if it is not cached.
+        """
+        with self._lock:
+            txt = self._results.get(key)
+            if txt is not None:
+                self._results.move_to_end(key)
+                self.hits += 1
+                return txt
+        txt = self._read_cache_file(key) if self.cache_dir is not None else None
+        with self._lock:
+            if txt is None:
+                self.misses += 1
+                return None
+            self.disk_hits += 1
+            self._store(key, txt)
+        return txt
+
+    def put(self, key, txt):
+        """
+        Caches the transformed message text of a key.
+        """
+        with self._lock:
+            self._store(key, txt)
+        if self.cache_dir is not None:
+            self._write_cache_file(key, txt)
+
+    def bypass(self):
+        """
+        Counts a message that was transformed without the cache.
+        """
+        with self._lock:
+            self.bypassed += 1
+
+    def _store(self, key, txt):
+        previous = self._results.pop(key, None)
+        if previous is not None:
+            self._chars -= len(previous)
+        self._results[key] = txt
+        self._chars += len(txt)
+        while len(self._results) > self.maxsize or (self.max_chars is not None and self._chars > self.max_chars):
+            _, evicted = self._results.popitem(last=False)
+            self._chars -= len(evicted)
+
+    def __len__(self):
+        return len(self._results)
+
+    def clear(self):
+        """
+        Empties the in-memory cache. Cache files are kept.
+        """
+        with self._lock:
+            self._results.clear()
+            self._chars = 0
+
+    def to_dict(self):
+        """
+        Returns the counters and the size of the in-memory cache.
+        """
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'disk_hits': self.disk_hits,
+                'misses': self.misses,
+                'bypassed': self.bypassed,
+                'size': len(self._results),
+                'chars': self._chars,
+            }
+
+    def cache_path(self, key):
+        return os.path.join(self.cache_dir, key + '.hl7')
+
+    def _read_cache_file(self, key):
+        try:
+            with open(self.cache_path(key), encoding='utf-8', newline='') as f:
+                return f.read()
+        except OSError:
+            return None
+
+    def _write_cache_file(self, key, txt):
+        os.makedirs(self.cache_dir, exist_ok=True)
+        cache_path = self.cache_path(key)
+        tmp_path = '{}.{}.tmp'.format(cache_path, os.getpid())
+        with open(tmp_path, 'w', encoding='utf-8', newline='') as f:
+            f.write(txt)
+        os.replace(tmp_path, cache_path)
+
+
+def is_deterministic(steps):
+    """
+    Returns True if the result of every operation of a list of
+    (target field, operation) steps is determined by the message.
+    """
+    return all(operation.deterministic for target_field, operation in steps)
+
+
+def mapping_fingerprint(steps):
+    """
+    Returns a hash of a list of (target field, operation) steps, which is
+    the same in every process for the same rules, operation arguments and lookup tables.
+    """
+    return hashlib.sha256(describe(list(steps)).encode()).hexdigest()
+
+
+def describe(value):
+    """
+    Returns a string that describes a value of an operation or a condition,
+    independent of the process. Objects are described by their class and
+    attributes, or by their `fingerprint()` method, e.g. lookup tables.
+    """
+    if value is None or isinstance(value, (str, int, float, bool)):
+        return repr(value)
+    if isinstance(value, HL7Field):
+        return 'HL7Field({})'.format(value.name)
+    if isinstance(value, (list, tuple)):
+        return '[{}]'.format(', '.join(describe(item) for item in value))
+    if isinstance(value, (set, frozenset)):
+        return '{{{}}}'.format(', '.join(sorted(describe(item) for item in value)))
+    if isinstance(value, dict):
+        return '{{{}}}'.format(', '.join(sorted('{}: {}'.format(describe(key), describe(item)) for key, item in value.items())))
+    if isinstance(value, re.Pattern):
+        return 're.compile({!r}, {})'.format(value.pattern, value.flags)
+    if isinstance(value, type):
+        return '{}.{}'.format(value.__module__, value.__qualname__)
+    if hasattr(value, 'fingerprint'):
+        return value.fingerprint()
+    return '{}.{}({})'.format(value.__class__.__module__, value.__class__.__qualname__, describe(vars(value)))
@@ -0,0 +1,120 @@
+"""
+Tests for hl7_transform.analysis module.
+"""
+import unittest
+from hl7_transform.analysis import HL7MappingAnalysis, overlaps, conflicts, covers
+from hl7_transform.field import HL7Field
+from hl7_transform.mapping import HL7Mapping
+from hl7_transform.message import HL7Message
+from hl7_transform.transform import HL7Transform
+
+
+INPUT_SEGMENTS = ['MSH', 'SCH', 'NTE', 'PID', 'RGS', 'AIG']
+
+
+class TestHL7MappingAnalysis(unittest.TestCase):
+    def setUp(self):
+        with open('hl7_transform/test/test_msg.hl7') as f:
+            self.txt = f.read().strip()
+
+    def assertSameOutput(self, mapping, analysis):
+        for parser in ('hl7apy', 'native'):
+            expected = HL7Transform(mapping, on_error='collect')(HL7Message.from_string(self.txt, parser)).to_string()
+            result = HL7Transform(analysis.optimized_mapping(), on_error='collect')(HL7Message.from_string(self.txt, parser)).to_string()
+            self.assertEqual(result, expected)
+
+    def test_fields(self):
+        self.assertTrue(overlaps(HL7Field('PID.3.1'), HL7Field('PID.3')))
+        self.assertTrue(overlaps(HL7Field('PID.3'), HL7Field('PID.3.1')))
+        self.assertFalse(overlaps(HL7Field('PID.3.2'), HL7Field('PID.3.1.2')))
+        # writes pad the fields and components before the written one
+        self.assertTrue(overlaps(HL7Field('PID.3'), HL7Field('PID.5')))
+        self.assertTrue(overlaps(HL7Field('PID.3.1'), HL7Field('PID.3.4')))
+        self.assertFalse(overlaps(HL7Field('PID.5'), HL7Field('PID.3')))
+        self.assertTrue(overlaps(HL7Field('OBX.5'), HL7Field('OBX[2].5')))
+        self.assertFalse(overlaps(HL7Field('OBX[1].5'), HL7Field('OBX[2].5')))
+        self.assertTrue(conflicts(HL7Field('PID.3'), HL7Field('PID.3.1')))
+        self.assertFalse(conflicts(HL7Field('PID.3.1'), HL7Field('PID.3.2')))
+        self.assertTrue(covers(HL7Field('PID.3'), HL7Field('PID[1].3.1.2')))
+        self.assertFalse(covers(HL7Field('PID.3.1'), HL7Field('PID.3')))
+        self.assertFalse(covers(HL7Field('PID.3'), HL7Field('PID.3[2]')))
+
+    def test_no_ops(self):
+        mapping = HL7Mapping.from_json('hl7_transform/test/test_transform.json')
+        analysis = HL7MappingAnalysis(mapping)
+        self.assertEqual(analysis.no_ops, [0])
+        self.assertEqual(analysis.removed, [0])
+        self.assertEqual(len(analysis.optimized_mapping()), 12)
+        self.assertIn('Rule 0 (MSH.9.1 <CopyValue>) removed: copies the field into itself', analysis.report())
+        # copies within other segments may read from a later segment than they write into
+        analysis = HL7MappingAnalysis(HL7Mapping.from_string('''[
+          {"target_field": "PID.3", "operation": "copy_value", "source_field": "PID.3"},
+          {"target_field": "PID[1].3", "operation": "copy_value", "source_field": "PID[1].3"}
+        ]'''))
+        self.assertEqual(analysis.no_ops, [1])
+
+    def test_dead_writes(self):
+        mapping = HL7Mapping.from_string('''[
+          {"target_field": "PID.3.1", "operation": "copy_value", "source_field": "PID.5"},
+          {"target_field": "PID.8", "operation": "set_value", "args": {"value": "F"}},
+          {"target_field": "PID.3", "operation": "set_value", "args": {"value": "1^^^X"}},
+          {"target_field": "PID.8", "operation": "copy_value", "source_field": "PID.7"},
+          {"target_field": "PV1.2", "operation": "set_value", "args": {"value": "I"}},
+          {"target_field": "PV1.2", "operation": "copy_value", "source_field": "PV1.2"},
+          {"target_field": "SCH.1", "operation": "set_value", "args": {"value": "1"}},
+          {"target_field": "SCH.2", "operation": "concatenate_values", "source_fields": ["SCH.1", "PID.3"], "args": {"separator": "-"}},
+          {"target_field": "SCH.1", "operation": "set_value", "args": {"value": "2"}}
+        ]''')
+        analysis = HL7MappingAnalysis(mapping, INPUT_SEGMENTS)
+        # PID.8 is overwritten by a rule that can fail, SCH.1 is read before it is overwritten
+        self.assertEqual(analysis.dead_writes, {0: 2})
+        self.assertEqual(analysis.no_ops, [])
+        self.assertIn('Rule 0 (PID.3.1 <CopyValue>) removed: overwritten by rule 2 (PID.3)', analysis.report())
+        self.assertSameOutput(mapping, analysis)
+
+    def test_new_segments_keep_their_order(self):
+        mapping = HL7Mapping.from_string('''[
+          {"target_field": "ZBE.1", "operation": "set_value", "args": {"value": "1"}},
+          {"target_field": "TQ1.1", "operation": "set_value", "args": {"value": "2"}},
+          {"target_field": "ZBE.1", "operation": "set_value", "args": {"value": "3"}},
+          {"target_field": "PID[2].1", "operation": "set_value", "args": {"value": "4"}}
+        ]''')
+        analysis = HL7MappingAnalysis(mapping, INPUT_SEGMENTS)
+        self.assertEqual(analysis.removed, [])
+        self.assertEqual(analysis.order, [0, 1, 2, 3])
+        self.assertEqual(analysis.dependencies[3], {0, 1, 2})
+        self.assertSameOutput(mapping, analysis)
+
+    def test_unpopulated_reads(self):
+        mapping = HL7Mapping.from_string('''[
+          {"target_field": "TQ1.7", "operation": "copy_value", "source_field": "TQ1.8"},
+          {"target_field": "TQ1.8", "operation": "copy_value", "source_field": "SCH.11.4"},
+          {"target_field": "TQ1.9", "operation": "copy_value", "source_field": "TQ1.8"},
+          {"target_field": "PID.1", "operation": "copy_value", "source_field": "PV1.2",
+           "when": {"field": "ZBE.1", "present": false}}
+        ]''')
+        analysis = HL7MappingAnalysis(mapping, INPUT_SEGMENTS)
+        self.assertEqual([(rule, field.name) for rule, field in analysis.unpopulated_reads],
+                         [(0, 'TQ1.8'), (3, 'ZBE.1'), (3, 'PV1.2')])
+        self.assertIn('Rule 0 (TQ1.7 <CopyValue>) reads TQ1.8, which is never populated', analysis.report())
+        self.assertEqual(HL7MappingAnalysis(mapping).unpopulated_reads, [])
+
+    def test_order(self):
+        mapping = HL7Mapping.from_string('''[
+          {"target_field": "PID.3.1", "operation": "set_value", "args": {"value": "1"}},
+          {"target_field": "SCH.2", "operation": "copy_value", "source_field": "PID.5"},
+          {"target_field": "SCH.3", "operation": "copy_value", "source_field": "PID.3.1"},
+          {"target_field": "NTE.1", "operation": "copy_value", "source_field": "SCH.11.4"},
+          {"target_field": "PID.8", "operation": "copy_value", "source_field": "PID.7"}
+        ]''')
+        analysis = HL7MappingAnalysis(mapping, INPUT_SEGMENTS)
+        # writing PID.8 can pad the segment with the fields read by rules 1 and 2
+        self.assertEqual(analysis.dependencies, {0: set(), 1: set(), 2: {0}, 3: set(), 4: {1, 2}})
+        # the read of SCH.11.4 is moved before the writes into SCH
+        self.assertEqual(analysis.order, [0, 3, 1, 2, 4])
+        self.assertIn('Optimized rule order: 0, 3, 1, 2, 4', analysis.report())
+        self.assertSameOutput(mapping, analysis)
+
+
+if __name__ == '__main__':
+    unittest.main()
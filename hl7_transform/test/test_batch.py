@@ -0,0 +1,98 @@
+"""
+Tests for hl7_transform.batch module.
+"""
+import unittest
+import io
+import os
+import tempfile
+from hl7_transform.batch import split_messages, read_messages, write_messages, HL7Archive
+from hl7_transform.message import HL7Message
+
+
+class TestBatch(unittest.TestCase):
+    def setUp(self):
+        with open('hl7_transform/test/test_msg.hl7') as f:
+            self.txt = '\n'.join(segment for segment in f.read().splitlines() if segment)
+
+    def test_split_plain(self):
+        messages = list(split_messages(io.StringIO(self.txt + '\n\n' + self.txt + '\n')))
+        self.assertEqual(len(messages), 2)
+        self.assertEqual(messages[0], self.txt)
+
+    def test_split_mllp(self):
+        framed = '\x0b{}\x1c\r'.format(self.txt.replace('\n', '\r'))
+        messages = list(split_messages(io.StringIO(framed * 3)))
+        self.assertEqual(len(messages), 3)
+        self.assertEqual(messages[2], self.txt)
+
+    def test_split_batch_envelope(self):
+        batch = '\n'.join(['FHS|^~\\&', 'BHS|^~\\&', self.txt, self.txt, 'BTS|2', 'FTS|1'])
+        messages = list(split_messages(io.StringIO(batch)))
+        self.assertEqual(messages, [self.txt, self.txt])
+
+    def test_read_messages_glob(self):
+        messages = list(read_messages('hl7_transform/test/*.hl7'))
+        self.assertEqual(len(messages), 2)
+
+    def test_read_messages_directory(self):
+        with tempfile.TemporaryDirectory() as directory:
+            for name in ('a.hl7', 'b.hl7', 'c.hl7'):
+                with open(os.path.join(directory, name), 'w') as f:
+                    f.write(self.txt)
+            messages = list(read_messages(directory))
+        self.assertEqual(messages, [self.txt] * 3)
+
+    def test_write_messages(self):
+        out = io.StringIO()
+        count = write_messages((HL7Message.from_string(self.txt) for _ in range(2)), out)
+        self.assertEqual(count, 2)
+        self.assertEqual(list(split_messages(io.StringIO(out.getvalue()))), [self.txt, self.txt])
+
+
+class TestHL7Archive(unittest.TestCase):
+    def setUp(self):
+        with open('hl7_transform/test/test_msg.hl7') as f:
+            self.txt = '\n'.join(segment for segment in f.read().splitlines() if segment)
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'archive.hl7')
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def scan(self, content):
+        with open(self.path, 'wb') as f:
+            f.write(content.encode())
+        with HL7Archive(self.path) as archive:
+            return [entry.text() for entry in archive]
+
+    def test_plain(self):
+        self.assertEqual(self.scan(self.txt + '\n\n' + self.txt + '\n'), [self.txt, self.txt])
+        self.assertEqual(self.scan(''), [])
+
+    def test_mllp(self):
+        txt = self.txt.replace('\n', '\r')
+        self.assertEqual(self.scan('\x0b{}\x1c\r'.format(txt) * 3), [txt] * 3)
+
+    def test_batch_envelope(self):
+        batch = '\r'.join(['FHS|^~\\&', 'BHS|^~\\&', self.txt, self.txt, 'BTS|2', 'FTS|1'])
+        self.assertEqual(self.scan(batch), [self.txt, self.txt])
+
+    def test_same_as_split_messages(self):
+        batch = '\n'.join(['FHS|^~\\&', self.txt, 'NTE|MSH|1', '\x0b' + self.txt + '\x1c', 'FTS|1'])
+        self.assertEqual(self.scan(batch), list(split_messages(io.StringIO(batch))))
+
+    def test_lazy_entries(self):
+        with open(self.path, 'w') as f:
+            f.write('\n'.join([self.txt.replace('SIU^S12', 'ADT^A01'), self.txt]))
+        with HL7Archive(self.path) as archive:
+            entries = list(archive)
+            self.assertEqual(entries[1].start, len(self.txt) + 1)
+            self.assertEqual([entry.header().split('|')[8] for entry in entries], ['ADT^A01', 'SIU^S12'])
+            with entries[0].data as data:
+                self.assertEqual(bytes(data[:3]), b'MSH')
+            message = entries[1].parse('native')
+            self.assertEqual(message.to_string(), self.txt)
+
+
+if __name__ == '__main__':
+    unittest.main()
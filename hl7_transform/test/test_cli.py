@@ -1,8 +1,22 @@
-from hl7_transform.__main__ import main_cli
+from hl7_transform.__main__ import main_cli, main
 import unittest
 import os
-from contextlib import redirect_stdout
+from contextlib import redirect_stdout, redirect_stderr
 import io
+import json
+import sys
+import tempfile
+
+
+class redirect_stdin:
+    def __init__(self, stream):
+        self.stream = stream
+
+    def __enter__(self):
+        self.old_stdin, sys.stdin = sys.stdin, self.stream
+
+    def __exit__(self, *exc):
+        sys.stdin = self.old_stdin
 
 
 class TestCLI(unittest.TestCase):
@@ -12,6 +26,16 @@ class TestCLI(unittest.TestCase):
             message = None
             out = None
             type = 'json'
+            batch = None
+            parser = 'hl7apy'
+            workers = None
+            chunk_size = 100
+            columnar = False
+            unordered = False
+            metrics = None
+            on_error = 'raise'
+            mapping_cache = None
+            optimize = False
 
             def __contains__(self, key):
                 return key in self.__dict__ and self.__dict__[key] is not None
@@ -22,8 +46,9 @@ class TestCLI(unittest.TestCase):
         self.args.out = 'test.hl7'
 
     def tearDown(self):
-        if self.args.out is not None and os.path.exists(self.args.out):
-            os.remove(self.args.out)
+        for path in (self.args.out, self.args.metrics):
+            if path is not None and os.path.exists(path):
+                os.remove(path)
 
     def test_main_cli(self):
         res = main_cli(self.args)
@@ -35,6 +60,46 @@ class TestCLI(unittest.TestCase):
         res = main_cli(self.args)
         self.assertIsNone(res, msg='CLI failed')
 
+    def test_main_cli_native_parser(self):
+        self.args.parser = 'native'
+        res = main_cli(self.args)
+        self.assertIsNone(res, msg='CLI failed')
+
+    def test_main_cli_metrics(self):
+        self.args.metrics = 'test_metrics.json'
+        res = main_cli(self.args)
+        self.assertIsNone(res, msg='CLI failed')
+        with open(self.args.metrics) as f:
+            metrics = json.load(f)
+        self.assertEqual(metrics['stages']['serialize']['calls'], 1)
+        self.assertEqual(metrics['rules']['SCH.9']['calls'], 1)
+
+    def test_main_cli_batch_metrics(self):
+        self.args.message = None
+        self.args.batch = 'hl7_transform/test/test_msg.hl7'
+        self.args.metrics = 'test_metrics.prom'
+        main_cli(self.args)
+        with open(self.args.metrics) as f:
+            self.assertIn('hl7_transform_stage_calls_total{stage="parse"} 1', f.read())
+
+    def test_main_cli_mapping_cache(self):
+        with tempfile.TemporaryDirectory() as directory:
+            self.args.mapping_cache = directory
+            for _ in range(2):
+                res = main_cli(self.args)
+                self.assertIsNone(res, msg='CLI failed')
+            self.assertEqual(len(os.listdir(directory)), 1)
+
+    def test_main_cli_optimize(self):
+        self.args.optimize = True
+        s = io.StringIO()
+        with redirect_stderr(s):
+            res = main_cli(self.args)
+        self.assertIsNone(res, msg='CLI failed')
+        self.assertIn('Rule 0 (MSH.9.1 <CopyValue>) removed', s.getvalue())
+        with open(self.args.out) as f:
+            self.assertIn('TQ1|||||||202005201615|202005201665|202005201615 + 50', f.read())
+
     def test_main_cli_new_message(self):
         self.args.message = None
         self.args.mappingfile = 'hl7_transform/test/test_transform_empty_message.json'
@@ -48,3 +113,80 @@ class TestCLI(unittest.TestCase):
         with redirect_stdout(s):
             res = main_cli(self.args)
         self.assertIsNone(res, msg='CLI failed')
+
+    def test_main_cli_batch(self):
+        self.args.message = None
+        self.args.batch = 'hl7_transform/test/test_msg.hl7'
+        res = main_cli(self.args)
+        self.assertIsNone(res, msg='CLI failed')
+        with open(self.args.out) as f:
+            self.assertEqual(f.read().count('TQ1|'), 1)
+
+    def test_main_cli_batch_columnar(self):
+        self.args.message = None
+        self.args.batch = 'hl7_transform/test/test_msg.hl7'
+        self.args.columnar = True
+        res = main_cli(self.args)
+        self.assertIsNone(res, msg='CLI failed')
+        with open(self.args.out) as f:
+            self.assertEqual(f.read().count('TQ1|'), 1)
+
+    def test_main_cli_batch_parallel(self):
+        self.args.message = None
+        self.args.batch = 'hl7_transform/test/test_*.hl7'
+        self.args.workers = 2
+        s = io.StringIO()
+        with redirect_stderr(s):
+            res = main_cli(self.args)
+        self.assertIsNone(res, msg='CLI failed')
+        self.assertIn('Message 1 failed', s.getvalue())
+        with open(self.args.out) as f:
+            self.assertEqual(f.read().count('TQ1|'), 1)
+
+    def test_main_cli_batch_parallel_on_error_log(self):
+        self.args.message = None
+        self.args.batch = 'hl7_transform/test/test_*.hl7'
+        self.args.workers = 2
+        self.args.on_error = 'log'
+        with self.assertLogs('hl7_transform', level='WARNING') as logs:
+            res = main_cli(self.args)
+        self.assertIsNone(res, msg='CLI failed')
+        self.assertEqual(len(logs.output), 4)
+        self.assertIn('skipped in message 1', logs.output[0])
+        with open(self.args.out) as f:
+            self.assertEqual(f.read().count('MSH|'), 2)
+
+    def test_parallel_rejects_unsupported_options(self):
+        for option in (['--metrics', 'metrics.json'], ['--result-cache', '10']):
+            with self.subTest(option=option):
+                argv = ['hl7_transform', self.args.mappingfile, '--batch', 'hl7_transform/test/test_*.hl7', '-j', '2'] + option
+                with redirect_stderr(io.StringIO()) as s, self.assertRaises(SystemExit):
+                    sys.argv, old_argv = argv, sys.argv
+                    try:
+                        main()
+                    finally:
+                        sys.argv = old_argv
+                self.assertIn('--workers does not support', s.getvalue())
+
+    def test_main_cli_batch_on_error_log(self):
+        self.args.message = None
+        self.args.batch = 'hl7_transform/test/test_*.hl7'
+        self.args.on_error = 'log'
+        with self.assertLogs('hl7_transform', level='WARNING') as logs:
+            res = main_cli(self.args)
+        self.assertIsNone(res, msg='CLI failed')
+        self.assertEqual(len(logs.output), 4)
+        with open(self.args.out) as f:
+            self.assertEqual(f.read().count('MSH|'), 2)
+
+    def test_main_cli_batch_stdin(self):
+        self.args.message = None
+        self.args.batch = '-'
+        with open('hl7_transform/test/test_msg.hl7') as f:
+            txt = f.read().strip().replace('\n', '\r')
+        stdin = io.StringIO('\x0b{}\x1c\r\x0b{}\x1c\r'.format(txt, txt))
+        with redirect_stdin(stdin):
+            res = main_cli(self.args)
+        self.assertIsNone(res, msg='CLI failed')
+        with open(self.args.out) as f:
+            self.assertEqual(f.read().count('TQ1|'), 2)
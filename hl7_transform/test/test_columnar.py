@@ -0,0 +1,114 @@
+"""
+Tests for hl7_transform.columnar module.
+"""
+import re
+import unittest
+from hl7_transform.columnar import HL7BatchTransform, Column, map_columns
+from hl7_transform.mapping import HL7Mapping
+from hl7_transform.message import HL7Message
+from hl7_transform.metrics import HL7Metrics
+from hl7_transform.transform import HL7Transform, TransformError
+
+
+class TestHL7BatchTransform(unittest.TestCase):
+    def setUp(self):
+        self.mapping = HL7Mapping.from_json('hl7_transform/test/test_transform.json')
+        with open('hl7_transform/test/test_msg.hl7') as f:
+            txt = '\n'.join(s for s in f.read().splitlines() if s)
+        self.txts = [txt.replace('^^50^202005201615', '^^{}^2020052016{:02}'.format(i * 7, i)) for i in range(10)]
+        # a message without SCH.11, where four rules fail
+        self.txts[4] = txt.replace('^^50^202005201615', '')
+        # a message with an invalid duration
+        self.txts[7] = txt.replace('^^50^', '^^x^')
+
+    @staticmethod
+    def without_generated_values(txt):
+        return re.sub(r'ZBE\|\d{9}\^MOVEMENT\|\d{14}', 'ZBE|<id>^MOVEMENT|<now>', txt)
+
+    def transform_both(self, parser, on_error='collect'):
+        transform = HL7Transform(self.mapping, on_error=on_error)
+        expected = [self.without_generated_values(transform(HL7Message.from_string(txt, parser)).to_string())
+                    for txt in self.txts]
+        batch_transform = HL7BatchTransform(self.mapping, on_error=on_error)
+        messages = batch_transform([HL7Message.from_string(txt, parser) for txt in self.txts])
+        return expected, [self.without_generated_values(message.to_string()) for message in messages], transform, batch_transform
+
+    def test_same_output_as_transform(self):
+        for parser in ('hl7apy', 'native'):
+            with self.subTest(parser=parser):
+                expected, result, transform, batch_transform = self.transform_both(parser)
+                self.assertEqual(result, expected)
+                self.assertIn('TQ1|||||||202005201605|202005201640|202005201605 + 35', result[5])
+                self.assertEqual(sorted((e.rule, str(e.reason)) for e in batch_transform.errors),
+                                 sorted((e.rule, str(e.reason)) for e in transform.errors))
+                self.assertEqual(len(batch_transform.errors), 6)
+
+    def test_same_output_on_other_fixture(self):
+        mapping = HL7Mapping.from_string('''[
+          {"target_field": "PV1.19", "operation": "copy_value", "source_field": "PID.3"},
+          {"target_field": "PID.3", "operation": "set_value", "args": {"value": "1^2"}},
+          {"target_field": "PV1.20", "operation": "concatenate_values", "source_fields": ["PID.3.2", "OBR.7"], "args": {"separator": "/"}},
+          {"target_field": "OBR.8", "operation": "add_values", "source_fields": ["OBR.7", "OBR.1"], "args": {"type": "int"}}
+        ]''')
+        with open('hl7_transform/test/test_transform.hl7') as f:
+            txt = f.read().strip()
+        transform = HL7Transform(mapping)
+        expected = transform(HL7Message.from_string(txt, 'native')).to_string()
+        result = HL7BatchTransform(mapping)([HL7Message.from_string(txt, 'native')] * 3)
+        self.assertEqual([message.to_string() for message in result], [expected] * 3)
+        self.assertIn('PV1|||||||||||||||||||555-44-4444|2/200202150730', expected)
+
+    def test_date_operations(self):
+        mapping = HL7Mapping.from_string('''[
+          {"target_field": "ZDT.1", "operation": "add_duration", "source_fields": ["SCH.11.4", "SCH.11.3"]},
+          {"target_field": "ZDT.2", "operation": "convert_timezone", "source_field": "SCH.11.4", "args": {"timezone": "+0100", "source_timezone": "UTC"}},
+          {"target_field": "ZDT.3", "operation": "compute_age", "source_fields": ["PID.7", "SCH.11.4"]}
+        ]''')
+        transform = HL7Transform(mapping, on_error='collect')
+        expected = [transform(HL7Message.from_string(txt, 'native')).to_string() for txt in self.txts]
+        batch_transform = HL7BatchTransform(mapping, on_error='collect')
+        result = batch_transform([HL7Message.from_string(txt, 'native') for txt in self.txts])
+        self.assertEqual([message.to_string() for message in result], expected)
+        self.assertIn('ZDT|202005201640|202005201705+0100|30', expected[5])
+        self.assertEqual(len(batch_transform.errors), len(transform.errors))
+
+    def test_raises(self):
+        with self.assertRaises(TransformError) as cm:
+            self.transform_both('native', on_error='raise')
+        self.assertEqual(cm.exception.rule, 2)
+
+    def test_stream(self):
+        transform = HL7BatchTransform(self.mapping, on_error='collect')
+        messages = (HL7Message.from_string(txt, 'native') for txt in self.txts)
+        result = list(transform.stream(messages, batch_size=3))
+        self.assertEqual(len(result), 10)
+        self.assertIn('SCH||8678012^Doctolib||||neu_pat^Neupatient|||202005201712|', result[9].to_string())
+
+    def test_metrics(self):
+        counts = []
+        for transform_class in (HL7Transform, HL7BatchTransform):
+            metrics = HL7Metrics()
+            transform = transform_class(self.mapping, metrics, on_error='collect')
+            messages = [HL7Message.from_string(txt, 'native') for txt in self.txts]
+            if transform_class is HL7Transform:
+                for message in messages:
+                    transform(message)
+            else:
+                transform(messages)
+            result = metrics.to_dict()
+            counts.append({group: {key: (counter['calls'], counter['errors']) for key, counter in result[group].items()}
+                           for group in ('rules', 'operations')})
+            self.assertGreater(result['rules']['TQ1.7']['seconds'], 0)
+        self.assertEqual(counts[1], counts[0])
+        self.assertEqual(counts[1]['rules']['TQ1.7'], (10, 1))
+
+    def test_map_columns(self):
+        column = map_columns(lambda a, b: str(int(a) + int(b)),
+                             [Column(['1', '2', None, 'x'], {2: KeyError('a')}), Column(['1', None, '3', '4'], {1: KeyError('b')})])
+        self.assertEqual(column.values, ['2', None, None, None])
+        self.assertEqual(sorted(column.errors), [1, 2, 3])
+        self.assertIsInstance(column.errors[1], KeyError)
+
+
+if __name__ == '__main__':
+    unittest.main()
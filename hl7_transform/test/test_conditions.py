@@ -0,0 +1,145 @@
+"""
+Tests for hl7_transform.conditions module.
+"""
+import unittest
+from hl7_transform.conditions import HL7Condition, Conditional, Equals, AllOf, SKIP
+from hl7_transform.columnar import HL7BatchTransform
+from hl7_transform.field import HL7Field
+from hl7_transform.mapping import HL7Mapping
+from hl7_transform.message import HL7Message
+from hl7_transform.transform import HL7Transform, HL7TransformPlan, HL7RoutedPlan
+
+
+MAPPING = '''[
+  {"target_field": "ZZZ.1", "operation": "set_value", "args": {"value": "all"}},
+  {"target_field": "ZZZ.2", "operation": "copy_value", "source_field": "SCH.11.4",
+   "when": {"field": "MSH.9.1", "equals": "SIU"}},
+  {"when": {"field": "MSH.9.1", "equals": ["ADT", "ORU"]},
+   "rules": [
+     {"target_field": "ZZZ.3", "operation": "set_value", "args": {"value": "adt or oru"}},
+     {"target_field": "ZZZ.4", "operation": "copy_value", "source_field": "PID.3.1",
+      "when": {"field": "PID.3.4", "present": true}}
+   ]},
+  {"target_field": "ZZZ.5", "operation": "set_value", "args": {"value": "a01"},
+   "when": [{"field": "MSH.9.1", "equals": "ADT"}, {"field": "MSH.9", "matches": "\\\\^A0[14]$"}]},
+  {"target_field": "ZZZ.6", "operation": "set_value", "args": {"value": "not siu"},
+   "when": {"field": "MSH.9", "matches": "^(?!SIU)"}}
+]'''
+
+
+class TestHL7Condition(unittest.TestCase):
+    def setUp(self):
+        self.message = HL7Message.from_file('hl7_transform/test/test_msg.hl7', 'native')
+
+    def test_from_dict(self):
+        self.assertTrue(HL7Condition.from_dict({'field': 'MSH.9.1', 'equals': 'SIU'})(self.message))
+        self.assertTrue(HL7Condition.from_dict({'field': 'MSH.9.1', 'equals': ['ADT', 'SIU']})(self.message))
+        self.assertFalse(HL7Condition.from_dict({'field': 'MSH.9.1', 'equals': 'ADT'})(self.message))
+        self.assertTrue(HL7Condition.from_dict({'field': 'MSH.9', 'matches': '^SIU\\^S1[2-4]'})(self.message))
+        self.assertTrue(HL7Condition.from_dict({'field': 'PID.3', 'present': True})(self.message))
+        self.assertFalse(HL7Condition.from_dict({'field': 'PID.2', 'present': True})(self.message))
+        self.assertTrue(HL7Condition.from_dict({'field': 'ZBE.1', 'present': False})(self.message))
+        self.assertFalse(HL7Condition.from_dict({'field': 'ZBE.1', 'equals': 'x'})(self.message))
+        self.assertTrue(HL7Condition.from_dict({'field': 'PID.3.1', 'equals': 19619205})(self.message))
+        self.assertTrue(HL7Condition.from_dict({'field': 'PID.3.1', 'equals': [1, 19619205]})(self.message))
+        for value in (None, True, {'a': 1}, [['SIU']]):
+            with self.subTest(value=value), self.assertRaises(ValueError):
+                HL7Condition.from_dict({'field': 'MSH.9.1', 'equals': value})
+        with self.assertRaises(KeyError):
+            HL7Condition.from_dict({'field': 'MSH.9.1', 'contains': 'S'})
+
+    def test_restrict(self):
+        field = HL7Field('MSH.9.1')
+        condition = AllOf([Equals(field, ['ADT', 'ORU']), Equals(HL7Field('PID.8'), 'F')])
+        self.assertIs(condition.restrict(field, 'SIU'), False)
+        self.assertIs(condition.restrict(field, None), False)
+        self.assertIs(condition.restrict(field, 'ADT'), condition.conditions[1])
+        self.assertEqual(condition.compared_values(field), {'ADT', 'ORU'})
+
+    def test_conditional_is_not_evaluated(self):
+        operation = Conditional(HL7Mapping.from_string(
+            '[{"target_field": "ZZZ.1", "operation": "copy_value", "source_field": "ZBE.1"}]')[0][HL7Field('ZZZ.1')],
+            Equals(HL7Field('MSH.9.1'), 'ADT'))
+        self.assertIs(operation(self.message), SKIP)
+        self.assertEqual(str(operation), "<CopyValue when MSH.9.1 in ['ADT']>")
+
+
+class TestConditionalMapping(unittest.TestCase):
+    def setUp(self):
+        self.mapping = HL7Mapping.from_string(MAPPING)
+        with open('hl7_transform/test/test_msg.hl7') as f:
+            self.txt = '\n'.join(segment for segment in f.read().splitlines() if segment)
+        self.txts = [self.txt,
+                     self.txt.replace('SIU^S12', 'ADT^A01'),
+                     self.txt.replace('SIU^S12', 'ADT^A08'),
+                     self.txt.replace('SIU^S12', 'ORU^R01'),
+                     self.txt.replace('SIU^S12', 'MDM^T02'),
+                     self.txt.replace('SIU^S12', 'ADT^A04').replace('^^^Doctolib^PI', '')]
+
+    def zzz(self, message):
+        return message.segment_string('ZZZ')
+
+    def test_mapping(self):
+        self.assertEqual(len(self.mapping), 6)
+        self.assertIsInstance(self.mapping[2][HL7Field('ZZZ.3')], Conditional)
+        self.assertEqual(len(self.mapping[3][HL7Field('ZZZ.4')].condition.conditions), 2)
+
+    def test_transform(self):
+        transform = HL7Transform(self.mapping)
+        results = [self.zzz(transform(HL7Message.from_string(txt, 'native'))) for txt in self.txts]
+        self.assertEqual(results, [
+            'ZZZ|all|202005201615',
+            'ZZZ|all||adt or oru|19619205|a01|not siu',
+            'ZZZ|all||adt or oru|19619205||not siu',
+            'ZZZ|all||adt or oru|19619205||not siu',
+            'ZZZ|all|||||not siu',
+            'ZZZ|all||adt or oru||a01|not siu',
+        ])
+
+    def test_routing(self):
+        transform = HL7Transform(self.mapping)
+        self.assertIsInstance(transform.plan, HL7RoutedPlan)
+        self.assertEqual(transform.plan.field, HL7Field('MSH.9.1'))
+        self.assertEqual(sorted(transform.plan.plans), ['ADT', 'ORU', 'SIU'])
+        self.assertEqual(transform.plan.plans['SIU'].rules, (0, 1, 5))
+        self.assertEqual(transform.plan.plans['ORU'].rules, (0, 2, 3, 5))
+        self.assertEqual(transform.plan.default.rules, (0, 5))
+        # conditions decided by the route field are removed
+        self.assertEqual(type(transform.plan.plans['SIU'].steps[1][1]).__name__, 'CopyValue')
+        self.assertIsInstance(transform.plan.plans['ORU'].steps[2][1], Conditional)
+        # same results as evaluating every condition
+        unrouted = HL7TransformPlan([step for mapping in self.mapping for step in mapping.items()],
+                                    on_error=transform.on_error)
+        for txt in self.txts:
+            for parser in ('hl7apy', 'native'):
+                self.assertEqual(transform(HL7Message.from_string(txt, parser)).to_string(),
+                                 unrouted(HL7Message.from_string(txt, parser)).to_string())
+
+    def test_errors_report_mapping_rule(self):
+        mapping = HL7Mapping.from_string('''[
+          {"target_field": "ZZZ.1", "operation": "set_value", "args": {"value": "x"}, "when": {"field": "MSH.9.1", "equals": "ADT"}},
+          {"target_field": "ZZZ.2", "operation": "copy_value", "source_field": "ZBE.1"}
+        ]''')
+        transform = HL7Transform(mapping, on_error='collect')
+        transform(HL7Message.from_string(self.txt, 'native'))
+        self.assertEqual([error.rule for error in transform.errors], [1])
+
+    def test_no_routing_when_routing_field_is_written(self):
+        mapping = HL7Mapping.from_string('''[
+          {"target_field": "MSH.9.1", "operation": "set_value", "args": {"value": "ADT"}},
+          {"target_field": "ZZZ.1", "operation": "set_value", "args": {"value": "x"}, "when": {"field": "MSH.9.1", "equals": "ADT"}}
+        ]''')
+        transform = HL7Transform(mapping)
+        self.assertIsInstance(transform.plan, HL7TransformPlan)
+        message = transform(HL7Message.from_string(self.txt, 'native'))
+        self.assertEqual(self.zzz(message), 'ZZZ|x')
+
+    def test_batch_transform(self):
+        transform = HL7Transform(self.mapping)
+        expected = [transform(HL7Message.from_string(txt, 'native')).to_string() for txt in self.txts]
+        batch = HL7BatchTransform(self.mapping)([HL7Message.from_string(txt, 'native') for txt in self.txts])
+        self.assertEqual([message.to_string() for message in batch], expected)
+
+
+if __name__ == '__main__':
+    unittest.main()
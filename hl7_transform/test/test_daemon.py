@@ -0,0 +1,138 @@
+"""
+Tests for hl7_transform.daemon and hl7_transform.client modules.
+"""
+import io
+import os
+import shutil
+import socket
+import stat
+import subprocess
+import sys
+import tempfile
+import threading
+import unittest
+from contextlib import redirect_stderr
+from hl7_transform.__main__ import main_client
+from hl7_transform.client import request, DaemonError
+from hl7_transform.daemon import HL7TransformDaemon
+from hl7_transform.mapping import HL7Mapping
+from hl7_transform.message import HL7Message
+from hl7_transform.transform import HL7Transform
+
+
+MAPPING = '''[
+  {"target_field": "PID.8", "operation": "set_value", "args": {"value": "%s"}},
+  {"target_field": "ZZZ.1", "operation": "copy_value", "source_field": "PID.3.1"},
+  {"target_field": "ZZZ.2", "operation": "copy_value", "source_field": "ZBE.1"}
+]'''
+
+
+class TestHL7TransformDaemon(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.mapping_path = os.path.join(self.directory, 'mapping.json')
+        self.write_mapping('F')
+        with open('hl7_transform/test/test_msg.hl7') as f:
+            self.txt = f.read().strip()
+        self.daemon = HL7TransformDaemon(os.path.join(self.directory, 'daemon.sock'), preload=[self.mapping_path])
+        self.thread = threading.Thread(target=self.daemon.serve_forever)
+        self.thread.start()
+
+    def tearDown(self):
+        self.daemon.shutdown()
+        self.thread.join()
+        self.daemon.server_close()
+        shutil.rmtree(self.directory)
+
+    def write_mapping(self, value):
+        with open(self.mapping_path, 'w') as f:
+            f.write(MAPPING % value)
+
+    def request(self, **kwargs):
+        return request(self.daemon.server_address, self.mapping_path, **kwargs)
+
+    def test_transform(self):
+        transform = HL7Transform(HL7Mapping.from_json(self.mapping_path), on_error='collect')
+        for parser in ('hl7apy', 'native'):
+            with self.subTest(parser=parser):
+                response = self.request(message=self.txt, parser=parser, on_error='log')
+                self.assertEqual(response['message'], transform(HL7Message.from_string(self.txt, parser)).to_string())
+                self.assertEqual(len(response['warnings']), 1)
+                self.assertIn('Rule 2 (<CopyValue>) skipped in message MSH|', response['warnings'][0])
+        self.assertRegex(self.request(parser='native', on_error='log')['message'],
+                         r'^MSH\|\^~\\&\|\|\|\|\|\d{14}\|\|\|\|\|2\.5\nPID\|\|\|\|\|\|\|\|F\nZZZ\|$')
+
+    def test_errors(self):
+        with self.assertLogs('hl7_transform.daemon', level='WARNING') as logs:
+            with self.assertRaises(DaemonError):
+                self.request(message=self.txt)
+            with self.assertRaises(DaemonError):
+                self.request(message='not a message', on_error='log')
+            with self.assertRaisesRegex(DaemonError, 'Unsupported error policy collect'):
+                self.request(message=self.txt, on_error='collect')
+        self.assertEqual(len(logs.output), 3)
+
+    def test_transforms_are_cached(self):
+        transform, _ = self.daemon.transform_for(self.mapping_path, 'json', 'raise', False)
+        self.assertIs(self.daemon.transform_for(self.mapping_path, 'json', 'raise', False)[0], transform)
+        self.assertEqual(self.daemon.mappings.misses, 1)
+        self.write_mapping('M')
+        os.utime(self.mapping_path, ns=(0, 0))
+        self.assertIsNot(self.daemon.transform_for(self.mapping_path, 'json', 'raise', False)[0], transform)
+        response = self.request(message=self.txt, parser='native', on_error='log')
+        self.assertIn('\nPID|||19619205^^^Doctolib^PI||Test^Otto^^^^^L||19900101|M|', response['message'])
+
+    def test_optimize(self):
+        with open(self.mapping_path, 'w') as f:
+            f.write('[{"target_field": "MSH.9.1", "operation": "copy_value", "source_field": "MSH.9.1"}]')
+        response = self.request(message=self.txt, parser='native', optimize=True)
+        self.assertIn('Rule 0 (MSH.9.1 <CopyValue>) removed', response['report'])
+
+    def test_socket(self):
+        self.assertEqual(stat.S_IMODE(os.stat(self.daemon.server_address).st_mode), 0o600)
+        with self.assertRaises(OSError):
+            HL7TransformDaemon(self.daemon.server_address)
+        path = os.path.join(self.directory, 'stale.sock')
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as stale:
+            stale.bind(path)
+        umask = os.umask(0o022)
+        os.umask(umask)
+        daemon = HL7TransformDaemon(path)
+        self.assertEqual(os.umask(umask), umask)
+        daemon.server_close()
+        self.assertFalse(os.path.exists(path))
+        with self.assertRaises(OSError):
+            HL7TransformDaemon(self.mapping_path)
+        self.assertTrue(os.path.exists(self.mapping_path))
+
+    def test_main_client(self):
+        class Args:
+            connect = self.daemon.server_address
+            mappingfile = self.mapping_path
+            message = 'hl7_transform/test/test_msg.hl7'
+            out = os.path.join(self.directory, 'out.hl7')
+            type = 'json'
+            parser = 'native'
+            on_error = 'log'
+            optimize = False
+
+        s = io.StringIO()
+        with redirect_stderr(s):
+            self.assertEqual(main_client(Args), 0)
+        self.assertIn('WARNING hl7_transform.transform: ', s.getvalue())
+        with open(Args.out) as f:
+            self.assertIn('ZZZ|19619205', f.read())
+        Args.connect = os.path.join(self.directory, 'missing.sock')
+        with redirect_stderr(io.StringIO()):
+            self.assertEqual(main_client(Args), 1)
+
+
+class TestLazyImports(unittest.TestCase):
+    def test_cli_does_not_import_hl7apy(self):
+        script = 'import sys, hl7_transform.__main__, hl7_transform.client; print(sorted(m for m in sys.modules if m.startswith(("hl7apy", "asyncio"))))'
+        output = subprocess.run([sys.executable, '-c', script], stdout=subprocess.PIPE, check=True).stdout
+        self.assertEqual(output.strip(), b'[]')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,77 @@
+"""
+Tests for hl7_transform.dtm module.
+"""
+import unittest
+from datetime import datetime, timedelta, timezone
+from hl7_transform.dtm import HL7DateTime, parse_dtm, get_timezone
+
+
+class TestHL7DateTime(unittest.TestCase):
+    def test_round_trip(self):
+        for txt, type in [('2020', 'DTM'), ('202005', 'DTM'), ('20200520', 'DT'), ('2020052016', 'DTM'),
+                          ('202005201615', 'DTM'), ('20200520161530', 'DTM'), ('20200520161530.1', 'DTM'),
+                          ('20200520161530.1234+0200', 'DTM'), ('20200520-0530', 'DTM'),
+                          ('16', 'TM'), ('161530.25', 'TM'), ('1615-0100', 'TM')]:
+            with self.subTest(txt=txt):
+                self.assertEqual(HL7DateTime.from_string(txt, type).to_string(), txt)
+
+    def test_values(self):
+        dt = HL7DateTime.from_string('20200520161530.25+0200')
+        self.assertEqual(dt.value, datetime(2020, 5, 20, 16, 15, 30, 250000, timezone(timedelta(hours=2))))
+        self.assertEqual(dt.precision, 16)
+        self.assertEqual(HL7DateTime.from_string('1615', 'TM').value, datetime(1900, 1, 1, 16, 15))
+        self.assertIs(parse_dtm('202005201615'), parse_dtm('202005201615'))
+
+    def test_invalid_values(self):
+        for txt, type in [('', 'DTM'), ('2020052', 'DTM'), ('20201320', 'DTM'), ('2020052x', 'DTM'),
+                          ('202005201615.1', 'DTM'), ('20200520161530.12345', 'DTM'), ('20200520161530.', 'DTM'),
+                          ('20200520+01', 'DTM'), ('20200520+0100', 'DT'), ('2020052016', 'DT'),
+                          ('2460', 'TM'), ('161', 'TM'), ('٢٠٢٠', 'DTM'), ('2020', 'DATE')]:
+            with self.subTest(txt=txt):
+                with self.assertRaises(ValueError):
+                    HL7DateTime.from_string(txt, type)
+
+    def test_add(self):
+        dt = HL7DateTime.from_string('202005201615')
+        self.assertEqual(dt.add(50).to_string(), '202005201705')
+        self.assertEqual(dt.add(-1, 'days').to_string(), '202005191615')
+        self.assertEqual(dt.add(30, 'seconds').to_string(), '20200520161530')
+        self.assertEqual(HL7DateTime.from_string('20200520').add(90).to_string(), '202005200130')
+        self.assertEqual(HL7DateTime.from_string('20200131').add(1, 'months').to_string(), '20200229')
+        self.assertEqual(HL7DateTime.from_string('20200229').add(-1, 'years').to_string(), '20190228')
+        self.assertEqual(HL7DateTime.from_string('2359', 'TM').add(2).to_string(), '0001')
+        with self.assertRaises(ValueError):
+            dt.add(1, 'fortnights')
+        with self.assertRaises(ValueError):
+            HL7DateTime.from_string('99991231').add(1, 'days')
+
+    def test_truncate(self):
+        dt = HL7DateTime.from_string('20200520161530.1234+0200')
+        self.assertEqual(dt.truncate('day').to_string(), '20200520+0200')
+        self.assertEqual(dt.truncate('minute').to_string(), '202005201615+0200')
+        self.assertEqual(dt.truncate(16).to_string(), '20200520161530.12+0200')
+        self.assertEqual(dt.truncate(16).value.microsecond, 120000)
+        dt = HL7DateTime.from_string('2020')
+        self.assertIs(dt.truncate('day'), dt)
+
+    def test_truncate_time(self):
+        dt = HL7DateTime.from_string('123015.1234+0100', 'TM')
+        self.assertEqual(dt.truncate('hour').to_string(), '12+0100')
+        self.assertEqual(dt.truncate('second').to_string(), '123015+0100')
+        for txt in ('1230', '123015.1234+0100'):
+            for unit in ('day', 'month', 'year'):
+                with self.subTest(txt=txt, unit=unit):
+                    with self.assertRaises(ValueError):
+                        HL7DateTime.from_string(txt, 'TM').truncate(unit)
+
+    def test_get_timezone(self):
+        self.assertEqual(get_timezone('-0130').utcoffset(None), timedelta(hours=-1, minutes=-30))
+        self.assertIs(get_timezone('UTC'), timezone.utc)
+        for name in ('', '+1', 'Not/AZone'):
+            with self.subTest(name=name):
+                with self.assertRaises(ValueError):
+                    get_timezone(name)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,124 @@
+"""
+Tests for hl7_transform.er7 module.
+"""
+import unittest
+from hl7_transform.er7 import ER7Message
+from hl7_transform.message import HL7Message, NativeHL7Message
+from hl7_transform.mapping import HL7Mapping
+from hl7_transform.transform import HL7Transform
+from hl7_transform.field import HL7Field
+from hl7_transform import APIError
+
+
+class TestER7Message(unittest.TestCase):
+    def setUp(self):
+        with open('hl7_transform/test/test_msg.hl7') as f:
+            self.txt = f.read().strip()
+        self.message = HL7Message.from_string(self.txt, 'native')
+
+    def test_from_string(self):
+        self.assertIsInstance(self.message, NativeHL7Message)
+        self.assertIsInstance(self.message.hl7_message, ER7Message)
+        self.assertEqual(len(self.message.hl7_message.segments), 6)
+
+    def test_raises(self):
+        with self.assertRaises(APIError):
+            HL7Message.from_string('MSH|', 'native')
+        with self.assertRaises(APIError):
+            HL7Message.from_string('PID|1', 'native')
+        with self.assertRaises(ValueError):
+            HL7Message.from_string(self.txt, 'unknown')
+
+    def test_message_accessor(self):
+        self.assertEqual(self.message[HL7Field('MSH.1')], '|')
+        self.assertEqual(self.message[HL7Field('MSH.2')], '^~\\&')
+        self.assertEqual(self.message[HL7Field('MSH.9')], 'SIU^S12')
+        self.assertEqual(self.message[HL7Field('MSH.9.2')], 'S12')
+        self.assertEqual(self.message[HL7Field('SCH.11.4')], '202005201615')
+        self.assertEqual(self.message[HL7Field('PID.13.1')], '+491738599814')
+        self.assertEqual(self.message[HL7Field('NTE.1')], '')
+        with self.assertRaises(KeyError):
+            self.message[HL7Field('MSH.9.3')]
+        with self.assertRaises(KeyError):
+            self.message[HL7Field('NTE.4')]
+        with self.assertRaises(KeyError):
+            self.message[HL7Field('ZBE.1')]
+
+    def test_message_setter(self):
+        self.message[HL7Field('PID.13.1')] = '123'
+        self.message[HL7Field('RGS.3.2')] = 'a^b'
+        self.message[HL7Field('ZBE.2')] = 'new'
+        txt = self.message.to_string()
+        self.assertIn('||123^^^jackson.heights@doctolib.com~+49301234567', txt)
+        self.assertIn('\nRGS|1||^a\\S\\b\n', txt)
+        self.assertTrue(txt.endswith('\nZBE||new'))
+
+    def test_same_output_as_hl7apy(self):
+        mapping = HL7Mapping.from_string('''[
+          {"target_field": "MSH.9.1", "operation": "copy_value",         "source_field": "MSH.9.1"},
+          {"target_field": "MSH.9.3", "operation": "set_value",          "args": {"value": "SIU_S12"}},
+          {"target_field": "TQ1.7",   "operation": "copy_value",         "source_field": "SCH.11.4"},
+          {"target_field": "TQ1.8",   "operation": "add_values",         "source_fields": ["SCH.11.4", "SCH.11.3"], "args": {"type": "int"}},
+          {"target_field": "TQ1.9",   "operation": "concatenate_values", "source_fields": ["SCH.11.4", "SCH.11.3"], "args": {"separator": " + "}},
+          {"target_field": "MSH.5",   "operation": "set_value",          "args": {"value": ""}},
+          {"target_field": "ORC.7.4", "operation": "set_value",          "args": {"value": "4"}},
+          {"target_field": "ORC.7.5", "operation": "set_value",          "args": {"value": "5"}},
+          {"target_field": "ORC.7.6", "operation": "set_value",          "args": {"value": "6"}},
+          {"target_field": "SCH.9",   "operation": "set_end_time",       "source_fields": ["SCH.11.4", "SCH.11.3"]},
+          {"target_field": "ZBE.1.1", "operation": "set_value",          "args": {"value": "899860218"}},
+          {"target_field": "ZBE.1.2", "operation": "set_value",          "args": {"value": "MOVEMENT"}},
+          {"target_field": "ZBE.2",   "operation": "set_value",          "args": {"value": "20200522153917"}}
+        ]''')
+        transform = HL7Transform(mapping)
+        hl7apy_message = HL7Message.from_string(self.txt)
+        self.assertEqual(self.message.to_string(), hl7apy_message.to_string())
+        self.assertEqual(transform(self.message).to_string(), transform(hl7apy_message).to_string())
+        lazy_message = HL7Message.from_string(self.txt, 'lazy')
+        self.assertEqual(transform(lazy_message).to_string(), transform(hl7apy_message).to_string())
+
+    def test_lossless(self):
+        with open('hl7_transform/test/test_transform.hl7') as f:
+            txt = f.read().strip()
+        self.assertEqual(HL7Message.from_string(txt, 'native').to_string(), txt)
+        self.assertEqual(HL7Message.from_string(txt, 'lazy').to_string(), txt)
+
+    def test_lazy(self):
+        message = HL7Message.from_string(self.txt, 'lazy')
+        segments = message.hl7_message.segments
+        self.assertEqual(len(segments), 6)
+        self.assertIsInstance(segments[0], list)
+        self.assertTrue(all(isinstance(segment, str) for segment in segments[1:]))
+        self.assertEqual(message[HL7Field('PID.13[2]')], '+49301234567')
+        message[HL7Field('RGS.2')] = 'x'
+        self.assertEqual([isinstance(segment, str) for segment in segments], [False, True, True, False, False, True])
+        self.assertEqual(message.segment_string('NTE'), 'NTE|||Muss Ultraschall bekommen')
+        txt = '\n'.join(segment for segment in self.txt.splitlines() if segment)
+        self.assertEqual(message.to_string(), txt.replace('RGS|1', 'RGS|1|x'))
+
+    def test_copy_on_write(self):
+        for parser in ('native', 'lazy'):
+            with self.subTest(parser=parser):
+                message = HL7Message.from_string(self.txt, parser)
+                original = message.to_string()
+                message[HL7Field('PID.3.1')]
+                copy = message.copy()
+                self.assertIs(copy.hl7_message.segments[3], message.hl7_message.segments[3])
+                copy[HL7Field('PID.3.1')] = '1'
+                copy[HL7Field('ZBE.1')] = '2'
+                self.assertEqual(message.to_string(), original)
+                self.assertEqual(copy.segment_string('PID')[:14], 'PID|||1^^^Doct')
+                self.assertIs(copy.hl7_message.segments[0], message.hl7_message.segments[0])
+                message[HL7Field('MSH.10')] = '3'
+                self.assertEqual(copy[HL7Field('MSH.10')], 'd051c31adcc460b5289f')
+                self.assertEqual(message[HL7Field('PID.3.1')], '19619205')
+                self.assertIsNone(message.segment_string('ZBE'))
+
+    def test_new(self):
+        message = HL7Message.new('native')
+        message[HL7Field('MSH.7')] = '20200101000000'
+        message[HL7Field('MSH.10')] = '1'
+        self.assertEqual(message.to_string(), 'MSH|^~\\&|||||20200101000000|||1||2.5')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,49 @@
+"""
+Tests for hl7_transform.field module.
+"""
+import pickle
+import unittest
+from hl7_transform.field import HL7Field
+
+
+class TestHL7Field(unittest.TestCase):
+    def test_parse(self):
+        field = HL7Field('PID.3.4')
+        self.assertEqual((field.segment, field.field, field.component), ('PID', 3, 4))
+        self.assertEqual(field.field_name, 'PID_3')
+        self.assertEqual(field.component_name, 'PID_3_4')
+        self.assertEqual(HL7Field('PID.3').component, 0)
+        self.assertEqual(str(field), '(PID.3.4)')
+
+    def test_parse_full_address(self):
+        field = HL7Field('OBX[3].5[2].4.1')
+        self.assertEqual((field.segment, field.occurrence, field.field, field.repetition, field.component, field.sub_component),
+                         ('OBX', 3, 5, 2, 4, 1))
+        field = HL7Field('PID.3')
+        self.assertEqual((field.occurrence, field.repetition, field.sub_component), (None, 1, 0))
+        self.assertEqual(HL7Field('PID.3[1]'), HL7Field('PID.3'))
+        self.assertNotEqual(HL7Field('PID[1].3'), HL7Field('PID.3'))
+        for name in ('PID', 'PID.x', 'PID[0].3', 'PID.3[0]', 'PID.3.0.1', 'PID.3.1.1.1'):
+            with self.assertRaises(ValueError):
+                HL7Field(name)
+
+    def test_interned(self):
+        self.assertIs(HL7Field('MSH.9.1'), HL7Field('MSH.9.1'))
+        self.assertIs(pickle.loads(pickle.dumps(HL7Field('MSH.9.1'))), HL7Field('MSH.9.1'))
+
+    def test_hashable(self):
+        self.assertEqual(HL7Field('PID.3'), HL7Field('PID.3.0'))
+        self.assertNotEqual(HL7Field('PID.3'), HL7Field('PID.3.1'))
+        index = {HL7Field('PID.3'): 1}
+        self.assertEqual(index[HL7Field('PID.3.0')], 1)
+
+    def test_immutable(self):
+        field = HL7Field('PID.3')
+        with self.assertRaises(AttributeError):
+            field.field = 4
+        with self.assertRaises(AttributeError):
+            field.extra = 4
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,157 @@
+"""
+Tests for hl7_transform.lookup module and the lookup_value operation.
+"""
+import json
+import os
+import pickle
+import shutil
+import sqlite3
+import tempfile
+import unittest
+from hl7_transform.columnar import HL7BatchTransform
+from hl7_transform.field import HL7Field
+from hl7_transform.lookup import LookupTable, SQLiteLookupTable, load_table
+from hl7_transform.mapping import HL7Mapping
+from hl7_transform.message import HL7Message
+from hl7_transform.operations import LookupValue
+from hl7_transform.transform import HL7Transform
+
+
+class LookupTableFiles:
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.csv_path = os.path.join(self.directory, 'departments.csv')
+        with open(self.csv_path, 'w') as f:
+            f.write('local_code,facility,partner_code\n'
+                    'allg_chir,Doctolib,SURG\n'
+                    'allg_chir,Other,SURG2\n'
+                    'kardio,Doctolib,CARD\n')
+        self.json_path = os.path.join(self.directory, 'sex.json')
+        with open(self.json_path, 'w') as f:
+            json.dump({'M': 'male', 'F': 'female', 'U': 0}, f)
+        self.db_path = os.path.join(self.directory, 'codes.sqlite')
+        with sqlite3.connect(self.db_path) as connection:
+            connection.execute('CREATE TABLE codes (local_code TEXT, facility TEXT, partner_code TEXT)')
+            connection.execute('CREATE INDEX codes_key ON codes (local_code, facility)')
+            connection.executemany('INSERT INTO codes VALUES (?, ?, ?)',
+                                   [('allg_chir', 'Doctolib', 'SURG'), ('kardio', 'Doctolib', 'CARD')])
+        connection.close()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+
+class TestLookupTable(LookupTableFiles, unittest.TestCase):
+    def test_csv(self):
+        table = load_table(self.csv_path, ['local_code', 'facility'], 'partner_code')
+        self.assertIsInstance(table, LookupTable)
+        self.assertEqual(len(table), 3)
+        self.assertEqual(table.get(('allg_chir', 'Other')), 'SURG2')
+        self.assertIsNone(table.get(('allg_chir', 'Unknown')))
+        table = load_table(self.csv_path, 'local_code', 'partner_code')
+        self.assertEqual(table.get('kardio'), 'CARD')
+
+    def test_json(self):
+        table = load_table(self.json_path)
+        self.assertEqual(table.get('F'), 'female')
+        self.assertEqual(table.get('U'), '0')
+        records_path = os.path.join(self.directory, 'records.json')
+        with open(records_path, 'w') as f:
+            json.dump([{'code': 'a', 'value': 'b'}], f)
+        self.assertEqual(load_table(records_path, 'code', 'value').get('a'), 'b')
+        with self.assertRaises(ValueError):
+            load_table(records_path)
+
+    def test_json_numbers_and_nulls(self):
+        with open(self.json_path, 'w') as f:
+            json.dump({'M': 'male', 'X': None}, f)
+        table = load_table(self.json_path)
+        self.assertIsNone(table.get('X'))
+        records_path = os.path.join(self.directory, 'rooms.json')
+        with open(records_path, 'w') as f:
+            json.dump([{'code': 101, 'ward': 2, 'name': 'x'}, {'code': 102, 'ward': 2, 'name': None},
+                       {'code': None, 'ward': 2, 'name': 'y'}], f)
+        table = load_table(records_path, 'code', 'name')
+        self.assertEqual(table.get('101'), 'x')
+        self.assertIsNone(table.get('102'))
+        self.assertEqual(len(table), 1)
+        self.assertEqual(load_table(records_path, ['code', 'ward'], 'name').get(('101', '2')), 'x')
+        mapping = HL7Mapping.from_string(json.dumps([{"target_field": "PV1.3.2", "operation": "lookup_value", "source_field": "PID.8",
+                                                      "args": {"table": records_path, "key": "code", "value": "name", "default": "none"}}]))
+        message = HL7Message.from_string('MSH|^~\\&|\nPID||||||||102\nPV1|', 'native')
+        self.assertEqual(HL7Transform(mapping)(message)[HL7Field('PV1.3.2')], 'none')
+
+    def test_sqlite(self):
+        table = load_table(self.db_path, ['local_code', 'facility'], 'partner_code', 'codes', cache_size=1)
+        self.assertIsInstance(table, SQLiteLookupTable)
+        self.assertEqual(len(table), 2)
+        self.assertEqual(table.get(('kardio', 'Doctolib')), 'CARD')
+        self.assertEqual(table.get(('kardio', 'Doctolib')), 'CARD')
+        self.assertIsNone(table.get(('kardio', 'Other')))
+        info = table.get.cache_info()
+        self.assertEqual((info.hits, info.misses, info.currsize), (1, 2, 1))
+        with self.assertRaises(ValueError):
+            load_table(self.db_path, 'local_code', 'partner_code')
+
+    def test_sqlite_path_with_uri_characters(self):
+        path = os.path.join(self.directory, 'codes ?#%20.sqlite')
+        shutil.copy(self.db_path, path)
+        table = load_table(path, ['local_code', 'facility'], 'partner_code', 'codes')
+        self.assertEqual(table.get(('kardio', 'Doctolib')), 'CARD')
+        table.close()
+
+    def test_tables_are_shared(self):
+        table = load_table(self.csv_path, 'local_code', 'partner_code')
+        self.assertIs(load_table(os.path.relpath(self.csv_path), ['local_code'], 'partner_code'), table)
+        os.utime(self.csv_path, ns=(0, 0))
+        self.assertIsNot(load_table(self.csv_path, 'local_code', 'partner_code'), table)
+
+
+class TestLookupValue(LookupTableFiles, unittest.TestCase):
+    def mapping(self, path, **args):
+        return HL7Mapping.from_string(json.dumps([
+            {'target_field': 'AIG.4.1', 'operation': 'lookup_value', 'source_fields': ['AIG.4.1', 'MSH.3'],
+             'args': dict({'table': path, 'key': ['local_code', 'facility'], 'value': 'partner_code'}, **args)},
+            {'target_field': 'PID.8', 'operation': 'lookup_value', 'source_field': 'PID.8',
+             'args': {'table': self.json_path}},
+        ]))
+
+    def test_transform(self):
+        for path, args in ((self.csv_path, {}), (self.db_path, {'table_name': 'codes'})):
+            with self.subTest(path=path):
+                transform = HL7Transform(self.mapping(path, **args))
+                message = transform(HL7Message.from_file('hl7_transform/test/test_msg.hl7', 'native'))
+                self.assertEqual(message.segment_string('AIG'), 'AIG|1|||SURG^Allg. Chirurgie')
+                self.assertEqual(message[HL7Field('PID.8')], 'male')
+
+    def test_missing_key(self):
+        with open('hl7_transform/test/test_msg.hl7') as f:
+            txt = f.read().replace('allg_chir', 'neuro')
+        transform = HL7Transform(self.mapping(self.csv_path), on_error='collect')
+        transform(HL7Message.from_string(txt, 'native'))
+        self.assertEqual([error.rule for error in transform.errors], [0])
+        transform = HL7Transform(self.mapping(self.csv_path, default='UNKNOWN'))
+        message = transform(HL7Message.from_string(txt, 'native'))
+        self.assertEqual(message[HL7Field('AIG.4.1')], 'UNKNOWN')
+
+    def test_batch_transform(self):
+        with open('hl7_transform/test/test_msg.hl7') as f:
+            txt = '\n'.join(segment for segment in f.read().splitlines() if segment)
+        txts = [txt, txt.replace('allg_chir', 'kardio'), txt.replace('allg_chir', 'neuro'), txt.replace('|M|', '|F|')]
+        mapping = self.mapping(self.csv_path)
+        transform = HL7Transform(mapping, on_error='collect')
+        expected = [transform(HL7Message.from_string(txt, 'native')).to_string() for txt in txts]
+        batch_transform = HL7BatchTransform(mapping, on_error='collect')
+        result = batch_transform([HL7Message.from_string(txt, 'native') for txt in txts])
+        self.assertEqual([message.to_string() for message in result], expected)
+        self.assertEqual(len(batch_transform.errors), 1)
+
+    def test_pickle(self):
+        operation = LookupValue(['PID.8'], {'table': os.path.relpath(self.json_path)})
+        copy = pickle.loads(pickle.dumps(operation))
+        self.assertIs(copy.table, operation.table)
+        self.assertEqual(copy.translate('M'), 'male')
+
+
+if __name__ == '__main__':
+    unittest.main()
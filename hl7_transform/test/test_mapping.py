@@ -1,7 +1,10 @@
 """
 Tests for hl7_transform.mapping module.
 """
+import os
+import tempfile
 import unittest
+from hl7_transform.conditions import Conditional, Equals, Matches
 from hl7_transform.mapping import HL7Mapping
 
 
@@ -46,6 +49,39 @@ class TestHL7Mapping(unittest.TestCase):
         self.assertEqual(operation.__class__.__name__, exp_res['operation_name'])
         self.assertEqual(operation.field.name, exp_res['source_field'])
 
+    def test_from_csv_with_conditions(self):
+        fd, path = tempfile.mkstemp(suffix='.csv')
+        with os.fdopen(fd, 'w') as f:
+            f.write('target_field,operation,args.value,source_field,when.field,when.equals,when.matches\n'
+                    'PID.3,set_value,123,,,,\n'
+                    'PV1.2,copy_value,,PID.18,MSH.9.1,ADT,\n'
+                    'PV1.3,set_value,x,,MSH.9,,^SIU\n')
+        try:
+            mapping = HL7Mapping.from_csv(path)
+        finally:
+            os.remove(path)
+        operations = [operation for rule in mapping for operation in rule.values()]
+        self.assertEqual([operation.__class__.__name__ for operation in operations], ['SetValue', 'Conditional', 'Conditional'])
+        self.assertIsInstance(operations[1].condition, Equals)
+        self.assertEqual(operations[1].operation.field.name, 'PID.18')
+        self.assertIsInstance(operations[2].condition, Matches)
+        self.assertEqual(operations[2].operation.value, 'x')
+
+    def test_rule_groups(self):
+        mapping = HL7Mapping.from_string('''[
+          {"target_field": "PID.3", "operation": "set_value", "args": {"value": "1"}},
+          {"when": {"field": "MSH.9.1", "equals": "ADT"}, "rules": [
+            {"target_field": "PV1.2", "operation": "set_value", "args": {"value": "I"}},
+            {"when": {"field": "PID.8", "equals": "F"}, "rules": [
+              {"target_field": "PV1.3", "operation": "set_value", "args": {"value": "F"}}
+            ]}
+          ]}
+        ]''')
+        self.assertEqual([list(rule)[0].name for rule in mapping], ['PID.3', 'PV1.2', 'PV1.3'])
+        operation = list(mapping[2].values())[0]
+        self.assertIsInstance(operation, Conditional)
+        self.assertEqual(str(operation.condition), "MSH.9.1 in ['ADT'] and PID.8 in ['F']")
+
 
 if __name__ == '__main__':
     unittest.main()
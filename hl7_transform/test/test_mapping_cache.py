@@ -0,0 +1,60 @@
+"""
+Tests for hl7_transform.mapping_cache module.
+"""
+import os
+import shutil
+import tempfile
+import unittest
+from hl7_transform.mapping_cache import HL7MappingCache, load_mapping
+
+
+class TestHL7MappingCache(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.cache_dir = os.path.join(self.directory, 'cache')
+        self.path = os.path.join(self.directory, 'mapping.json')
+        shutil.copy('hl7_transform/test/test_transform.json', self.path)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_memory_cache(self):
+        cache = HL7MappingCache(maxsize=1)
+        mapping = cache.load(self.path)
+        self.assertEqual(len(mapping), 13)
+        self.assertIs(cache.load(self.path), mapping)
+        cache.load('hl7_transform/test/test_transform.csv', 'csv')
+        self.assertIsNot(cache.load(self.path), mapping)
+        self.assertEqual((cache.hits, cache.misses), (1, 3))
+
+    def test_disk_cache(self):
+        mapping = HL7MappingCache(self.cache_dir).load(self.path)
+        self.assertEqual(len(os.listdir(self.cache_dir)), 1)
+        cache = HL7MappingCache(self.cache_dir)
+        cached_mapping = cache.load(self.path)
+        self.assertEqual((cache.disk_hits, cache.misses), (1, 0))
+        self.assertEqual(str(cached_mapping), str(mapping))
+
+    def test_touched_file(self):
+        HL7MappingCache(self.cache_dir).load(self.path)
+        stat = os.stat(self.path)
+        os.utime(self.path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+        cache = HL7MappingCache(self.cache_dir)
+        cache.load(self.path)
+        self.assertEqual((cache.disk_hits, cache.misses), (1, 0))
+
+    def test_modified_file(self):
+        cache = HL7MappingCache(self.cache_dir)
+        cache.load(self.path)
+        with open(self.path, 'w') as f:
+            f.write('[{"target_field": "PID.3", "operation": "set_value", "args": {"value": "1"}}]')
+        self.assertEqual(len(cache.load(self.path)), 1)
+        self.assertEqual(len(HL7MappingCache(self.cache_dir).load(self.path)), 1)
+        self.assertEqual(cache.misses, 2)
+
+    def test_load_mapping(self):
+        self.assertIs(load_mapping(self.path, cache_dir=self.cache_dir), load_mapping(self.path, cache_dir=self.cache_dir))
+
+
+if __name__ == '__main__':
+    unittest.main()
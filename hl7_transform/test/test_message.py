@@ -1,6 +1,7 @@
-from hl7_transform.message import HL7Message
+from hl7_transform.message import HL7Message, preload_hl7apy, _preloaded
 from hl7_transform.field import HL7Field
 from hl7_transform import APIError
+import io
 import unittest
 
 
@@ -18,6 +19,107 @@ class TestHL7Transform(unittest.TestCase):
     def test_message_to_string(self):
         self.assertIn('\n', self.message.to_string())
 
+    def test_message_setter_updates_index(self):
+        self.assertEqual(self.message[HL7Field('PID.3.1')], '19619205')
+        self.message[HL7Field('PID.3.1')] = '42'
+        self.assertEqual(self.message[HL7Field('PID.3.1')], '42')
+        self.message[HL7Field('PID.3')] = '43^^^Doctolib^PI'
+        self.assertEqual(self.message[HL7Field('PID.3.1')], '43')
+        self.message[HL7Field('ZBE.1.2')] = 'MOVEMENT'
+        self.assertEqual(self.message[HL7Field('ZBE.1.2')], 'MOVEMENT')
+        self.assertIn('ZBE|^MOVEMENT', self.message.to_string())
+
+    def test_message_repeated_segments(self):
+        segments = ['OBX|{}|ST|||value {}'.format(i, i) for i in range(1, 301)]
+        message = HL7Message.from_string('\n'.join(self.message.to_string().split('\n')[:1] + segments))
+        self.assertEqual(message[HL7Field('OBX.1')], '1')
+        self.assertEqual(message[HL7Field('OBX.5')], 'value 1')
+        message[HL7Field('OBX.5')] = 'changed'
+        self.assertEqual(message[HL7Field('OBX.5')], 'changed')
+        self.assertIn('OBX|2|ST|||value 2', message.to_string())
+
+    def test_repetitions_and_sub_components(self):
+        for parser in ('hl7apy', 'native'):
+            with self.subTest(parser=parser):
+                message = HL7Message.from_file('hl7_transform/test/test_msg.hl7', parser)
+                self.assertEqual(message[HL7Field('PID.13[2]')], '+49301234567')
+                self.assertEqual(message[HL7Field('PID.13[1].4')], 'jackson.heights@doctolib.com')
+                self.assertEqual(message[HL7Field('PID.3.4.1')], 'Doctolib')
+                with self.assertRaises(KeyError):
+                    message[HL7Field('PID.13[3]')]
+                with self.assertRaises(KeyError):
+                    message[HL7Field('PID.3.4.2')]
+                message[HL7Field('PID.13[3]')] = '+4930555'
+                message[HL7Field('PID.3.4.2')] = 'DE'
+                self.assertEqual(message[HL7Field('PID.13[3]')], '+4930555')
+                self.assertEqual(message[HL7Field('PID.3.4')], 'Doctolib&DE')
+                self.assertIn('||19619205^^^Doctolib&DE^PI||', message.to_string())
+                self.assertIn('@doctolib.com~+49301234567~+4930555', message.to_string())
+
+    def test_segment_occurrences(self):
+        segments = ['OBX|{}|ST|||value {}'.format(i, i) for i in range(1, 301)]
+        txt = '\n'.join(self.message.to_string().split('\n')[:1] + segments)
+        for parser in ('hl7apy', 'native'):
+            with self.subTest(parser=parser):
+                message = HL7Message.from_string(txt, parser)
+                self.assertEqual(message[HL7Field('OBX[1].5')], 'value 1')
+                self.assertEqual(message[HL7Field('OBX[300].5')], 'value 300')
+                with self.assertRaises(KeyError):
+                    message[HL7Field('OBX[301].5')]
+                message[HL7Field('OBX[3].5')] = 'changed'
+                message[HL7Field('NTE[2].3')] = 'note'
+                self.assertEqual(message[HL7Field('OBX[3].5')], 'changed')
+                self.assertEqual(message[HL7Field('OBX.5')], 'value 1')
+                self.assertEqual(message[HL7Field('NTE.3')], 'note')
+                txt_out = message.to_string()
+                self.assertIn('\nOBX|3|ST|||changed\n', txt_out)
+                self.assertTrue(txt_out.endswith('\nNTE\nNTE|||note'))
+
+    def test_preload_hl7apy(self):
+        preload_hl7apy(['2.3', '2.8'], ['tolerant', 'strict'])
+        self.assertTrue({('2.3', 'strict'), ('2.8', 'tolerant')} <= _preloaded)
+        with self.assertRaises(ValueError):
+            preload_hl7apy(['2.5'], ['quiet'])
+        message = HL7Message.from_string('MSH|^~\\&|||||||ADT^A01|1|P|2.3\nPID|1||1')
+        self.assertEqual(message[HL7Field('PID.3')], '1')
+
+    def test_copy_keeps_validation_level(self):
+        from hl7apy.consts import VALIDATION_LEVEL
+        from hl7apy.parser import parse_message
+        txt = 'MSH|^~\\&|A|B|C|D|20200101000000||ADT^A01|1|P|2.5\rPID|1||1||Doe^John'
+        message = HL7Message(parse_message(txt, VALIDATION_LEVEL.STRICT, find_groups=False))
+        copy = message.copy()
+        self.assertEqual(copy.hl7_message.validation_level, VALIDATION_LEVEL.STRICT)
+        self.assertEqual(copy.to_string(), message.to_string())
+        self.assertEqual(message.parsed_like(txt).hl7_message.validation_level, VALIDATION_LEVEL.STRICT)
+        self.assertEqual(self.message.copy().hl7_message.validation_level, VALIDATION_LEVEL.TOLERANT)
+
+    def test_new(self):
+        messages = {parser: HL7Message.new(parser) for parser in ('hl7apy', 'native')}
+        for parser, message in messages.items():
+            with self.subTest(parser=parser):
+                self.assertRegex(message[HL7Field('MSH.7')], r'^\d{14}$')
+                message[HL7Field('MSH.7')] = '20200101000000'
+                message[HL7Field('MSH.10')] = '1'
+        self.assertEqual(messages['native'].to_string(), messages['hl7apy'].to_string())
+        self.assertEqual(messages['native'].to_string(), 'MSH|^~\\&|||||20200101000000|||1||2.5')
+
+    def test_serialization_cache(self):
+        for parser in ('hl7apy', 'native', 'lazy'):
+            with self.subTest(parser=parser):
+                message = HL7Message.from_file('hl7_transform/test/test_msg.hl7', parser)
+                txt = message.to_string()
+                strings = message.segment_strings()
+                message[HL7Field('PID.8')] = 'F'
+                changed = message.segment_strings()
+                self.assertEqual([a is b for a, b in zip(strings, changed)], [True, True, True, False, True, True])
+                self.assertEqual(message.to_string(), txt.replace('|19900101|M|', '|19900101|F|'))
+                self.assertEqual(message.segment_string('PID'), changed[3])
+                out = io.StringIO()
+                message.write(out)
+                self.assertEqual(out.getvalue(), message.to_string() + '\n')
+                self.assertEqual(message.to_bytes(), message.to_string().replace('\n', '\r').encode())
+
     def test_raises(self):
         with self.assertRaises(APIError):
             HL7Message.from_string('MSH|')
@@ -0,0 +1,54 @@
+"""
+Tests for hl7_transform.metrics module.
+"""
+import unittest
+from hl7_transform.metrics import HL7Metrics
+from hl7_transform.mapping import HL7Mapping
+from hl7_transform.message import HL7Message
+from hl7_transform.transform import HL7Transform
+
+
+class TestHL7Metrics(unittest.TestCase):
+    def setUp(self):
+        self.metrics = HL7Metrics()
+        self.transform = HL7Transform(HL7Mapping.from_json('hl7_transform/test/test_transform.json'), self.metrics)
+
+    def test_transform(self):
+        for _ in range(2):
+            with self.metrics.measure('parse'):
+                message = HL7Message.from_file('hl7_transform/test/test_msg.hl7')
+            self.transform(message)
+        metrics = self.metrics.to_dict()
+        self.assertEqual(metrics['rules']['TQ1.7']['calls'], 2)
+        self.assertGreater(metrics['rules']['TQ1.7']['seconds'], 0)
+        self.assertEqual(metrics['operations']['SetValue']['calls'], 12)
+        self.assertEqual(metrics['stages']['transform']['calls'], 2)
+        self.assertEqual(metrics['stages']['parse']['calls'], 2)
+
+    def test_errors(self):
+        message = HL7Message.from_file('hl7_transform/test/test_transform.hl7')
+        with self.assertRaises(RuntimeError):
+            self.transform(message)
+        with self.assertRaises(ValueError), self.metrics.measure('parse'):
+            HL7Message.from_string('MSH|^~\\&', 'unknown')
+        metrics = self.metrics.to_dict()
+        self.assertEqual(metrics['rules']['TQ1.7']['errors'], 1)
+        self.assertEqual(metrics['operations']['CopyValue']['errors'], 1)
+        self.assertEqual(metrics['stages']['transform']['errors'], 1)
+        self.assertEqual(metrics['stages']['parse']['errors'], 1)
+
+    def test_to_prometheus(self):
+        self.transform(HL7Message.from_file('hl7_transform/test/test_msg.hl7'))
+        txt = self.metrics.to_prometheus()
+        self.assertIn('# TYPE hl7_transform_rule_seconds_total counter', txt)
+        self.assertIn('hl7_transform_rule_calls_total{target_field="SCH.9"} 1\n', txt)
+        self.assertIn('hl7_transform_operation_errors_total{operation="SetEndTime"} 0\n', txt)
+        self.assertIn('hl7_transform_stage_calls_total{stage="transform"} 1\n', txt)
+
+    def test_disabled(self):
+        transform = HL7Transform(HL7Mapping.from_json('hl7_transform/test/test_transform.json'))
+        self.assertIsNone(transform.plan.metrics)
+
+
+if __name__ == '__main__':
+    unittest.main()
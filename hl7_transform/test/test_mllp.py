@@ -0,0 +1,188 @@
+"""
+Tests for hl7_transform.mllp module.
+"""
+import asyncio
+import time
+import unittest
+from hl7_transform.mllp import HL7MLLPServer, frame, read_frame, make_ack, ack_code
+from hl7_transform.mapping import HL7Mapping
+from hl7_transform.transform import HL7Transform
+
+
+class Downstream:
+    """
+    A stand-in downstream MLLP endpoint that records messages and replies with a fixed ACK code.
+    """
+    def __init__(self, code='AA'):
+        self.code = code
+        self.messages = []
+
+    async def start(self):
+        self.server = await asyncio.start_server(self.handle, '127.0.0.1', 0, limit=1024 * 1024)
+        return self.server.sockets[0].getsockname()[1]
+
+    async def handle(self, reader, writer):
+        while True:
+            txt = await read_frame(reader)
+            if txt is None:
+                break
+            self.messages.append(txt)
+            writer.write(frame(make_ack(txt, self.code)))
+            await writer.drain()
+        writer.close()
+
+    async def close(self):
+        self.server.close()
+        await self.server.wait_closed()
+
+
+async def send(port, messages):
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    acks = []
+    for txt in messages:
+        writer.write(frame(txt))
+        await writer.drain()
+        acks.append(await read_frame(reader))
+    writer.close()
+    await writer.wait_closed()
+    return acks
+
+
+class TestMLLP(unittest.TestCase):
+    def setUp(self):
+        with open('hl7_transform/test/test_msg.hl7') as f:
+            self.txt = f.read().strip()
+        self.transform = HL7Transform(HL7Mapping.from_json('hl7_transform/test/test_transform.json'))
+
+    def test_make_ack(self):
+        ack = make_ack(self.txt, 'AE', 'Error|in^field')
+        self.assertTrue(ack.startswith('MSH|^~\\&|Doctolib||Doctolib||'))
+        self.assertIn('||ACK^S12|d051c31adcc460b5289f|P|2.5.1\r', ack)
+        self.assertTrue(ack.endswith('\rMSA|AE|d051c31adcc460b5289f|Error\\F\\in\\S\\field'))
+        self.assertEqual(ack_code(ack), 'AE')
+        self.assertEqual(ack_code(make_ack('garbage', 'AR')), 'AR')
+
+    def test_forward(self):
+        asyncio.run(self.forward())
+
+    async def forward(self):
+        downstream = Downstream()
+        server = HL7MLLPServer(self.transform, ('127.0.0.1', await downstream.start()), pool_size=2, max_in_flight=4)
+        await server.start('127.0.0.1', 0)
+        try:
+            results = await asyncio.gather(*(send(server.port, [self.txt] * 5) for _ in range(20)))
+        finally:
+            await server.close()
+            await downstream.close()
+        self.assertEqual([ack_code(ack) for acks in results for ack in acks], ['AA'] * 100)
+        self.assertEqual(len(downstream.messages), 100)
+        self.assertIn('\rTQ1|||||||202005201615|', downstream.messages[0])
+
+    def test_nack(self):
+        asyncio.run(self.nack())
+
+    async def nack(self):
+        downstream = Downstream('AE')
+        server = HL7MLLPServer(self.transform, ('127.0.0.1', await downstream.start()))
+        await server.start('127.0.0.1', 0)
+        try:
+            invalid, bad_transform, rejected = await send(server.port, ['MSH|', 'MSH|^~\\&|A\rPID|1', self.txt])
+        finally:
+            await server.close()
+            await downstream.close()
+        self.assertEqual(ack_code(invalid), 'AR')
+        self.assertEqual(ack_code(bad_transform), 'AE')
+        self.assertEqual(ack_code(rejected), 'AE')
+        self.assertEqual(len(downstream.messages), 1)
+
+    def test_large_messages(self):
+        asyncio.run(self.large_messages())
+
+    async def large_messages(self):
+        # OBX segments with about 100 KB of embedded data, above the default stream limit of asyncio
+        large = self.txt + '\nOBX|1|ED|PDF^Report||^AP^PDF^Base64^' + 'A' * 100000
+        downstream = Downstream()
+        server = HL7MLLPServer(self.transform, ('127.0.0.1', await downstream.start()))
+        await server.start('127.0.0.1', 0)
+        try:
+            acks = await send(server.port, [large, self.txt])
+        finally:
+            await server.close()
+            await downstream.close()
+        self.assertEqual([ack_code(ack) for ack in acks], ['AA', 'AA'])
+        self.assertIn('A' * 100000, downstream.messages[0])
+
+        server = HL7MLLPServer(self.transform, max_message_size=64 * 1024)
+        await server.start('127.0.0.1', 0)
+        try:
+            with self.assertLogs('hl7_transform.mllp', level='WARNING'):
+                reader, writer = await asyncio.open_connection('127.0.0.1', server.port)
+                writer.write(frame(large))
+                ack = await read_frame(reader)
+                # the connection is closed after the rejection
+                self.assertIsNone(await read_frame(reader))
+                writer.close()
+        finally:
+            await server.close()
+        self.assertEqual(ack_code(ack), 'AR')
+        self.assertIn('|d051c31adcc460b5289f|Message larger than 65536 bytes', ack)
+
+    def test_slow_transform_does_not_block(self):
+        asyncio.run(self.slow_transform_does_not_block())
+
+    async def slow_transform_does_not_block(self):
+        def transform(message):
+            if message.segment_string('PID') is not None:
+                time.sleep(0.5)
+            return message
+        server = HL7MLLPServer(transform)
+        await server.start('127.0.0.1', 0)
+        try:
+            slow = asyncio.ensure_future(send(server.port, [self.txt]))
+            await asyncio.sleep(0.05)
+            start = time.perf_counter()
+            fast = await send(server.port, ['MSH|^~\\&|A|B|C|D|||ADT^A01|1|P|2.5'])
+            self.assertLess(time.perf_counter() - start, 0.3)
+            self.assertFalse(slow.done())
+            self.assertEqual(ack_code((await slow)[0]), 'AA')
+        finally:
+            await server.close()
+        self.assertEqual(ack_code(fast[0]), 'AA')
+
+    def test_oversized_downstream_ack(self):
+        asyncio.run(self.oversized_downstream_ack())
+
+    async def oversized_downstream_ack(self):
+        async def handle(reader, writer):
+            await read_frame(reader)
+            writer.write(frame(make_ack(self.txt) + '\rNTE|' + 'x' * 2048))
+            await writer.drain()
+            writer.close()
+        downstream = await asyncio.start_server(handle, '127.0.0.1', 0)
+        server = HL7MLLPServer(self.transform, ('127.0.0.1', downstream.sockets[0].getsockname()[1]), max_message_size=1024)
+        await server.start('127.0.0.1', 0)
+        try:
+            acks = await send(server.port, [self.txt])
+        finally:
+            await server.close()
+            downstream.close()
+            await downstream.wait_closed()
+        self.assertEqual(ack_code(acks[0]), 'AE')
+        self.assertIn('Invalid downstream acknowledgment', acks[0])
+
+    def test_downstream_unavailable(self):
+        asyncio.run(self.downstream_unavailable())
+
+    async def downstream_unavailable(self):
+        server = HL7MLLPServer(self.transform, ('127.0.0.1', 1), timeout=1)
+        await server.start('127.0.0.1', 0)
+        try:
+            acks = await send(server.port, [self.txt])
+        finally:
+            await server.close()
+        self.assertEqual(ack_code(acks[0]), 'AE')
+        self.assertIn('Downstream not available', acks[0])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -2,12 +2,24 @@
 Tests for hl7_transform.operations module.
 """
 import unittest
-from hl7_transform.operations import HL7Operation, GenerateCurrentDatetime, GenerateAplhanumericID, GenerateNumericID
+from hl7_transform.operations import HL7Operation, GenerateCurrentDatetime, GenerateAplhanumericID, GenerateNumericID, SetEndTime
 from hl7_transform.message import HL7Message
+from hl7_transform.mapping import HL7Mapping
+from hl7_transform.transform import HL7Transform
+from hl7_transform.field import HL7Field
 from contextlib import redirect_stderr
 import io
 
 
+def zoneinfo_available():
+    try:
+        from zoneinfo import ZoneInfo
+        ZoneInfo('Europe/Berlin')
+    except Exception:
+        return False
+    return True
+
+
 class TestHL7Operation(unittest.TestCase):
     def setUp(self):
         pass
@@ -37,11 +49,73 @@ class TestHL7Operation(unittest.TestCase):
         op = GenerateAplhanumericID([field], {})
         msg = HL7Message.from_file('hl7_transform/test/test_transform.hl7')
         res = op(msg)
-        self.assertIsNotNone(res)
+        self.assertRegex(res, '^[0-9a-f]{32}$')
+        self.assertEqual(len({op(msg) for _ in range(1000)}), 1000)
 
     def test_generatenumericid(self):
         field = 'NTE.4'
         op = GenerateNumericID([field], {})
         msg = HL7Message.from_file('hl7_transform/test/test_transform.hl7')
         res = op(msg)
-        self.assertTrue(0 <= int(res) <= 1e9)
+        self.assertRegex(res, '^[0-9]{9}$')
+        self.assertGreater(len({op(msg) for _ in range(100)}), 1)
+
+    def test_generated_values_per_message(self):
+        mapping = HL7Mapping.from_string('''[
+          {"target_field": "MSH.10", "operation": "generate_alphanumeric_id"},
+          {"target_field": "MSH.7", "operation": "generate_current_datetime"}
+        ]''')
+        transform = HL7Transform(mapping)
+        messages = [transform(HL7Message.from_file('hl7_transform/test/test_transform.hl7', 'native')) for _ in range(3)]
+        self.assertEqual(len({message[HL7Field('MSH.10')] for message in messages}), 3)
+        self.assertEqual(len(messages[0][HL7Field('MSH.7')]), 14)
+
+    def test_set_end_time(self):
+        self.assertEqual(SetEndTime.end_time('202005201615', '50'), '202005201705')
+        self.assertEqual(SetEndTime.end_time('20200520161530', '50'), '20200520170530')
+        self.assertEqual(SetEndTime.end_time('20200520161530.25+0200', '-20'), '20200520155530.25+0200')
+
+    def test_date_operations(self):
+        mapping = HL7Mapping.from_string('''[
+          {"target_field": "ZDT.1", "operation": "add_duration", "source_fields": ["SCH.11.4", "SCH.11.3"]},
+          {"target_field": "ZDT.2", "operation": "subtract_duration", "source_field": "SCH.11.4", "args": {"amount": 2, "unit": "days"}},
+          {"target_field": "ZDT.3", "operation": "convert_timezone", "source_field": "SCH.11.4",
+           "args": {"timezone": "UTC", "source_timezone": "+0200"}},
+          {"target_field": "ZDT.4", "operation": "convert_timezone", "source_field": "ZDT.3", "args": {"timezone": "-0500"}},
+          {"target_field": "ZDT.5", "operation": "truncate_datetime", "source_field": "MSH.7", "args": {"precision": "hour"}},
+          {"target_field": "ZDT.6", "operation": "format_datetime", "source_field": "PID.7", "args": {"format": "%d.%m.%Y"}},
+          {"target_field": "ZDT.7", "operation": "compute_age", "source_fields": ["PID.7", "MSH.7"]},
+          {"target_field": "ZDT.8", "operation": "compute_age", "source_fields": ["PID.7", "MSH.7"], "args": {"unit": "months"}},
+          {"target_field": "ZDT.9", "operation": "compute_age", "source_fields": ["PID.7", "MSH.7"], "args": {"unit": "days"}}
+        ]''')
+        for parser in ('hl7apy', 'native'):
+            with self.subTest(parser=parser):
+                message = HL7Transform(mapping)(HL7Message.from_file('hl7_transform/test/test_msg.hl7', parser))
+                self.assertIn('ZDT|202005201705|202005181615|202005201415+0000|202005200915-0500|2020052215|01.01.1990|30|364|11099',
+                              message.to_string())
+
+    @unittest.skipUnless(zoneinfo_available(), 'needs zoneinfo and time zone data')
+    def test_convert_timezone_iana_names(self):
+        op = HL7Operation.from_name('convert_timezone', ['MSH.7'], {'timezone': 'Europe/Berlin'})
+        self.assertEqual(op.compute('20200520161530+0000'), '20200520181530+0200')
+        self.assertEqual(op.compute('20201220161530+0000'), '20201220171530+0100')
+        with self.assertRaises(ValueError):
+            HL7Operation.from_name('convert_timezone', ['MSH.7'], {'timezone': 'Mars/Olympus'})
+
+    def test_date_operation_arguments(self):
+        with self.assertRaises(RuntimeError):
+            HL7Operation.from_name('add_duration', ['SCH.11.4'], {})
+        with self.assertRaises(ValueError):
+            HL7Operation.from_name('truncate_datetime', ['SCH.11.4'], {'precision': 'week'})
+        with self.assertRaises(ValueError):
+            HL7Operation.from_name('truncate_datetime', ['TQ1.7'], {'precision': 'day', 'type': 'TM'})
+        op = HL7Operation.from_name('truncate_datetime', ['TQ1.7'], {'precision': 'minute', 'type': 'TM'})
+        self.assertEqual(op.compute('123015.1234+0100'), '1230+0100')
+        with self.assertRaises(ValueError):
+            HL7Operation.from_name('convert_timezone', ['SCH.11.4'], {'timezone': '+01'})
+        op = HL7Operation.from_name('convert_timezone', ['SCH.11.4'], {'timezone': 'UTC'})
+        with self.assertRaises(ValueError):
+            op.compute('202005201615')
+        self.assertFalse(HL7Operation.from_name('compute_age', ['PID.7'], {}).deterministic)
+        self.assertTrue(HL7Operation.from_name('compute_age', ['PID.7', 'MSH.7'], {}).deterministic)
+        self.assertEqual(HL7Operation.from_name('add_duration', ['PV1.44'], {'amount': '90', 'type': 'TM'}).compute('2300'), '0030')
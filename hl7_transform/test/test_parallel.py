@@ -0,0 +1,40 @@
+"""
+Tests for hl7_transform.parallel module.
+"""
+import unittest
+from hl7_transform.message import _preloaded
+from hl7_transform.parallel import HL7ParallelTransform
+
+
+class TestHL7ParallelTransform(unittest.TestCase):
+    def setUp(self):
+        with open('hl7_transform/test/test_msg.hl7') as f:
+            self.txt = f.read().strip()
+        self.messages = [self.txt.replace('d051c31adcc460b5289f', str(i)) for i in range(10)]
+        self.messages[3] = 'MSH|'
+
+    def test_ordered(self):
+        transform = HL7ParallelTransform('hl7_transform/test/test_transform.json', workers=2, chunk_size=3)
+        results = list(transform(iter(self.messages)))
+        self.assertEqual([result.index for result in results], list(range(10)))
+        self.assertFalse(results[3].ok)
+        self.assertIn('encoding chars', results[3].error)
+        self.assertIn('|5|P|2.5.1', results[5].message)
+        self.assertIn('TQ1|', results[9].message)
+
+    def test_unordered_native(self):
+        transform = HL7ParallelTransform('hl7_transform/test/test_transform.json', parser='native', workers=2, chunk_size=2, ordered=False)
+        results = list(transform(self.messages))
+        self.assertEqual(sorted(result.index for result in results), list(range(10)))
+        self.assertEqual(sum(result.ok for result in results), 9)
+
+    def test_preload(self):
+        transform = HL7ParallelTransform('hl7_transform/test/test_transform.json', workers=2, chunk_size=3, preload=['2.5.1'])
+        results = list(transform(self.messages))
+        self.assertEqual(sum(result.ok for result in results), 9)
+        self.assertIn('|5|P|2.5.1', results[5].message)
+        self.assertIn(('2.5.1', 'tolerant'), _preloaded)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,151 @@
+"""
+Tests for hl7_transform.result_cache module.
+"""
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+from hl7_transform.field import HL7Field
+from hl7_transform.mapping import HL7Mapping
+from hl7_transform.message import HL7Message, parser_backend
+from hl7_transform.result_cache import HL7ResultCache, mapping_fingerprint
+from hl7_transform.transform import HL7Transform
+
+
+MAPPING = '''[
+  {"target_field": "MSH.9.3", "operation": "set_value", "args": {"value": "SIU_S12"}},
+  {"target_field": "TQ1.8", "operation": "add_values", "source_fields": ["SCH.11.4", "SCH.11.3"], "args": {"type": "int"}},
+  {"target_field": "ZZZ.1", "operation": "set_value", "args": {"value": "x"},
+   "when": {"field": "MSH.9.1", "equals": ["ADT", "ORU", "SIU", "MDM"]}},
+  {"target_field": "PID.8", "operation": "lookup_value", "source_field": "PID.8", "args": {"table": "%s", "default": "unknown"}}
+]'''
+
+FINGERPRINT_SCRIPT = '''
+import sys
+from hl7_transform.mapping import HL7Mapping
+from hl7_transform.result_cache import mapping_fingerprint
+print(mapping_fingerprint(step for rule in HL7Mapping.from_json(sys.argv[1]) for step in rule.items()))
+'''
+
+
+class TestHL7ResultCache(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.table_path = os.path.join(self.directory, 'sex.json')
+        with open(self.table_path, 'w') as f:
+            json.dump({'M': 'male', 'F': 'female'}, f)
+        self.mapping_path = os.path.join(self.directory, 'mapping.json')
+        with open(self.mapping_path, 'w') as f:
+            f.write(MAPPING % self.table_path)
+        self.mapping = HL7Mapping.from_json(self.mapping_path)
+        with open('hl7_transform/test/test_msg.hl7') as f:
+            self.txt = '\n'.join(segment for segment in f.read().splitlines() if segment)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_transform(self):
+        expected = HL7Transform(self.mapping)(HL7Message.from_string(self.txt, 'native')).to_string()
+        cache = HL7ResultCache()
+        transform = HL7Transform(self.mapping, result_cache=cache)
+        for parser in ('native', 'hl7apy'):
+            with self.subTest(parser=parser):
+                message = transform(HL7Message.from_string(self.txt, parser))
+                self.assertEqual(message[HL7Field('PID.8')], 'male')
+                # a hit modifies the message in place
+                message = HL7Message.from_string(self.txt, parser)
+                self.assertIs(transform(message), message)
+                self.assertEqual(message[HL7Field('PID.8')], 'male')
+                self.assertEqual(message.to_string(), transform(HL7Message.from_string(self.txt, parser)).to_string())
+                message = HL7Message.from_string(self.txt, parser)
+                transformed = transform(message, copy=True)
+                self.assertEqual(message.to_string(), HL7Message.from_string(self.txt, parser).to_string())
+                self.assertEqual(transformed[HL7Field('TQ1.8')], '202005201665')
+        self.assertEqual(message.to_string().count('ZZZ'), 0)
+        self.assertEqual(transformed.to_string().replace('\r', '\n'), expected)
+        self.assertEqual((cache.hits, cache.misses, cache.bypassed), (6, 2, 0))
+
+    def test_transform_string(self):
+        cache = HL7ResultCache()
+        transform = HL7Transform(self.mapping, result_cache=cache)
+        result = transform.transform_string(self.txt, 'native')
+        self.assertEqual(transform.transform_string(self.txt.replace('\n', '\r'), 'native'), result)
+        self.assertEqual(transform(HL7Message.from_string(self.txt, 'native')).to_string(), result)
+        self.assertEqual((cache.hits, cache.misses), (2, 1))
+        self.assertEqual(transform.transform_string(self.txt, 'native'), HL7Transform(self.mapping).transform_string(self.txt, 'native'))
+
+    def test_parsers_are_cached_separately(self):
+        # hl7apy drops the empty trailing component of OBR-16, the native parsers keep it
+        with open('hl7_transform/test/test_transform.hl7') as f:
+            txt = f.read().strip()
+        mapping = HL7Mapping.from_string('[{"target_field": "PID.8", "operation": "set_value", "args": {"value": "F"}}]')
+        expected = {parser: HL7Transform(mapping).transform_string(txt, parser) for parser in ('hl7apy', 'native')}
+        self.assertNotEqual(expected['hl7apy'], expected['native'])
+        cache = HL7ResultCache()
+        transform = HL7Transform(mapping, result_cache=cache)
+        for parser in ('hl7apy', 'native', 'lazy', 'hl7apy'):
+            with self.subTest(parser=parser):
+                self.assertEqual(transform.transform_string(txt, parser), expected[parser_backend(parser)])
+                self.assertEqual(transform(HL7Message.from_string(txt, parser)).to_string(), expected[parser_backend(parser)])
+        # messages parsed with hl7apy are keyed by their serialization, which differs from the text
+        self.assertEqual((cache.hits, cache.misses), (5, 3))
+
+    def test_non_deterministic_mappings_bypass_the_cache(self):
+        cache = HL7ResultCache()
+        transform = HL7Transform(HL7Mapping.from_json('hl7_transform/test/test_transform.json'), result_cache=cache)
+        self.assertIsNone(transform.fingerprint)
+        ids = {transform.transform_string(self.txt, 'native').splitlines()[-1] for _ in range(3)}
+        self.assertEqual(len(ids), 3)
+        self.assertEqual(cache.to_dict(), {'hits': 0, 'disk_hits': 0, 'misses': 0, 'bypassed': 3, 'size': 0, 'chars': 0})
+
+    def test_failed_messages_are_not_cached(self):
+        mapping = HL7Mapping.from_string('[{"target_field": "ZZZ.1", "operation": "copy_value", "source_field": "ZBE.1"}]')
+        cache = HL7ResultCache()
+        transform = HL7Transform(mapping, on_error='collect', result_cache=cache)
+        for _ in range(2):
+            transform.transform_string(self.txt, 'native')
+        self.assertEqual(len(transform.errors), 2)
+        self.assertEqual((cache.hits, cache.misses, len(cache)), (0, 2, 0))
+
+    def test_eviction(self):
+        cache = HL7ResultCache(maxsize=2)
+        for key in 'abc':
+            cache.put(key, key * 10)
+        self.assertIsNone(cache.get('a'))
+        self.assertEqual(cache.get('b'), 'b' * 10)
+        cache.put('d', 'd')
+        self.assertIsNone(cache.get('c'))
+        cache = HL7ResultCache(max_chars=25)
+        for key in 'abc':
+            cache.put(key, key * 10)
+        self.assertEqual((len(cache), cache.to_dict()['chars']), (2, 20))
+
+    def test_disk_cache(self):
+        cache_dir = os.path.join(self.directory, 'cache')
+        result = HL7Transform(self.mapping, result_cache=HL7ResultCache(cache_dir=cache_dir)).transform_string(self.txt, 'native')
+        self.assertEqual(len(os.listdir(cache_dir)), 1)
+        cache = HL7ResultCache(cache_dir=cache_dir)
+        self.assertEqual(HL7Transform(self.mapping, result_cache=cache).transform_string(self.txt, 'native'), result)
+        self.assertEqual((cache.hits, cache.disk_hits, cache.misses), (0, 1, 0))
+
+    def test_fingerprint(self):
+        steps = [step for rule in self.mapping for step in rule.items()]
+        fingerprint = mapping_fingerprint(steps)
+        self.assertNotEqual(mapping_fingerprint(steps[:-1]), fingerprint)
+        # the same in other processes
+        for seed in ('1', '2'):
+            output = subprocess.run([sys.executable, '-c', FINGERPRINT_SCRIPT, self.mapping_path], stdout=subprocess.PIPE,
+                                    env=dict(os.environ, PYTHONHASHSEED=seed), check=True).stdout
+            self.assertEqual(output.decode().strip(), fingerprint)
+        # and changes with the lookup table
+        with open(self.table_path, 'w') as f:
+            json.dump({'M': 'männlich', 'F': 'weiblich'}, f)
+        os.utime(self.table_path, ns=(0, 0))
+        self.assertNotEqual(mapping_fingerprint(step for rule in HL7Mapping.from_json(self.mapping_path) for step in rule.items()), fingerprint)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -2,9 +2,13 @@
 Tests for hl7_transform.transform module.
 """
 import unittest
+import io
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import redirect_stdout
 from hl7_transform.mapping import HL7Mapping
-from hl7_transform.transform import HL7Transform
+from hl7_transform.transform import HL7Transform, TransformError
 from hl7_transform.message import HL7Message
+from hl7_transform.metrics import HL7Metrics
 from hl7_transform.field import HL7Field
 
 
@@ -41,6 +45,105 @@ class TestHL7Transform(unittest.TestCase):
         self.assertEqual(message_transformed[HL7Field('ZBE.1.2')], 'MOVEMENT')
         self.assertTrue(int(message_transformed[HL7Field('ZBE.2')]))
 
+    def test_compile(self):
+        plan = self.transform.compile()
+        self.assertIs(plan, self.transform.plan)
+        self.assertEqual(len(plan), 13)
+        for _ in range(2):
+            message = plan(HL7Message.from_file('hl7_transform/test/test_msg.hl7'))
+            self.assertEqual(message[HL7Field('TQ1.9')], '202005201615 + 50')
+
+    def test_plan_reads_sources_once(self):
+        reads = []
+
+        class CountingMessage(HL7Message):
+            def __getitem__(self, index):
+                reads.append(index.name)
+                return HL7Message.__getitem__(self, index)
+
+        message = CountingMessage(self.message.hl7_message)
+        self.transform(message)
+        self.assertEqual(reads.count('SCH.11.4'), 1)
+        self.assertEqual(reads.count('SCH.11.3'), 1)
+
+    def test_plan_sequential_semantics(self):
+        mapping = HL7Mapping.from_string('''[
+          {"target_field": "SCH.11.4", "operation": "copy_value", "source_field": "SCH.11.3"},
+          {"target_field": "TQ1.7",    "operation": "copy_value", "source_field": "SCH.11.4"},
+          {"target_field": "TQ1.8",    "operation": "set_value",  "args": {"value": "1"}},
+          {"target_field": "TQ1.9",    "operation": "copy_value", "source_field": "TQ1.8"}
+        ]''')
+        message = HL7Transform(mapping)(self.message)
+        self.assertEqual(message[HL7Field('TQ1.7')], '50')
+        self.assertEqual(message[HL7Field('TQ1.9')], '1')
+
+    def test_error_raise(self):
+        message = HL7Message.from_file('hl7_transform/test/test_transform.hl7')
+        s = io.StringIO()
+        with self.assertRaises(TransformError) as context, redirect_stdout(s):
+            self.transform(message)
+        self.assertEqual(s.getvalue(), '')
+        error = context.exception
+        self.assertIsInstance(error, RuntimeError)
+        self.assertEqual(error.rule, 2)
+        self.assertEqual(error.target_field.name, 'TQ1.7')
+        self.assertIsInstance(error.reason, KeyError)
+        self.assertEqual(error.excerpt(20), 'MSH|^~\\&|GHH LAB|ELA...')
+        # rules before the failed one have been applied
+        self.assertEqual(message[HL7Field('MSH.9.3')], 'SIU_S12')
+
+    def test_error_collect(self):
+        transform = HL7Transform(HL7Mapping.from_json('hl7_transform/test/test_transform.json'), on_error='collect', max_errors=3)
+        message = transform(HL7Message.from_file('hl7_transform/test/test_transform.hl7'))
+        self.assertEqual(message[HL7Field('ZBE.1.2')], 'MOVEMENT')
+        with self.assertRaises(KeyError):
+            message[HL7Field('TQ1.7')]
+        self.assertEqual([error.target_field.name for error in transform.errors], ['TQ1.8', 'TQ1.9', 'SCH.9'])
+
+    def test_error_log(self):
+        transform = HL7Transform(HL7Mapping.from_json('hl7_transform/test/test_transform.json'), on_error='log')
+        with self.assertLogs('hl7_transform', level='WARNING') as logs:
+            transform(HL7Message.from_file('hl7_transform/test/test_transform.hl7'))
+        self.assertEqual(len(logs.output), 4)
+        self.assertIn('Rule 2 (<CopyValue>) skipped in message MSH|', logs.output[0])
+        self.assertNotIn('PID|', logs.output[0])
+
+    def test_error_callback(self):
+        errors = []
+        transform = HL7Transform(HL7Mapping.from_json('hl7_transform/test/test_transform.json'), on_error=errors.append)
+        transform(HL7Message.from_file('hl7_transform/test/test_transform.hl7'))
+        self.assertEqual(len(errors), 4)
+        with self.assertRaises(ValueError):
+            HL7Transform(HL7Mapping.from_json('hl7_transform/test/test_transform.json'), on_error='ignore')
+
+    def test_copy(self):
+        for parser in ('hl7apy', 'native'):
+            with self.subTest(parser=parser):
+                message = HL7Message.from_file('hl7_transform/test/test_msg.hl7', parser)
+                original = message.to_string()
+                transformed = self.transform(message, copy=True)
+                self.assertIsNot(transformed, message)
+                self.assertEqual(message.to_string(), original)
+                self.assertEqual(transformed[HL7Field('TQ1.9')], '202005201615 + 50')
+
+    def test_concurrent_use(self):
+        metrics = HL7Metrics()
+        transform = HL7Transform(HL7Mapping.from_json('hl7_transform/test/test_transform.json'), metrics=metrics)
+        shared = HL7Message.from_file('hl7_transform/test/test_msg.hl7', 'native')
+        original = shared.to_string()
+
+        def transform_message(i):
+            message = transform(shared, copy=True) if i % 2 else transform(HL7Message.from_string(original, 'native'))
+            return message[HL7Field('ZBE.1.1')], message[HL7Field('TQ1.9')]
+
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            results = list(executor.map(transform_message, range(400)))
+        self.assertEqual(shared.to_string(), original)
+        self.assertEqual({result[1] for result in results}, {'202005201615 + 50'})
+        self.assertTrue(all(len(result[0]) == 9 for result in results))
+        self.assertEqual(metrics.to_dict()['stages']['transform']['calls'], 400)
+        self.assertEqual(metrics.to_dict()['rules']['TQ1.9']['calls'], 400)
+
 
 if __name__ == '__main__':
     unittest.main()
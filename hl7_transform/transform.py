@@ -1,6 +1,21 @@
 """
 This file contains the transformation class.
 """
+import logging
+import threading
+from collections import Counter, deque
+from time import perf_counter
+from hl7_transform.conditions import Conditional, SKIP
+from hl7_transform.message import HL7Message, parser_backend
+from hl7_transform.result_cache import is_deterministic, mapping_fingerprint
+
+
+logger = logging.getLogger('hl7_transform')
+
+ERRORS = (IndexError, KeyError, ValueError)
+"""Exceptions raised by a rule that are handled according to the error policy of a transform."""
+
+ERROR_POLICIES = ('raise', 'collect', 'log')
 
 
 class HL7Transform:
@@ -8,31 +23,421 @@ class HL7Transform:
     The transformation class that applies an :class:`HL7Mapping` to
     an :class:`HL7Message`.
     """
-    def __init__(self, mapping):
+    def __init__(self, mapping, metrics=None, on_error='raise', max_errors=1000, result_cache=None):
         """
         :param mapping: A dictionary that contains field mappings.
+        :param metrics: An optional :class:`HL7Metrics` that records timings
+            and counters per rule and per operation class.
+        :param on_error: What to do when a rule fails with a :class:`TransformError`:
+
+            - raise:    stop and raise the error (default),
+            - collect:  skip the rule and append the error to :attr:`errors`,
+            - log:      skip the rule and log a warning to the `hl7_transform` logger,
+            - a callable that receives the error, it can raise to stop the transformation.
+
+        :param max_errors: Number of most recent errors kept in :attr:`errors`.
+        :param result_cache: An optional :class:`HL7ResultCache`. Messages that
+            were transformed before are not transformed again, unless the mapping
+            contains operations that are not deterministic, see :attr:`HL7Operation.deterministic`.
+            Results of messages with failed rules are not cached, and cached
+            results are not recorded in the metrics.
+
+        The mapping is compiled into an :class:`HL7TransformPlan` once,
+        later modifications of the mapping require calling :meth:`compile` again.
+        Rules with conditions on the message type are compiled into one plan
+        per message type, see :class:`HL7RoutedPlan`.
+
+        A transform can be shared by several threads: plans and operations
+        are not modified after compilation, the state of a call is kept in
+        a :class:`PlanReader` per call, and the :class:`HL7Metrics`, the
+        collected errors and the generated IDs are thread-safe.
+        Messages must not be shared between threads while they are transformed,
+        use ``copy=True`` to transform a shared message.
         """
         self.mapping = mapping
+        self.metrics = metrics
+        self.result_cache = result_cache
+        self.errors = deque(maxlen=max_errors)
+        if on_error == 'raise':
+            self.on_error = raise_error
+        elif on_error == 'collect':
+            self.on_error = self.errors.append
+        elif on_error == 'log':
+            self.on_error = log_error
+        elif callable(on_error):
+            self.on_error = on_error
+        else:
+            raise ValueError('Unsupported error policy {}. Currently supported are: {} or a callable.'.format(on_error, ', '.join(ERROR_POLICIES)))
+        self.plan = self.compile()
+
+    def compile(self):
+        """
+        Compiles the mapping into a plan that can be applied to many messages.
+
+        :return: An :class:`HL7TransformPlan` or an :class:`HL7RoutedPlan`, also stored as `self.plan`.
+        """
+        steps = []
+        for mapping in self.mapping:
+            for target_field, operation in mapping.items():
+                steps.append((target_field, operation))
+        on_error = self.on_error
+        self.fingerprint = None
+        if self.result_cache is not None and is_deterministic(steps):
+            # the fingerprint of a mapping, or None if its results are not cached
+            self.fingerprint = mapping_fingerprint(steps)
+            self._call = threading.local()
+            on_error = self._uncached_error
+        self.plan = HL7RoutedPlan.from_steps(steps, self.metrics, on_error)
+        if self.plan is None:
+            self.plan = HL7TransformPlan(steps, self.metrics, on_error)
+        return self.plan
+
+    def _uncached_error(self, error):
+        self._call.failed = True
+        self.on_error(error)
 
     def execute(self, message):
         from warnings import warn
         warn("This function is deprecated. Use __call__ instead.")
         return self(message)
 
-    def __call__(self, message):
+    def __call__(self, message, copy=False):
         """
         Applies the transformation to an HL7 message and outputs the
         transformed message both as the return value and
         by modifying the input message.
 
         :param message: Applies the transformation to this message.
-        :return: The transformed copy of the input message.
+        :param copy: If True, the input message is left unchanged and a
+            transformed copy is returned, see :meth:`HL7Message.copy`.
+            Copies of natively parsed messages only copy the modified segments.
+        :return: The transformed message.
+        :raises TransformError: If a rule fails and the error policy is raise.
         """
-        for mapping in self.mapping:
-            for target_field, operation in mapping.items():
+        if self.fingerprint is not None:
+            return self._call_cached(message, copy)
+        if self.result_cache is not None:
+            self.result_cache.bypass()
+        if copy:
+            message = message.copy()
+        return self.plan(message)
+
+    def _call_cached(self, message, copy):
+        key = self.result_cache.key(self.fingerprint, message.to_string(), message.backend)
+        txt = self.result_cache.get(key)
+        if txt is None:
+            if copy:
+                message = message.copy()
+            self._call.failed = False
+            message = self.plan(message)
+            if not self._call.failed:
+                self.result_cache.put(key, message.to_string())
+            return message
+        result = message.parsed_like(txt)
+        if copy:
+            return result
+        message.hl7_message = result.hl7_message
+        message.invalidate_index()
+        return message
+
+    def transform_string(self, txt, parser='hl7apy'):
+        """
+        Parses a message, applies the transformation and serializes the result.
+        With a result cache, a message that was transformed before is not parsed.
+
+        :param parser: The parser backend, see :meth:`HL7Message.from_string`.
+        :return: The transformed message as a string, with segments separated by line feeds.
+        """
+        if self.fingerprint is None:
+            return self(HL7Message.from_string(txt, parser)).to_string()
+        key = self.result_cache.key(self.fingerprint, txt, parser_backend(parser))
+        result = self.result_cache.get(key)
+        if result is None:
+            self._call.failed = False
+            result = self.plan(HL7Message.from_string(txt, parser)).to_string()
+            if not self._call.failed:
+                self.result_cache.put(key, result)
+        return result
+
+
+class TransformError(RuntimeError):
+    """
+    Describes a mapping rule that failed on a message.
+    """
+    def __init__(self, rule, target_field, operation, reason, message):
+        """
+        :param rule: Index of the failed rule in the plan.
+        :param target_field: The target :class:`HL7Field` of the rule.
+        :param operation: The :class:`HL7Operation` of the rule.
+        :param reason: The exception raised by the rule.
+        :param message: The message the rule was applied to.
+        """
+        RuntimeError.__init__(self, "Error occurred during processing of {}. Reason: {}".format(target_field, str(reason)))
+        self.rule = rule
+        self.target_field = target_field
+        self.operation = operation
+        self.reason = reason
+        self.message = message
+
+    def excerpt(self, max_length=120):
+        """
+        Renders the beginning of the MSH segment of the message, which identifies
+        the message without exposing patient data from other segments.
+        """
+        segment = self.message.segment_string('MSH') or ''
+        if len(segment) > max_length:
+            return segment[:max_length] + '...'
+        return segment
+
+
+class MessageExcerpt:
+    """
+    Renders the excerpt of a :class:`TransformError` only when converted to a string,
+    e.g. when a log record is actually emitted.
+    """
+    def __init__(self, error):
+        self.error = error
+
+    def __str__(self):
+        return self.error.excerpt()
+
+
+def raise_error(error):
+    raise error
+
+
+def log_error(error):
+    logger.warning('%s Rule %d (%s) skipped in message %s', error, error.rule, error.operation, MessageExcerpt(error))
+
+
+class HL7TransformPlan:
+    """
+    A compiled mapping: the flat tuple of (target field, operation) steps
+    of an :class:`HL7Mapping`, executed in order. Plans are not modified
+    during execution and can be executed by several threads at once.
+
+    During execution, every source field is read from the message only once
+    and served from a cache to later steps, until a step writes into its segment.
+    Writes are buffered and applied in step order, at the latest
+    before a later step reads from a segment with pending writes,
+    so every step sees the results of the steps before it.
+    """
+    def __init__(self, steps, metrics=None, on_error=raise_error, rules=None):
+        """
+        :param steps: A list of (:class:`HL7Field`, :class:`HL7Operation`) tuples.
+        :param metrics: An optional :class:`HL7Metrics`.
+        :param on_error: A callable that handles a :class:`TransformError`.
+        :param rules: The index of every step in the mapping, reported in errors.
+            Defaults to the index in `steps`.
+        """
+        self.steps = tuple(steps)
+        self.metrics = metrics
+        self.on_error = on_error
+        self.rules = tuple(rules) if rules is not None else range(len(steps))
+
+    def __len__(self):
+        return len(self.steps)
+
+    def select(self, message):
+        """
+        Returns the plan that applies to a message, see :meth:`HL7RoutedPlan.select`.
+        """
+        return self
+
+    def __call__(self, message):
+        """
+        Applies the plan to an HL7 message, modifying the message.
+
+        :return: The modified message.
+        """
+        if self.metrics is not None:
+            return self._call_instrumented(message)
+        reader = PlanReader(self, message)
+        for rule, (target_field, operation) in enumerate(self.steps):
+            try:
+                value = operation(reader)
+            except ERRORS as e:
+                reader.fail(rule, e)
+                continue
+            if value is not SKIP:
+                reader.write(rule, target_field, value)
+        reader.flush()
+        return message
+
+    def _call_instrumented(self, message):
+        metrics = self.metrics
+        start_call = perf_counter()
+        reader = PlanReader(self, message, metrics)
+        try:
+            for rule, (target_field, operation) in enumerate(self.steps):
+                start = perf_counter()
+                flush_seconds = reader.flush_seconds
                 try:
-                    message[target_field] = operation(message)
-                except (IndexError, KeyError) as e:
-                    print(message.to_string())
-                    raise RuntimeError("Error occurred during processing of {}. Reason: {}".format(target_field, str(e)))
+                    value = operation(reader)
+                except ERRORS as e:
+                    metrics.record_rule(target_field, operation, perf_counter() - start - (reader.flush_seconds - flush_seconds), error=True)
+                    reader.fail(rule, e)
+                    continue
+                metrics.record_rule(target_field, operation, perf_counter() - start - (reader.flush_seconds - flush_seconds))
+                if value is not SKIP:
+                    reader.write(rule, target_field, value)
+            reader.flush()
+        except BaseException:
+            metrics.record_stage('transform', perf_counter() - start_call, error=True)
+            raise
+        metrics.record_stage('transform', perf_counter() - start_call)
         return message
+
+
+class HL7RoutedPlan:
+    """
+    A compiled mapping that dispatches every message to a plan by the value
+    of a routing field, e.g. the message type in MSH.9.1.
+
+    The routing field is the field most rules compare with an ``equals``
+    condition. For every compared value, a plan is precomputed that only
+    contains the rules whose conditions can be fulfilled for that value,
+    with the conditions on the routing field removed. Messages with other
+    values are transformed by a default plan. Routing thus replaces a
+    condition check per rule by one dictionary lookup per message.
+    """
+    def __init__(self, field, plans, default):
+        """
+        :param field: The routing :class:`HL7Field`.
+        :param plans: A dictionary of :class:`HL7TransformPlan` by value of the routing field.
+        :param default: The :class:`HL7TransformPlan` for other values.
+        """
+        self.field = field
+        self.plans = plans
+        self.default = default
+
+    @property
+    def steps(self):
+        return self.default.steps
+
+    @property
+    def on_error(self):
+        return self.default.on_error
+
+    def __len__(self):
+        return len(self.default)
+
+    def select(self, message):
+        """
+        Returns the plan that applies to a message.
+        """
+        try:
+            value = message[self.field]
+        except ERRORS:
+            return self.default
+        return self.plans.get(value, self.default)
+
+    def __call__(self, message):
+        return self.select(message)(message)
+
+    @staticmethod
+    def from_steps(steps, metrics=None, on_error=raise_error):
+        """
+        Compiles mapping steps into a routed plan.
+
+        :return: An :class:`HL7RoutedPlan`, None if no rule has an ``equals``
+            condition or if a rule writes into the routing field.
+        """
+        fields = Counter()
+        for target_field, operation in steps:
+            if isinstance(operation, Conditional):
+                fields.update(set(operation.condition.equals_fields()))
+        if not fields:
+            return None
+        field = fields.most_common(1)[0][0]
+        for target_field, operation in steps:
+            if (target_field.segment, target_field.field) == (field.segment, field.field):
+                return None
+        values = set()
+        for target_field, operation in steps:
+            if isinstance(operation, Conditional):
+                values.update(operation.condition.compared_values(field))
+        plans = {value: restrict_plan(steps, field, value, metrics, on_error) for value in values}
+        return HL7RoutedPlan(field, plans, restrict_plan(steps, field, None, metrics, on_error))
+
+
+def restrict_plan(steps, field, value, metrics, on_error):
+    """
+    Creates the plan of the steps that apply to messages whose `field` has the given value.
+    """
+    restricted_steps = []
+    rules = []
+    for rule, (target_field, operation) in enumerate(steps):
+        if isinstance(operation, Conditional):
+            condition = operation.condition.restrict(field, value)
+            if condition is False:
+                continue
+            if condition is True:
+                operation = operation.operation
+            elif condition is not operation.condition:
+                operation = Conditional(operation.operation, condition)
+        restricted_steps.append((target_field, operation))
+        rules.append(rule)
+    return HL7TransformPlan(restricted_steps, metrics, on_error, rules)
+
+
+class PlanReader:
+    """
+    The view of a message that operations read from during execution of
+    an :class:`HL7TransformPlan`. Caches read values and buffers writes
+    until a segment with buffered writes is read.
+    """
+    def __init__(self, plan, message, metrics=None):
+        self.plan = plan
+        self.message = message
+        self.metrics = metrics
+        self.values = {}
+        self.pending = []
+        self.pending_segments = set()
+        self.flush_seconds = 0.
+
+    def __getitem__(self, field):
+        if field.segment in self.pending_segments:
+            self.flush()
+        values = self.values.setdefault(field.segment, {})
+        try:
+            return values[field.name]
+        except KeyError:
+            value = values[field.name] = self.message[field]
+            return value
+
+    def write(self, rule, field, value):
+        self.pending.append((rule, field, value))
+        self.pending_segments.add(field.segment)
+
+    def flush(self):
+        """
+        Writes the pending values into the message, in rule order.
+        """
+        pending, self.pending = self.pending, []
+        for segment in self.pending_segments:
+            self.values.pop(segment, None)
+        self.pending_segments = set()
+        metrics = self.metrics
+        for rule, field, value in pending:
+            if metrics is not None:
+                start = perf_counter()
+            try:
+                self.message[field] = value
+            except ERRORS as e:
+                self.fail(rule, e)
+                continue
+            if metrics is not None:
+                seconds = perf_counter() - start
+                metrics.record_write(field, seconds)
+                self.flush_seconds += seconds
+
+    def fail(self, rule, reason):
+        """
+        Applies the pending writes and passes the error of a failed rule
+        to the error handler of the plan.
+        """
+        if self.pending:
+            self.flush()
+        target_field, operation = self.plan.steps[rule]
+        self.plan.on_error(TransformError(self.plan.rules[rule], target_field, operation, reason, self.message))
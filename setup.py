@@ -21,7 +21,7 @@ setup(
   url = f'https://github.com/{account_name}/hl7_transform',
   download_url = f'https://github.com/{account_name}/hl7_transform/archive/v.{version}.tar.gz',
   keywords = ['HL7', 'hospital IT', 'infrastructure', 'message', 'transform'],
-  python_requires='>=3',
+  python_requires='>=3.7',
   install_requires=['hl7apy',],
   classifiers=[
     'Development Status :: 4 - Beta',
@@ -32,9 +32,6 @@ setup(
     'Intended Audience :: Telecommunications Industry',
     'License :: OSI Approved :: MIT License',
     'Programming Language :: Python :: 3',
-    'Programming Language :: Python :: 3.4',
-    'Programming Language :: Python :: 3.5',
-    'Programming Language :: Python :: 3.6',
     'Programming Language :: Python :: 3.7',
     'Programming Language :: Python :: 3.8',
     'Programming Language :: Python :: 3.9',